@@ -8,7 +8,7 @@ same for the Resource List Archive, Change List Archive,
 Resource Dump Archive, and Change Dump Archive.
 """
 
-from resync.list_base_with_index import ListBaseWithIndex
+from resync.list_base_with_index import ListBaseWithIndex, in_time_window
 
 
 
@@ -33,6 +33,15 @@ class ChangeListArchive(ListBaseWithIndex):
               resources=resources, md=md, ln=ln, uri=uri,
               capability_name='changelist-archive')
 
+    def uris_in_time_window(self, from_timestamp=None, until_timestamp=None):
+        """URIs of the Change Lists that may list changes in the time window
+
+        Uses the md_from and md_until of each Change List, see
+        in_time_window().
+        """
+        return([r.uri for r in self
+                if in_time_window(r, from_timestamp, until_timestamp)])
+
 
 class ResourceDumpArchive(ListBaseWithIndex):
     """Class representing an Resource Dump Archive"""
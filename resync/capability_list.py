@@ -5,7 +5,7 @@ each capability. The Capability List object may also contain metadata
 and links like other lists.
 """
 
-import collections
+import collections.abc
 
 from resync.resource import Resource
 from resync.resource_set import ResourceSet
@@ -82,7 +82,7 @@ class CapabilityList(ListBase):
         Will throw a ValueError if the resource (ie. same uri) already
         exists in the capability_list, unless replace=True.
         """
-        if isinstance(resource, collections.Iterable):
+        if isinstance(resource, collections.abc.Iterable):
             for r in resource:
                 self.resources.add(r, replace)
         else:
@@ -0,0 +1,336 @@
+"""Watch local files and write a Change List as changes happen
+
+Rather than rescanning the disk and comparing with a reference
+Resource List every few minutes, ChangeListWatcher records changes
+as they happen and appends them to a Change List:
+
+    rlb = IncrementalResourceListBuilder('/var/lib/resync/scan.sqlite',
+                                         mapper=mapper)
+    watcher = ChangeListWatcher(rlb, '/var/www/rs/changelist.xml')
+    watcher.run()
+
+On Linux inotify is used to learn which directories have changed and
+only those are listed again, using IncrementalResourceListBuilder
+which keeps the state needed to tell created, updated and deleted
+resources apart. Elsewhere, or if inotify cannot be used, the whole
+tree is scanned incrementally every poll_interval seconds. In either
+case the cost of each update does not depend on the size of the tree.
+
+The Change List is written with a ChangeListWriter as a sitemapindex
+(at basename) and a set of segments, each holding at most
+max_sitemap_entries entries and, if segment_window is set, the changes
+from at most segment_window seconds. New entries go into the last
+segment which is rewritten and closed segments are never written
+again. Both the index and the segments must be within the mapper's
+paths so that they have URIs. On restart the watcher reads the existing
+index and continues to append to the last segment.
+"""
+
+import ctypes
+import ctypes.util
+import logging
+import os
+import os.path
+import re
+import select
+import struct
+import time
+
+from resync.change_list_writer import ChangeListWriter
+
+# Event masks from <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_MOVE_SELF = 0x00000800
+IN_Q_OVERFLOW = 0x00004000
+IN_IGNORED = 0x00008000
+IN_ONLYDIR = 0x01000000
+IN_ISDIR = 0x40000000
+IN_CLOEXEC = 0o2000000
+WATCH_MASK = (IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO |
+              IN_CREATE | IN_DELETE | IN_DELETE_SELF | IN_MOVE_SELF |
+              IN_ONLYDIR)
+EVENT_HEADER = struct.Struct('iIII')
+
+
+class InotifyError(Exception):
+    pass
+
+
+class Inotify(object):
+    """Minimal wrapper for the Linux inotify API using ctypes
+
+    Raises InotifyError if inotify is not available.
+    """
+
+    def __init__(self):
+        try:
+            libc = ctypes.CDLL(ctypes.util.find_library('c'), use_errno=True)
+            self._add_watch = libc.inotify_add_watch
+            fd = libc.inotify_init1(IN_CLOEXEC)
+        except (OSError, AttributeError) as e:
+            raise InotifyError("inotify not available (%s)" % str(e))
+        if (fd < 0):
+            raise InotifyError("inotify_init1 failed (%s)" %
+                               os.strerror(ctypes.get_errno()))
+        self._add_watch.argtypes = [ctypes.c_int, ctypes.c_char_p,
+                                    ctypes.c_uint32]
+        self.fd = fd
+
+    def add_watch(self, path, mask=WATCH_MASK):
+        """Add watch for path, returns the watch descriptor"""
+        wd = self._add_watch(self.fd, os.fsencode(path), mask)
+        if (wd < 0):
+            errno = ctypes.get_errno()
+            raise OSError(errno, os.strerror(errno), path)
+        return(wd)
+
+    def read_events(self, timeout=None):
+        """Return list of (wd, mask, name) events
+
+        Waits up to timeout seconds (for ever if None) for events and
+        returns an empty list if there are none.
+        """
+        (readable, _, _) = select.select([self.fd], [], [], timeout)
+        if (not readable):
+            return([])
+        data = os.read(self.fd, 65536)
+        events = []
+        pos = 0
+        while (pos < len(data)):
+            (wd, mask, cookie, length) = EVENT_HEADER.unpack_from(data, pos)
+            pos += EVENT_HEADER.size
+            name = os.fsdecode(data[pos:pos + length].rstrip(b'\0'))
+            pos += length
+            events.append((wd, mask, name))
+        return(events)
+
+    def close(self):
+        if (self.fd is not None):
+            os.close(self.fd)
+            self.fd = None
+
+
+class ChangeListWatcher(object):
+    """Watch files on disk and append changes to a Change List
+
+    builder - an IncrementalResourceListBuilder with the mapper, paths,
+        exclusions and state file to use
+
+    basename - file name for the Change List sitemapindex, segments
+        are named from this as by ListBaseWithIndex.part_name()
+
+    paths - the directories to watch, defaults to those of the builder's
+        mapper
+
+    use_inotify - set False to always poll
+
+    poll_interval - seconds between scans when polling
+
+    settle_time - with inotify, changes are processed once there have
+        been no events for this many seconds, or max_delay seconds after
+        the first unprocessed event
+
+    segment_window - seconds after which a segment of the Change List
+        is closed, as for ChangeListWriter
+    """
+
+    def __init__(self, builder, basename, paths=None, use_inotify=True,
+                 poll_interval=60.0, settle_time=1.0, max_delay=10.0,
+                 segment_window=None):
+        self.builder = builder
+        self.mapper = builder.mapper
+        self.basename = basename
+        self.paths = paths
+        if (self.paths is None):
+            self.paths = [m.dst_path for m in self.mapper.mappings]
+        self.use_inotify = use_inotify
+        self.poll_interval = poll_interval
+        self.settle_time = settle_time
+        self.max_delay = max_delay
+        self.writer = ChangeListWriter(basename, self.mapper,
+                                       segment_window=segment_window)
+        self.logger = logging.getLogger('resync.change_list_watcher')
+        self.inotify = None
+        self.watches = {}
+        self.dirty = set()
+        self.dirty_since = None
+        self.stopped = False
+
+    # #### Watching #####
+
+    def start(self):
+        """Catch up with changes since the last run and set up watches"""
+        self.writer.read_index()
+        # Don't report the Change List files as changes
+        (prefix, suffix) = os.path.splitext(os.path.basename(self.basename))
+        self.builder.exclude_files.append(
+            re.escape(prefix) + r"(\d{5})?" + re.escape(suffix) + "$")
+        self.builder.compile_excludes()
+        if (self.use_inotify):
+            try:
+                self.inotify = Inotify()
+            except InotifyError as e:
+                self.logger.warning("%s, will poll every %.1fs" %
+                                    (str(e), self.poll_interval))
+        if (self.inotify is not None):
+            for path in self.paths:
+                self.watch_tree(path)
+        # Watches are in place so any change from now on will be seen
+        (_, change_list) = self.builder.scan(paths=self.paths,
+                                             build_resource_list=False,
+                                             commit=False)
+        self.record(change_list)
+
+    def run(self):
+        """Run until stop() is called"""
+        self.start()
+        try:
+            while (not self.stopped):
+                self.check()
+        finally:
+            self.close()
+
+    def stop(self):
+        self.stopped = True
+
+    def check(self, timeout=None):
+        """Wait for and record changes, returns the number recorded
+
+        With inotify, waits up to timeout (default settle_time) seconds
+        for events and processes the changed directories once events
+        have settled. Otherwise sleeps for timeout (default
+        poll_interval) seconds and then scans.
+        """
+        if (self.inotify is None):
+            time.sleep(self.poll_interval if timeout is None else timeout)
+            (_, change_list) = self.builder.scan(paths=self.paths,
+                                                 build_resource_list=False,
+                                                 commit=False)
+            self.record(change_list)
+            return(len(change_list))
+        events = self.inotify.read_events(
+            self.settle_time if timeout is None else timeout)
+        for (wd, mask, name) in events:
+            self.handle_event(wd, mask, name)
+        if (len(self.dirty) == 0):
+            return(0)
+        if (len(events) > 0 and
+                time.time() - self.dirty_since < self.max_delay):
+            # wait for events to settle
+            return(0)
+        return(self.process_dirty())
+
+    def handle_event(self, wd, mask, name):
+        """Record the directory affected by one inotify event"""
+        if (mask & IN_Q_OVERFLOW):
+            # lost events, check everything
+            self.logger.warning("inotify queue overflow, will rescan")
+            self.mark_dirty(None)
+            return
+        dirpath = self.watches.get(wd)
+        if (mask & IN_IGNORED):
+            self.watches.pop(wd, None)
+            return
+        if (dirpath is None):
+            return
+        if (mask & (IN_DELETE_SELF | IN_MOVE_SELF)):
+            # reported via the parent directory
+            return
+        if ((mask & IN_ISDIR) and (mask & (IN_CREATE | IN_MOVED_TO))):
+            path = os.path.join(dirpath, name)
+            if (not self.builder.exclude_dir(path)):
+                # watch new directory before it is scanned
+                self.watch_tree(path)
+        self.mark_dirty(dirpath)
+
+    def mark_dirty(self, dirpath):
+        if (len(self.dirty) == 0):
+            self.dirty_since = time.time()
+        self.dirty.add(dirpath)
+
+    def process_dirty(self):
+        """Rescan the dirty directories and append changes"""
+        dirty = self.dirty
+        self.dirty = set()
+        if (None in dirty):
+            (_, change_list) = self.builder.scan(paths=self.paths,
+                                                 build_resource_list=False,
+                                                 commit=False)
+        else:
+            change_list = self.builder.rescan_dirs(dirty, commit=False)
+        try:
+            self.record(change_list)
+        except Exception:
+            # scan the same directories again next time
+            for dirpath in dirty:
+                self.mark_dirty(dirpath)
+            raise
+        return(len(change_list))
+
+    def watch_tree(self, path):
+        """Add inotify watches for path and all directories below"""
+        for (dirpath, dirs, files) in os.walk(path):
+            dirs[:] = [d for d in dirs if not
+                       self.builder.exclude_dir(os.path.join(dirpath, d))]
+            try:
+                wd = self.inotify.add_watch(dirpath)
+            except OSError as e:
+                self.logger.warning("Cannot watch %s (%s)" %
+                                    (dirpath, str(e)))
+                continue
+            self.watches[wd] = os.path.normpath(dirpath)
+
+    def close(self):
+        if (self.inotify is not None):
+            self.inotify.close()
+            self.inotify = None
+        self.builder.close()
+
+    # #### Change List output #####
+
+    @property
+    def max_sitemap_entries(self):
+        return(self.writer.max_sitemap_entries)
+
+    @max_sitemap_entries.setter
+    def max_sitemap_entries(self, max_sitemap_entries):
+        self.writer.max_sitemap_entries = max_sitemap_entries
+
+    @property
+    def pretty_xml(self):
+        return(self.writer.pretty_xml)
+
+    @pretty_xml.setter
+    def pretty_xml(self, pretty_xml):
+        self.writer.pretty_xml = pretty_xml
+
+    @property
+    def segments(self):
+        """Index entries for the segments of the Change List"""
+        return(self.writer.segments)
+
+    def append(self, change_list):
+        """Append resources in change_list and write the Change List"""
+        if (self.writer.append(change_list) > 0):
+            self.logger.info("Recorded %d changes" % (len(change_list)))
+
+    def record(self, change_list):
+        """Append change_list from a scan and then commit the scan state
+
+        If the Change List cannot be written then the scan state is
+        rolled back, and the Change List index read again, so that the
+        changes are found and written by a later scan.
+        """
+        try:
+            self.append(change_list)
+        except Exception:
+            self.builder.rollback()
+            self.writer.read_index()
+            raise
+        self.builder.commit()
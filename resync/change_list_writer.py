@@ -0,0 +1,192 @@
+"""Write a Change List as a sitemapindex of segments, appending changes
+
+Rewriting a whole Change List each time changes are added takes time
+in proportion to the history kept and means that clients can never
+cache any part of it. ChangeListWriter instead writes the Change List
+as a sitemapindex (at basename) and a set of component sitemaps, the
+segments, and only ever writes the last one:
+
+    writer = ChangeListWriter('/var/www/rs/changelist.xml', mapper,
+                              segment_window=86400)
+    writer.read_index()
+    writer.append(change_list)
+
+New entries go into the open segment, which is rewritten along with
+the sitemapindex. The open segment is closed once it holds
+max_sitemap_entries entries or, if segment_window is set, once it has
+been open for segment_window seconds, and a new segment is started for
+later entries. Closed segments are never written again.
+
+Each segment has md_from set to the time it was opened (the md_until of
+the previous segment) and, once closed, md_until set to the time it was
+closed. These are also given on the entries in the sitemapindex so that
+a client can pick out the segments that cover a period without reading
+the others.
+
+Both the sitemapindex and the segments must be within the mapper's
+paths so that they have URIs. read_index() reads an existing
+sitemapindex, and the open segment, to continue appending after a
+restart.
+"""
+
+import logging
+import os
+import os.path
+import time
+
+from resync.change_list import ChangeList
+from resync.list_base import ListBase
+from resync.resource import Resource
+from resync.sitemap import Sitemap
+from resync.utils import compute_md5_for_file
+from resync.w3c_datetime import datetime_to_str, str_to_datetime
+
+
+class ChangeListWriter(object):
+    """Append changes to a Change List written as segments
+
+    basename - file name for the Change List sitemapindex, segments are
+        named from this as by ListBaseWithIndex.part_name()
+
+    mapper - Mapper used to get URIs for the segment files
+
+    max_sitemap_entries - number of entries at which a segment is closed
+
+    segment_window - seconds after which a segment is closed, or None
+        to close segments only when full
+
+    ln - list of links (dicts as for ListBase.link_set()) to add to the
+        sitemapindex and new segments
+    """
+
+    def __init__(self, basename, mapper, max_sitemap_entries=50000,
+                 segment_window=None, ln=None):
+        self.basename = basename
+        self.mapper = mapper
+        self.max_sitemap_entries = max_sitemap_entries
+        self.segment_window = segment_window
+        self.ln = ln if (ln is not None) else []
+        self.pretty_xml = False
+        self.segments = []
+        self.segment = None
+        self.logger = logging.getLogger('resync.change_list_writer')
+
+    def read_index(self):
+        """Read the existing sitemapindex, if any, to continue appending
+
+        If the last segment listed is open (has no md_until) then it is
+        read so that new entries are added to it. A Change List with no
+        entries at basename, rather than a sitemapindex, is replaced.
+        """
+        self.segments = []
+        self.segment = None
+        if (os.path.exists(self.basename)):
+            index = ListBase()
+            s = Sitemap()
+            with open(self.basename, 'rb') as fh:
+                s.parse_xml(fh=fh, resources=index)
+            if (not s.parsed_index and len(index) > 0):
+                raise ValueError("%s is a Change List with entries but not "
+                                 "a sitemapindex so cannot be continued"
+                                 % (self.basename))
+            self.segments = [r for r in index]
+        if (len(self.segments) > 0 and self.segments[-1].md_until is None):
+            self.segment = ChangeList()
+            with open(self.mapper.src_to_dst(self.segments[-1].uri),
+                      'rb') as fh:
+                self.segment.parse(fh=fh)
+            if (self.segment.md_from is None):
+                self.segment.md_from = self.segments[-1].md_from
+        self.logger.debug("Read Change List index %s with %d segments"
+                          % (self.basename, len(self.segments)))
+
+    def segment_file(self, n):
+        """File name for segment n"""
+        return(ChangeList().part_name(self.basename, n))
+
+    def new_segment(self, md_from=None):
+        """Open a new segment
+
+        The new segment starts at the md_until of the last segment, or
+        for the first segment at md_from if given or else now.
+        """
+        if (len(self.segments) > 0 and
+                self.segments[-1].md_until is not None):
+            md_from = self.segments[-1].md_until
+        elif (md_from is None):
+            md_from = datetime_to_str()
+        self.segment = ChangeList(ln=list(self.ln))
+        self.segment.md_from = md_from
+        file = self.segment_file(len(self.segments))
+        uri = self.mapper.dst_to_src(file)
+        if (uri is None):
+            raise ValueError("Change List segment %s is not within the "
+                             "mapped paths so has no URI" % (file))
+        self.segments.append(Resource(uri=uri, md_from=md_from))
+
+    def close_segment(self, md_until=None):
+        """Close the open segment, setting md_until (default now)
+
+        The segment is written for the last time, along with the
+        sitemapindex.
+        """
+        if (self.segment is None):
+            return
+        self.segment.md_until = (md_until if (md_until is not None)
+                                 else datetime_to_str())
+        self.write_segment()
+        self.logger.info("Closed Change List segment %d with %d entries"
+                         % (len(self.segments) - 1, len(self.segment)))
+        self.segment = None
+
+    def segment_expired(self, now=None):
+        """True if the open segment has been open for segment_window"""
+        if (self.segment is None or self.segment_window is None):
+            return(False)
+        if (now is None):
+            now = time.time()
+        return(now - str_to_datetime(self.segment.md_from) >=
+               self.segment_window)
+
+    def append(self, change_list):
+        """Add the resources in change_list, returns the number added
+
+        Only the open segment and the sitemapindex are written. An empty
+        change_list still closes the open segment if it has expired.
+        """
+        if (self.segment_expired()):
+            self.close_segment()
+        if (len(change_list) == 0):
+            return(0)
+        for r in change_list:
+            if (self.segment is None):
+                self.new_segment(change_list.md_from)
+            elif (len(self.segment) >= self.max_sitemap_entries):
+                self.close_segment()
+                self.new_segment()
+            self.segment.add(r)
+        self.write_segment()
+        return(len(change_list))
+
+    def write_segment(self):
+        """Write the open segment and the sitemapindex"""
+        n = len(self.segments) - 1
+        file = self.segment_file(n)
+        self.segment.pretty_xml = self.pretty_xml
+        self.segment.max_sitemap_entries = self.max_sitemap_entries
+        self.segment.write(basename=file)
+        self.segments[n] = Resource(uri=self.segments[n].uri,
+                                    timestamp=os.stat(file).st_mtime,
+                                    md5=compute_md5_for_file(file),
+                                    md_from=self.segment.md_from,
+                                    md_until=self.segment.md_until)
+        self.write_index()
+
+    def write_index(self):
+        """Write the sitemapindex listing all segments"""
+        index = ListBase(self.segments, ln=list(self.ln))
+        index.sitemapindex = True
+        index.capability_name = 'changelist'
+        index.md_from = self.segments[0].md_from
+        index.pretty_xml = self.pretty_xml
+        index.write(basename=self.basename)
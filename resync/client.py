@@ -6,19 +6,26 @@ import os.path
 import distutils.dir_util
 import re
 import logging
+import time
 import requests
+from zipfile import BadZipFile
 
 from resync.resource_list_builder import ResourceListBuilder
-from resync.resource_list import ResourceList
+from resync.incremental_builder import IncrementalResourceListBuilder
+from resync.resource_list import ResourceList, ResourceListDict
 from resync.change_list import ChangeList
+from resync.change_dump import ChangeDump
+from resync.change_dump_manifest import ChangeDumpManifest
 from resync.capability_list import CapabilityList
 from resync.source_description import SourceDescription
 from resync.mapper import Mapper
 from resync.sitemap import Sitemap
-from resync.dump import Dump
+from resync.dump import Dump, DumpError
+from resync.dump_reader import DumpReader
+from resync.resource_dump import ResourceDump
 from resync.resource import Resource
 from resync.url_authority import UrlAuthority
-from resync.utils import compute_md5_for_file
+from resync.utils import compute_digests_for_file, DIGEST_ALGORITHMS
 from resync.client_state import ClientState
 from resync.list_base_with_index import ListBaseIndexError
 from resync.w3c_datetime import str_to_datetime, datetime_to_str
@@ -50,7 +57,13 @@ class Client(object):
         self.resource_list_name = 'resourcelist.xml'
         self.change_list_name = 'changelist.xml'
         self.dump_format = None
+        self.dump_workers = 1
+        self.dump_partition_method = 'sequential'
+        self.dump_compression_policy = None
+        # Seconds of changes in each Change Dump package, or None
+        self.dump_time_window = None
         self.exclude_patterns = []
+        self.exclude_globs = []
         self.sitemap_name = None
         self.allow_multifile = True
         self.noauth = False
@@ -58,6 +71,17 @@ class Client(object):
         self.max_sitemap_entries = None
         self.ignore_failures = False
         self.pretty_xml = True
+        # Number of threads to calculate checksums when building lists
+        self.checksum_workers = 1
+        # DigestCache used to avoid recalculating checksums, or None
+        self.digest_cache = None
+        # State file for incremental scans of local disk, or None
+        self.scan_state_file = None
+        # Storage class for resource lists, e.g. ResourceListSqlite
+        self.resources_class = ResourceListDict
+        # Resource Dump whose packages are used to get resources in a
+        # baseline sync, or None
+        self.resource_dump = None
         # Default file names
         self.status_file = '.resync-client-status.cfg'
         self.default_resource_dump = 'resourcedump.zip'
@@ -86,7 +110,7 @@ class Client(object):
             return(self.sitemap_name)
         return(self.sitemap_uri(self.resource_list_name))
 
-    def build_resource_list(self, paths=None, set_path=False):
+    def build_resource_list(self, paths=None, set_path=False, rlb=None):
         """Return a resource list for rs on local disk
 
         The set of rs is taken by disk scan from the paths specified or
@@ -98,6 +122,11 @@ class Client(object):
             included. This is used to build a resource list as the basis
             for creating a dump.
 
+        rlb - builder from resource_list_builder() to use. If it is an
+            IncrementalResourceListBuilder then the scan state is neither
+            committed nor closed, this is left to the caller so that the
+            state is only committed once the changes have been written.
+
         Return ResourceList. Uses existing self.mapper settings.
         """
         # 0. Sanity checks, parse paths is specified
@@ -107,11 +136,20 @@ class Client(object):
         if (paths is not None):
             # Expect comma separated list of paths
             paths = paths.split(',')
-        # 1. Build from disk
-        rlb = ResourceListBuilder(set_md5=self.checksum, mapper=self.mapper)
-        rlb.set_path = set_path
-        rlb.add_exclude_files(self.exclude_patterns)
-        rl = rlb.from_disk(paths=paths)
+        # 1. Build from disk, incrementally if there is a scan state
+        if (rlb is not None):
+            rlb.set_path = set_path
+            if (isinstance(rlb, IncrementalResourceListBuilder)):
+                (rl, _) = rlb.scan(paths=paths, commit=False)
+            else:
+                rl = rlb.from_disk(paths=paths)
+        elif (self.scan_state_file is not None):
+            rlb = self.resource_list_builder(set_path=set_path)
+            (rl, _) = rlb.scan(paths=paths)
+            rlb.close()
+        else:
+            rlb = self.resource_list_builder(set_path=set_path)
+            rl = rlb.from_disk(paths=paths)
         # 2. Set defaults and overrides
         rl.allow_multifile = self.allow_multifile
         rl.pretty_xml = self.pretty_xml
@@ -120,6 +158,27 @@ class Client(object):
             rl.max_sitemap_entries = self.max_sitemap_entries
         return(rl)
 
+    def resource_list_builder(self, set_path=None):
+        """Return builder for disk scans with the settings of this client
+
+        An IncrementalResourceListBuilder using self.scan_state_file if
+        set, else a ResourceListBuilder.
+        """
+        if (self.scan_state_file is not None):
+            rlb = IncrementalResourceListBuilder(
+                self.scan_state_file, set_md5=self.checksum,
+                mapper=self.mapper, resources_class=self.resources_class)
+        else:
+            rlb = ResourceListBuilder(set_md5=self.checksum,
+                                      mapper=self.mapper,
+                                      resources_class=self.resources_class)
+        rlb.set_path = set_path
+        rlb.checksum_workers = self.checksum_workers
+        rlb.digest_cache = self.digest_cache
+        rlb.add_exclude_files(self.exclude_patterns)
+        rlb.exclude_globs.extend(self.exclude_globs)
+        return(rlb)
+
     def log_event(self, change):
         """Log a Resource object as an event for automated analysis"""
         self.logger.debug("Event: " + repr(change))
@@ -145,7 +204,8 @@ class Client(object):
         try:
             self.logger.info("Reading sitemap %s" % (self.sitemap))
             src_resource_list = ResourceList(
-                allow_multifile=self.allow_multifile, mapper=self.mapper)
+                allow_multifile=self.allow_multifile, mapper=self.mapper,
+                resources_class=self.resources_class)
             src_resource_list.read(uri=self.sitemap)
             self.logger.debug("Finished reading sitemap")
         except Exception as e:
@@ -166,28 +226,48 @@ class Client(object):
                 "Not calculating checksums on destination as not "
                 "present in source resource list")
         # 1.b destination resource list mapped back to source URIs
-        rlb = ResourceListBuilder(set_md5=self.checksum, mapper=self.mapper)
+        rlb = ResourceListBuilder(set_md5=self.checksum, mapper=self.mapper,
+                                  resources_class=self.resources_class)
+        rlb.checksum_workers = self.checksum_workers
+        rlb.digest_cache = self.digest_cache
         dst_resource_list = rlb.from_disk()
-        # 2. Compare these resource lists respecting any comparison options
-        (same, updated, deleted, created) = dst_resource_list.compare(src_resource_list)
+        # 2. Compare these resource lists respecting any comparison options.
+        # Resources that are the same are only counted, and for an audit
+        # nothing is accumulated so memory use does not grow with list size
+        num_same = 0
+        num_changes = {'updated': 0, 'deleted': 0, 'created': 0}
+        changes = {'updated': [], 'deleted': [], 'created': []}
+        for (status, resource) in dst_resource_list.compare_iter(
+                src_resource_list, include_same=True):
+            if (status == 'same'):
+                num_same += 1
+            else:
+                num_changes[status] += 1
+                if (not audit_only):
+                    changes[status].append(resource)
+        updated = changes['updated']
+        deleted = changes['deleted']
+        created = changes['created']
         # 3. Report status and planned actions
-        self.log_status(in_sync=(len(updated) +
-                                 len(deleted) + len(created) == 0),
-                        audit=True, same=len(same), created=len(created),
-                        updated=len(updated), deleted=len(deleted))
+        self.log_status(in_sync=(sum(num_changes.values()) == 0),
+                        audit=True, same=num_same,
+                        created=num_changes['created'],
+                        updated=num_changes['updated'],
+                        deleted=num_changes['deleted'])
         if (audit_only or len(created) + len(updated) + len(deleted) == 0):
             self.logger.debug("Completed " + action)
             return
         # 4. Check that sitemap has authority over URIs listed
         if (not self.noauth):
             uauth = UrlAuthority(self.sitemap, strict=self.strictauth)
-            for resource in src_resource_list:
-                if (not uauth.has_authority_over(resource.uri)):
-                    raise ClientFatalError(
-                        "Aborting as sitemap (%s) mentions resource at a "
-                        "location it does not have authority over (%s), "
-                        "override with --noauth"
-                        "" % (self.sitemap, resource.uri))
+            bad_uri = next(uauth.without_authority(
+                resource.uri for resource in src_resource_list), None)
+            if (bad_uri is not None):
+                raise ClientFatalError(
+                    "Aborting as sitemap (%s) mentions resource at a "
+                    "location it does not have authority over (%s), "
+                    "override with --noauth"
+                    "" % (self.sitemap, bad_uri))
         # 5. Grab rs to do sync
         delete_msg = (", and delete %d resources" %
                       len(deleted)) if (allow_deletion) else ''
@@ -197,13 +277,24 @@ class Client(object):
         num_created = 0
         num_updated = 0
         num_deleted = 0
+        from_dump = set()
+        if (self.resource_dump is not None):
+            from_dump = self.update_from_resource_dump(
+                [(resource, 'created') for resource in created] +
+                [(resource, 'updated') for resource in updated])
         for resource in created:
             uri = resource.uri
+            if (uri in from_dump):
+                num_created += 1
+                continue
             filename = self.mapper.src_to_dst(uri)
             self.logger.info("created: %s -> %s" % (uri, filename))
             num_created += self.update_resource(resource, filename, 'created')
         for resource in updated:
             uri = resource.uri
+            if (uri in from_dump):
+                num_updated += 1
+                continue
             filename = self.mapper.src_to_dst(uri)
             self.logger.info("updated: %s -> %s" % (uri, filename))
             num_updated += self.update_resource(resource, filename, 'updated')
@@ -220,7 +311,7 @@ class Client(object):
         # 7. Done
         self.log_status(in_sync=(len(updated) + len(deleted) +
                                  len(created) == 0),
-                        same=len(same), created=num_created,
+                        same=num_same, created=num_created,
                         updated=num_updated, deleted=num_deleted,
                         to_delete=len(deleted))
         self.logger.debug("Completed %s" % (action))
@@ -264,7 +355,8 @@ class Client(object):
         try:
             self.logger.info("Reading change list %s" % (change_list))
             src_change_list = ChangeList()
-            src_change_list.read(uri=change_list)
+            src_change_list.read(uri=change_list,
+                                 from_timestamp=from_timestamp)
             self.logger.debug("Finished reading change list")
         except Exception as e:
             raise ClientFatalError(
@@ -294,15 +386,15 @@ class Client(object):
             uauth_cs = UrlAuthority(change_list, self.strictauth)
             if (not change_list_uri):
                 uauth_sm = UrlAuthority(self.sitemap)
-                for resource in src_change_list:
-                    if (not uauth_cs.has_authority_over(resource.uri) and
-                            (change_list_uri or
-                             not uauth_sm.has_authority_over(resource.uri))):
-                        raise ClientFatalError(
-                            "Aborting as change list (%s) mentions resource "
-                            "at a location it does not have authority over "
-                            "(%s), override with --noauth"
-                            "" % (change_list, resource.uri))
+                bad_uri = next(uauth_sm.without_authority(
+                    uauth_cs.without_authority(
+                        resource.uri for resource in src_change_list)), None)
+                if (bad_uri is not None):
+                    raise ClientFatalError(
+                        "Aborting as change list (%s) mentions resource "
+                        "at a location it does not have authority over "
+                        "(%s), override with --noauth"
+                        "" % (change_list, bad_uri))
         # 5. Prune entries before starting timestamp and dupe changes for a
         # resource
         num_skipped = src_change_list.prune_before(from_timestamp)
@@ -422,22 +514,133 @@ class Client(object):
                     self.last_timestamp = resource.timestamp
             self.log_event(Resource(resource=resource, change=change))
             # 3. sanity check
-
-            length = os.stat(filename).st_size
-            if (resource.length is None):
-                self.logger.warning("Caught flying None: " + str(resource))
-            elif (resource.length != length):
-                self.logger.warn("Downloaded size for %s of %d bytes does not "
-                                 "match expected %d bytes"
-                                 % (resource.uri, length, resource.length))
-            if (self.checksum and resource.md5 is not None):
-                file_md5 = compute_md5_for_file(filename)
-                if (resource.md5 != file_md5):
-                    self.logger.warn("MD5 mismatch for %s, got %s but expected"
-                                     " %s bytes" % (resource.uri, file_md5,
-                                                    resource.md5))
+            self.check_resource_file(resource, filename)
         return(num_updated)
 
+    def update_from_resource_dump(self, changes):
+        """Get resources from the packages of self.resource_dump
+
+        changes is a list of (resource, change) for the resources to get.
+        Each package of the Resource Dump is read remotely with a
+        DumpReader so that only the members needed are fetched, unless
+        they make up most of the package in which case it is fetched in
+        one request. Resources are only taken from a package if the
+        length, md5 and timestamp in its manifest, where given, match
+        those expected.
+
+        Returns the set of URIs of the resources updated. Others, and any
+        in packages that cannot be read, are left to be fetched
+        individually.
+        """
+        wanted = dict((resource.uri, (resource, change))
+                      for (resource, change) in changes)
+        done = set()
+        if (self.dryrun):
+            return(done)
+        try:
+            resource_dump = ResourceDump()
+            resource_dump.read(uri=self.resource_dump)
+        except Exception as e:
+            self.logger.warning("Can't read resource dump %s (%s), will GET "
+                                "resources individually"
+                                % (self.resource_dump, str(e)))
+            return(done)
+        for package in resource_dump:
+            if (len(done) == len(wanted)):
+                break
+            try:
+                reader = DumpReader(package.uri)
+            except (IOError, DumpError, BadZipFile) as e:
+                self.logger.warning("Failed to read dump package %s (%s)"
+                                    % (package.uri, str(e)))
+                continue
+            try:
+                self.update_from_dump_package(reader, wanted, done)
+            except (IOError, DumpError, BadZipFile) as e:
+                self.logger.warning("Failed to read dump package %s (%s)"
+                                    % (package.uri, str(e)))
+            finally:
+                reader.close()
+        return(done)
+
+    def update_from_dump_package(self, reader, wanted, done):
+        """Get resources in wanted and not in done from DumpReader reader
+
+        Adds the URI of each resource updated to done.
+        """
+        members = []
+        for member in reader.manifest:
+            if (member.uri in wanted and member.uri not in done and
+                    self.same_content(member, wanted[member.uri][0])):
+                members.append(member)
+        if (len(members) == 0):
+            return
+        if (sum(member.length or 0 for member in members) > reader.size / 2):
+            reader.prefetch_all()
+        self.logger.info("Getting %d resources from dump package %s"
+                         % (len(members), reader.file))
+        for member in members:
+            (resource, change) = wanted[member.uri]
+            filename = self.mapper.src_to_dst(member.uri)
+            self.logger.info("%s: %s (from dump) -> %s"
+                             % (change, member.uri, filename))
+            self.update_resource_from_dump(reader, member, resource,
+                                           filename, change)
+            done.add(member.uri)
+
+    def same_content(self, member, resource):
+        """True unless manifest entry member differs from resource"""
+        for att in ('length', 'md5', 'timestamp'):
+            if (getattr(member, att) is not None and
+                    getattr(resource, att) is not None and
+                    getattr(member, att) != getattr(resource, att)):
+                return(False)
+        return(True)
+
+    def update_resource_from_dump(self, reader, member, resource, filename,
+                                  change=None):
+        """Update resource from manifest entry member of DumpReader reader
+
+        As update_resource() but with the content from the dump package.
+        """
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        reader.extract(member, filename)
+        if (resource.timestamp is not None):
+            unixtime = int(resource.timestamp)  # no fractional
+            os.utime(filename, (unixtime, unixtime))
+            if (resource.timestamp > self.last_timestamp):
+                self.last_timestamp = resource.timestamp
+        self.log_event(Resource(resource=resource, change=change))
+        self.check_resource_file(resource, filename)
+
+    def check_resource_file(self, resource, filename):
+        """Warn if the file for resource does not match the length or digests"""
+        length = os.stat(filename).st_size
+        if (resource.length is None):
+            self.logger.warning("Caught flying None: " + str(resource))
+        elif (resource.length != length):
+            self.logger.warn("Downloaded size for %s of %d bytes does not "
+                             "match expected %d bytes"
+                             % (resource.uri, length, resource.length))
+        if (self.checksum):
+            # check all digests given in one read of the file
+            expected = dict((name, getattr(resource, name))
+                            for name in DIGEST_ALGORITHMS
+                            if getattr(resource, name) is not None)
+            if (expected):
+                if (self.digest_cache is not None):
+                    got = self.digest_cache.digests_for_file(
+                        filename, expected.keys())
+                else:
+                    got = compute_digests_for_file(filename,
+                                                   expected.keys())
+                for (name, digest) in sorted(expected.items()):
+                    if (got[name] != digest):
+                        self.logger.warn(
+                            "%s mismatch for %s, got %s but expected %s"
+                            % (name.upper(), resource.uri, got[name],
+                               digest))
+
     def delete_resource(self, resource, filename, allow_deletion=False):
         """Delete copy of resource in file on local system
 
@@ -696,9 +899,12 @@ class Client(object):
         if (dump):
             if (outfile is None):
                 outfile = self.default_resource_dump
-            self.logger.info("Writing resource dump to %s..." % (dump))
-            d = Dump(format=self.dump_format)
-            d.write(resource_list=rl, dumpfile=outfile)
+            self.logger.info("Writing resource dump to %s..." % (outfile))
+            d = Dump(resources=rl, fileformat=self.dump_format)
+            d.workers = self.dump_workers
+            d.partition_method = self.dump_partition_method
+            d.compression_policy = self.dump_compression_policy
+            d.write(basename=os.path.splitext(outfile)[0])
         else:
             if (outfile is None):
                 try:
@@ -721,6 +927,8 @@ class Client(object):
         paths setting or else on the mappings.
         """
         cl = ChangeList(ln=links)
+        # time of the state that changes are calculated up to
+        snapshot_time = time.time()
         if (not empty):
             # 1. Get and parse reference sitemap
             old_rl = self.read_reference_resource_list(ref_sitemap)
@@ -732,12 +940,19 @@ class Client(object):
             else:
                 new_rl = self.read_reference_resource_list(
                     newref_sitemap, name='new reference')
+            if (new_rl.md_at is not None):
+                snapshot_time = str_to_datetime(new_rl.md_at)
             # 3. Calculate change list
             (_, updated, deleted, created) = old_rl.compare(new_rl)
             cl.add_changed_resources(updated, change='updated')
             cl.add_changed_resources(deleted, change='deleted')
             cl.add_changed_resources(created, change='created')
-        # 4. Write out change list
+        # 4. Write out change list, or a Change Dump if requested
+        if (dump):
+            if (outfile is None):
+                outfile = self.default_change_dump
+            self.write_dump_if_requested(cl, outfile, until=snapshot_time)
+            return
         cl.mapper = self.mapper
         cl.pretty_xml = self.pretty_xml
         if (self.max_sitemap_entries is not None):
@@ -746,7 +961,6 @@ class Client(object):
             print(cl.as_xml())
         else:
             cl.write(basename=outfile)
-        self.write_dump_if_requested(cl, dump)
 
     def write_capability_list(self, capabilities=None,
                               outfile=None, links=None):
@@ -774,11 +988,118 @@ class Client(object):
         else:
             rsd.write(basename=outfile)
 
-    # second parameter: resource_list
-    def write_dump_if_requested(self, _, dump):
-        """Write a dump to the file dump"""
+    def write_dump_if_requested(self, change_list, dump, until=None):
+        """Extend the Change Dump dump with changes in change_list
+
+        Does nothing if dump is None. Otherwise the Change Dump document
+        is written to dump with the extension replaced by .xml, and the
+        packages are named from the same base with a number, along with
+        separate copies of their manifests. The resources in change_list
+        must have their path set, as by build_resource_list(set_path=True).
+
+        If the Change Dump document already exists then new packages are
+        added to it with only the changes not already recorded as the
+        latest change for each resource in the package manifests: a
+        resource created or updated is included unless the last entry
+        for it has the same lastmod, length and md5 (if both have one),
+        and a deletion unless the last entry is a deletion. The
+        modification time of a file is not compared with the md_until of
+        the last package as files may be added with an older, preserved,
+        modification time. The packages are partitioned by
+        self.dump_time_window if set. until is the time of the state that
+        change_list describes, the start of the disk scan, and is used as
+        md_until of the last package so that changes made after the scan
+        started are included next time. It defaults to now. Returns the
+        number of packages written.
+        """
         if (dump is None):
-            return
+            return(0)
+        basename = os.path.splitext(dump)[0]
+        docfile = basename + '.xml'
+        change_dump = ChangeDump()
+        since = None
+        last_entry = {}
+        if (os.path.exists(docfile)):
+            with open(docfile, 'rb') as fh:
+                change_dump.parse(fh=fh)
+            for n in range(len(change_dump)):
+                manifest = ChangeDumpManifest()
+                manifest_file = "%s%05d.xml" % (basename, n)
+                try:
+                    with open(manifest_file, 'rb') as fh:
+                        manifest.parse(fh=fh)
+                except IOError as e:
+                    raise ClientFatalError(
+                        "Cannot read manifest %s of existing Change Dump %s "
+                        "(%s)" % (manifest_file, docfile, str(e)))
+                if (manifest.md_until is not None):
+                    ended = str_to_datetime(manifest.md_until)
+                    since = ended if (since is None) else max(since, ended)
+                for resource in manifest:
+                    last_entry[resource.uri] = resource
+        changes = ChangeDumpManifest()
+        for resource in change_list:
+            last = last_entry.get(resource.uri)
+            if (last is None or last.change == 'deleted'):
+                if (last is None or resource.change != 'deleted'):
+                    changes.add(resource)
+            elif (resource.change == 'deleted' or
+                    not self.same_dump_content(resource, last)):
+                changes.add(resource)
+        if (len(changes) == 0):
+            self.logger.info("No changes since last Change Dump package")
+            return(0)
+        d = Dump(resources=changes, fileformat=self.dump_format)
+        d.manifest_class = ChangeDumpManifest
+        d.workers = self.dump_workers
+        d.partition_method = self.dump_partition_method
+        d.compression_policy = self.dump_compression_policy
+        d.time_window = self.dump_time_window
+        d.time_from = since
+        d.time_until = until if (until is not None) else time.time()
+        try:
+            num = d.write(basename=basename, start=len(change_dump))
+        except DumpError as e:
+            raise ClientFatalError("Failed to write Change Dump (%s)" % str(e))
+        for (dumpfile, manifest) in d.packages:
+            package = Resource(uri=self.dump_uri(dumpfile),
+                               timestamp=os.stat(dumpfile).st_mtime,
+                               length=os.stat(dumpfile).st_size,
+                               mime_type='application/zip',
+                               md_from=manifest.md_from,
+                               md_until=manifest.md_until)
+            package.link_set(rel='contents', href=self.dump_uri(
+                os.path.splitext(dumpfile)[0] + '.xml'),
+                type='application/xml')
+            change_dump.add(package)
+        if (change_dump.md_from is None):
+            change_dump.md_from = d.packages[0][1].md_from
+        change_dump.pretty_xml = self.pretty_xml
+        change_dump.write(basename=docfile)
+        self.logger.info("Wrote %d packages with %d changes to Change Dump %s"
+                         % (num, len(changes), docfile))
+        return(num)
+
+    def same_dump_content(self, resource, last):
+        """True if resource matches last, its entry in a Change Dump manifest
+
+        The lastmod and length must match, and also the md5 if both have
+        one.
+        """
+        if (resource.lastmod != last.lastmod or
+                resource.length != last.length):
+            return(False)
+        if (resource.md5 is not None and last.md5 is not None):
+            return(resource.md5 == last.md5)
+        return(True)
+
+    def dump_uri(self, filename):
+        """URI for a dump file from the mappings"""
+        uri = self.mapper.dst_to_src(filename)
+        if (uri is None):
+            raise ClientFatalError("Dump file %s is not within the mapped "
+                                   "paths so has no URI" % (filename))
+        return(uri)
 
     def read_reference_resource_list(self, ref_sitemap, name='reference'):
         """Read reference resource list and return the ResourceList object
@@ -786,7 +1107,7 @@ class Client(object):
         name parameter just uses in output messages to say what type
         of resource list is being read.
         """
-        rl = ResourceList()
+        rl = ResourceList(resources_class=self.resources_class)
         self.logger.info(
             "Reading reference %s resource list from %s ..."
             % (name, ref_sitemap))
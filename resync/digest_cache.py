@@ -0,0 +1,142 @@
+"""Persistent cache of file digests
+
+Calculating digests for a large set of files means reading every byte
+of every file, even when almost none have changed since the last run.
+DigestCache stores digests in an SQLite database keyed by the device
+and inode of each file and checked against the size, mtime and ctime
+from stat, so that the digests are reused only for files that have
+not been changed:
+
+    cache = DigestCache('/var/cache/resync/digests.sqlite')
+    digests = cache.digests_for_file(filename, ('md5', 'sha256'))
+    ...
+    cache.close()
+
+A file changed within the same mtime tick as it was hashed would not
+be detected, so digests are not stored for files modified less than
+racy_window seconds before they were hashed.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+from resync.utils import compute_digests_for_file
+
+# Digest columns in the database
+DIGEST_NAMES = ('md5', 'sha1', 'sha256')
+
+
+class DigestCache(object):
+    """Cache of digests for files on disk, stored in an SQLite database
+
+    filename - database file, created if it does not exist
+
+    racy_window - files with an mtime less than this number of seconds
+        before the time of hashing are not cached
+
+    commit_every - number of new entries after which changes are
+        committed to the database
+    """
+
+    def __init__(self, filename, racy_window=2.0, commit_every=1000):
+        self.filename = filename
+        self.racy_window = racy_window
+        self.commit_every = commit_every
+        self.hits = 0
+        self.misses = 0
+        self.uncommitted = 0
+        self.logger = logging.getLogger('resync.digest_cache')
+        self.db = sqlite3.connect(filename)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS digests ("
+            "dev INTEGER, ino INTEGER, size INTEGER, mtime_ns INTEGER, "
+            "ctime_ns INTEGER, md5 TEXT, sha1 TEXT, sha256 TEXT, "
+            "PRIMARY KEY (dev, ino))")
+
+    def get(self, file_stat, digests):
+        """Return dict of cached digests for file with stat file_stat
+
+        Returns None unless all the digests named are cached for an
+        unchanged file.
+        """
+        cached = self.get_all(file_stat)
+        if (cached is None or
+                not all((name in cached) for name in digests)):
+            self.misses += 1
+            return(None)
+        self.hits += 1
+        return(dict((name, cached[name]) for name in digests))
+
+    def put(self, file_stat, digests):
+        """Store dict of digests for file with stat file_stat
+
+        Any other digests stored for the same unchanged file are kept.
+        Nothing is stored if the file was modified too recently to be
+        sure that it has not changed since it was hashed.
+        """
+        if (file_stat.st_mtime > time.time() - self.racy_window):
+            self.logger.debug("Not caching digests for recently modified "
+                              "file (inode %d)" % (file_stat.st_ino))
+            return
+        old = self.get_all(file_stat)
+        if (old is not None):
+            old.update(digests)
+            digests = old
+        self.db.execute(
+            "INSERT OR REPLACE INTO digests VALUES (?,?,?,?,?,?,?,?)",
+            (file_stat.st_dev, file_stat.st_ino, file_stat.st_size,
+             file_stat.st_mtime_ns, file_stat.st_ctime_ns,
+             digests.get('md5'), digests.get('sha1'), digests.get('sha256')))
+        self.uncommitted += 1
+        if (self.uncommitted >= self.commit_every):
+            self.commit()
+
+    def get_all(self, file_stat):
+        """Dict of all digests cached for an unchanged file, else None"""
+        row = self.db.execute(
+            "SELECT size, mtime_ns, ctime_ns, md5, sha1, sha256 "
+            "FROM digests WHERE dev=? AND ino=?",
+            (file_stat.st_dev, file_stat.st_ino)).fetchone()
+        if (row is None or
+                row[0:3] != (file_stat.st_size, file_stat.st_mtime_ns,
+                             file_stat.st_ctime_ns)):
+            return(None)
+        return(dict((name, value) for (name, value)
+                    in zip(DIGEST_NAMES, row[3:]) if value is not None))
+
+    def digests_for_file(self, filename, digests, file_stat=None):
+        """Dict of digests for filename, from the cache if possible
+
+        Calculates and caches the digests if they are not cached for the
+        file as it is now.
+        """
+        if (file_stat is None):
+            file_stat = os.stat(filename)
+        result = self.get(file_stat, digests)
+        if (result is None):
+            result = compute_digests_for_file(filename, digests)
+            self.put(file_stat, result)
+        return(result)
+
+    def commit(self):
+        """Commit any new entries to the database file"""
+        self.db.commit()
+        self.uncommitted = 0
+
+    def close(self):
+        """Commit and close the database"""
+        if (self.db is None):
+            return
+        self.commit()
+        self.db.close()
+        self.db = None
+        self.logger.info("Digest cache %s: %d hits, %d misses" %
+                         (self.filename, self.hits, self.misses))
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
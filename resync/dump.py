@@ -1,15 +1,154 @@
-"""Dump handler for ResourceSync"""
+"""Dump handler for ResourceSync
 
+ZIP packages may be written by several worker processes at once by
+setting Dump.workers. File content is streamed into each package in
+one pass, with the length of each file checked as it is copied.
+Setting Dump.compression_policy to a CompressionPolicy object chooses
+whether to compress each file, rather than compressing all or none.
+
+For a Change Dump set manifest_class to ChangeDumpManifest, entries
+for deleted resources are then included in the manifests but have no
+content. Setting Dump.time_window partitions the changes into packages
+each covering a window of time, as given by md_from and md_until.
+"""
+
+import bisect
 import logging
+import os
 import os.path, resync.w3c_datetime as w3c
-from zipfile import ZipFile, ZIP_STORED, ZIP_DEFLATED
+import time
+import zlib
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from zipfile import ZipFile, ZipInfo, ZIP_STORED, ZIP_DEFLATED
 from resync.resource_dump_manifest import ResourceDumpManifest
+from resync.utils import compute_digests_for_file, DIGEST_ALGORITHMS
+
+
+# Size of buffer used to copy file content into ZIP packages
+COPY_BUFFER_SIZE = 1024 * 1024
+
+
+# Media types and file extensions of formats that are already compressed
+COMPRESSED_MIME_TYPES = ('image/', 'video/', 'audio/', 'application/zip',
+                         'application/gzip', 'application/x-gzip',
+                         'application/x-bzip2', 'application/x-xz',
+                         'application/x-7z-compressed', 'application/pdf',
+                         'application/epub+zip', 'font/woff')
+COMPRESSED_EXTENSIONS = frozenset((
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.jp2', '.tif', '.tiff',
+    '.mp3', '.mp4', '.m4a', '.ogg', '.mov', '.avi', '.mkv', '.webm',
+    '.zip', '.gz', '.tgz', '.bz2', '.xz', '.7z', '.rar', '.jar', '.pdf',
+    '.epub', '.docx', '.xlsx', '.pptx', '.odt', '.woff', '.woff2'))
 
 
 class DumpError(Exception):
     pass
 
 
+class CompressionPolicy(object):
+    """Choose whether to compress each file written to a ZIP package
+
+    Files are stored without compression if their mime_type starts with
+    one of mime_types, or their name ends with one of extensions, as
+    such formats are already compressed. Otherwise, if sample_size is
+    not 0, the start of the file is compressed at the fastest level and
+    the file is stored if that does not reduce the size to less than
+    max_ratio of the original. Other files are deflated at compresslevel
+    (zlib default if None, 1 is fastest).
+    """
+
+    def __init__(self, mime_types=COMPRESSED_MIME_TYPES,
+                 extensions=COMPRESSED_EXTENSIONS, sample_size=65536,
+                 max_ratio=0.9, compresslevel=None):
+        self.mime_types = tuple(mime_types)
+        self.extensions = frozenset(extensions)
+        self.sample_size = sample_size
+        self.max_ratio = max_ratio
+        self.compresslevel = compresslevel
+
+    def compress_type(self, path, mime_type=None, sample=None):
+        """ZIP_STORED or ZIP_DEFLATED for file at path
+
+        sample is the first bytes of the file, at least the first
+        sample_size bytes unless the file is shorter.
+        """
+        if (mime_type is not None and mime_type.startswith(self.mime_types)):
+            return(ZIP_STORED)
+        if (os.path.splitext(path)[1].lower() in self.extensions):
+            return(ZIP_STORED)
+        if (self.sample_size and sample is not None and len(sample) > 0):
+            sample = sample[:self.sample_size]
+            compressed = len(zlib.compress(sample, 1))
+            if (compressed >= self.max_ratio * len(sample)):
+                return(ZIP_STORED)
+        return(ZIP_DEFLATED)
+
+
+def set_compress_level(zinfo, level):
+    """Set the deflate level used when zinfo is written to a ZipFile
+
+    ZipInfo has no public way to set this before Python 3.13, where the
+    attribute was renamed from _compresslevel to compress_level.
+    """
+    if (hasattr(zinfo, 'compress_level')):
+        zinfo.compress_level = level
+    else:
+        zinfo._compresslevel = level
+
+
+def write_zip_package(dumpfile, manifest_xml, members, compression,
+                      policy=None):
+    """Write ZIP package dumpfile with manifest.xml and members
+
+    members is a list of (real_path, archive_path, length, mime_type) for
+    each file to include. The content of each file is copied through a
+    single buffer directly into the archive, and raises DumpError if the
+    number of bytes copied is not length (unless length is None). A
+    partly written package is removed on error. Returns the size of
+    dumpfile.
+
+    If compression is ZIP_DEFLATED and policy is a CompressionPolicy
+    then it is used to decide whether to compress each file, based on the
+    mime_type, name and first block of the file.
+
+    This is a module level function so that it may be run in a worker
+    process by Dump.write().
+    """
+    buf = bytearray(COPY_BUFFER_SIZE)
+    view = memoryview(buf)
+    try:
+        with ZipFile(dumpfile, mode="w", compression=compression,
+                     allowZip64=True) as zf:
+            zf.writestr('manifest.xml', manifest_xml)
+            for (real_path, archive_path, length, mime_type) in members:
+                zinfo = ZipInfo.from_file(real_path, arcname=archive_path)
+                zinfo.compress_type = compression
+                if (length is not None):
+                    # used to decide whether zip64 extensions are needed
+                    zinfo.file_size = length
+                size = 0
+                with open(real_path, 'rb') as src:
+                    n = src.readinto(buf)
+                    if (compression == ZIP_DEFLATED and policy is not None):
+                        zinfo.compress_type = policy.compress_type(
+                            real_path, mime_type, view[:n])
+                        set_compress_level(zinfo, policy.compresslevel)
+                    with zf.open(zinfo, mode='w') as dst:
+                        while (n > 0):
+                            dst.write(view[:n])
+                            size += n
+                            n = src.readinto(buf)
+                if (length is not None and size != length):
+                    raise DumpError("Size of file %s is %d on disk, not %d "
+                                    "as specified" % (real_path, size, length))
+    except BaseException:
+        if (os.path.exists(dumpfile)):
+            os.unlink(dumpfile)
+        raise
+    return(os.path.getsize(dumpfile))
+
+
 class Dump(object):
     """Dump of content for a Resource Dump or Change Dump
 
@@ -32,65 +171,131 @@ class Dump(object):
         self.manifest_class = ResourceDumpManifest  # FIXME
         self.max_size = 100 * 1024 * 1024  # 100MB
         self.max_files = 50000
+        self.partition_method = 'sequential'
+        self.time_window = None
+        self.time_from = None
+        self.time_until = None
+        self.compression_policy = None
         self.path_prefix = None
+        self.workers = 1
+        self.packages = []
         self.logger = logging.getLogger('resync.dump')
 
-    def write(self, basename=None, write_separate_manifests=True):
+    def write(self, basename=None, write_separate_manifests=True, start=0):
         """Write one or more dump rs to complete this dump
 
-        Returns the number of dump/archive rs written.
+        Returns the number of dump/archive rs written. Each is named from
+        basename and a number, starting from start, and the list of
+        (dumpfile, manifest) for those written is left in self.packages.
+
+        Lengths already specified for resources are not checked against
+        the files on disk beforehand but, for ZIP format, as each file is
+        written. If self.workers is more than 1 then ZIP packages are
+        written concurrently by that number of worker processes.
         """
-        self.check_files()
+        if (self.format not in ('zip', 'warc')):
+            raise DumpError(
+                "Unknown dump format requested (%s)" % (self.format))
+        self.check_files(stat_files=(self.format != 'zip'))
+        pool = None
+        pending = deque()
+        if (self.format == 'zip' and self.workers > 1):
+            pool = ProcessPoolExecutor(max_workers=self.workers)
         n = 0
-        for manifest in self.partition_dumps():
-            dumpbase = "%s%05d" % (basename, n)
-            dumpfile = "%s.%s" % (dumpbase, self.format)
-            if (write_separate_manifests):
-                manifest.write(basename=dumpbase + '.xml')
-            if (self.format == 'zip'):
-                self.write_zip(manifest.resources, dumpfile)
-            elif (self.format == 'warc'):
-                self.write_warc(manifest.resources, dumpfile)
-            else:
-                raise DumpError(
-                    "Unknown dump format requested (%s)" % (self.format))
-            n += 1
+        self.packages = []
+        try:
+            for manifest in self.partition_dumps():
+                dumpbase = "%s%05d" % (basename, start + n)
+                dumpfile = "%s.%s" % (dumpbase, self.format)
+                self.packages.append((dumpfile, manifest))
+                if (self.format == 'warc'):
+                    if (write_separate_manifests):
+                        manifest.write(basename=dumpbase + '.xml')
+                    self.write_warc(manifest.resources, dumpfile)
+                    n += 1
+                    continue
+                # the separate manifest is the same as that in the package,
+                # with paths within the package
+                (manifest_xml, members) = self.zip_members(
+                    manifest.resources, manifest)
+                if (write_separate_manifests):
+                    with open(dumpbase + '.xml', 'w', encoding='utf-8') as fh:
+                        fh.write(manifest_xml)
+                if (pool is not None):
+                    pending.append((dumpfile, pool.submit(
+                        write_zip_package, dumpfile, manifest_xml, members,
+                        self.zip_compression, self.compression_policy)))
+                    while (len(pending) > 2 * self.workers):
+                        self._log_zip_written(*pending.popleft())
+                else:
+                    zipsize = write_zip_package(
+                        dumpfile, manifest_xml, members,
+                        self.zip_compression, self.compression_policy)
+                    self.logger.info("Wrote ZIP file dump %s with size %d "
+                                     "bytes" % (dumpfile, zipsize))
+                n += 1
+            while (len(pending) > 0):
+                self._log_zip_written(*pending.popleft())
+        finally:
+            if (pool is not None):
+                pool.shutdown(wait=True, cancel_futures=True)
         self.logger.info("Wrote %d dump rs" % (n))
         return(n)
 
-    def write_zip(self, resources=None, dumpfile=None):
+    @property
+    def zip_compression(self):
+        return(ZIP_DEFLATED if self.compress else ZIP_STORED)
+
+    def _log_zip_written(self, dumpfile, future):
+        self.logger.info("Wrote ZIP file dump %s with size %d bytes"
+                         % (dumpfile, future.result()))
+
+    def write_zip(self, resources=None, dumpfile=None, manifest=None):
         """Write a ZIP format dump file
 
         Writes a ZIP file containing the resources in the iterable resources
-        along with a manifest file manifest.xml (written first). No checks
-        on the size of rs or total size are performed, this is expected
-        to have been done beforehand.
+        along with a manifest file manifest.xml (written first). The
+        length of each file is checked as it is written if specified, no
+        check on the total size is performed, this is expected to have
+        been done beforehand.
+        """
+        (manifest_xml, members) = self.zip_members(resources, manifest)
+        zipsize = write_zip_package(dumpfile, manifest_xml, members,
+                                    self.zip_compression,
+                                    self.compression_policy)
+        self.logger.info(
+            "Wrote ZIP file dump %s with size %d bytes" % (dumpfile, zipsize))
+
+    def zip_members(self, resources, manifest=None):
+        """Return (manifest_xml, members) for a ZIP package of resources
+
+        Sets the path of each resource to its path within the package, as
+        written in the manifest, and returns the list of members for
+        write_zip_package(). Deleted resources in a Change Dump have no
+        content. Any md_from and md_until of manifest, the manifest from
+        partition_dumps(), are copied.
         """
-        compression = (ZIP_DEFLATED if self.compress else ZIP_STORED)
-        zf = ZipFile(dumpfile, mode="w",
-                     compression=compression, allowZip64=True)
-        # Write resources first
-        rdm = ResourceDumpManifest(resources=resources)
+        rdm = self.manifest_class(resources=resources)
         rdm.pretty_xml = True
+        if (manifest is not None):
+            for att in ('md_from', 'md_until'):
+                if (getattr(manifest, att) is not None):
+                    setattr(rdm, att, getattr(manifest, att))
         # The mandatory <rs:md> child element of <urlset> must have a capability attribute with a value of
         # resourcedump-manifest. It must also have an at attribute that conveys the datetime at which the process
         # of taking a snapshot of resources for their inclusion in the ZIP package started, and it may have a
         # completed attribute that conveys the datetime at which that process completed.
         rdm.md_at = w3c.datetime_to_str(no_fractions=True)
-        real_path = {}
+        members = []
         for resource in resources:
+            if (resource.change == 'deleted'):
+                continue
             archive_path = self.archive_path(resource.path)
-            real_path[archive_path] = resource.path
+            members.append((resource.path, archive_path, resource.length,
+                            resource.mime_type))
             resource.path = archive_path
         rdm.md_completed = w3c.datetime_to_str(no_fractions=True)
-        zf.writestr('manifest.xml', rdm.as_xml())
-        # Add all rs in the resources
-        for resource in resources:
-            zf.write(real_path[resource.path], arcname=resource.path)
-        zf.close()
-        zipsize = os.path.getsize(dumpfile)
-        self.logger.info(
-            "Wrote ZIP file dump %s with size %d bytes" % (dumpfile, zipsize))
+        return(rdm.as_xml(), members)
 
     def write_warc(self, resources=None, dumpfile=None):
         """Write a WARC dump file
@@ -122,7 +327,8 @@ class Dump(object):
             "Wrote WARC file dump %s with size %d bytes"
             "" % (dumpfile, warcsize))
 
-    def check_files(self, set_length=True, check_length=True):
+    def check_files(self, set_length=True, check_length=True, digests=None,
+                    stat_files=True):
         """Go though and check all rs in self.resources, add up size, and
         find longest common path that can be used when writing the dump file.
         Saved in self.path_prefix.
@@ -130,12 +336,28 @@ class Dump(object):
         Parameters set_length and check_length control control whether then
         set_length attribute should be set from the file size if not specified,
         and whether any length specified should be checked. By default both
-        are True. In any event, the total size calculated is the size of rs
-        on disk.
+        are True. Unless stat_files is False, the total size calculated is
+        the size of rs on disk.
+
+        If stat_files is False then the lengths specified for resources are
+        used without looking at the files, which are then expected to be
+        checked as they are written, and the total size is of the lengths.
+        Files without a length specified are always looked at.
+
+        If digests is given as a list of digest names ('md5', 'sha1',
+        'sha256') then those digests are set for each resource where not
+        already specified. Any digest already specified for a resource
+        is checked. All the digests for a file are calculated in a single
+        read of the file.
+
+        Deleted resources in a Change Dump are skipped as they have no
+        content.
         """
         total_size = 0  # total size of all rs in bytes
         path_prefix = None
         for resource in self.resources:
+            if (resource.change == 'deleted'):
+                continue
             if (resource.path is None):
                 # explicit test because exception raised by getsize otherwise
                 # confusing
@@ -146,7 +368,10 @@ class Dump(object):
             else:
                 path_prefix = os.path.commonprefix(
                     [path_prefix, os.path.dirname(resource.path)])
-            size = os.path.getsize(resource.path)
+            if (not stat_files and resource.length is not None):
+                size = resource.length
+            else:
+                size = os.path.getsize(resource.path)
             if (resource.length is not None):
                 if (check_length and resource.length != size):
                     raise DumpError("Size of resource %s is %d on disk, "
@@ -154,6 +379,8 @@ class Dump(object):
                                     (resource.uri, size, resource.length))
             elif (set_length):
                 resource.length = size
+            if (digests is not None):
+                self.check_digests(resource, digests)
             if (size > self.max_size):
                 raise DumpError("Size of file (%s, %d) exceeds maximum (%d) "
                                 "dump size"
@@ -165,13 +392,149 @@ class Dump(object):
             "Total size of rs to include in dump %d bytes" % (total_size))
         return True
 
+    def check_digests(self, resource, digests):
+        """Set digests for resource and check any already specified
+
+        Raises DumpError if the digest of the file at resource.path does
+        not match one specified for resource.
+        """
+        expected = dict((name, getattr(resource, name))
+                        for name in DIGEST_ALGORITHMS
+                        if getattr(resource, name) is not None)
+        names = set(digests).union(expected.keys())
+        if (len(names) == 0):
+            return
+        got = compute_digests_for_file(resource.path, sorted(names))
+        for (name, digest) in got.items():
+            if (name not in expected):
+                setattr(resource, name, digest)
+            elif (expected[name] != digest):
+                raise DumpError("%s of resource %s is %s on disk, "
+                                "not %s as specified" %
+                                (name, resource.uri, digest, expected[name]))
+
     def partition_dumps(self):
         """Yield a set of manifest object that parition the dumps
 
-        Simply adds resources/rs to a manifest until their are either the
-        the correct number of rs or the size limit is exceeded, then yields
-        that manifest.
+        With self.partition_method 'sequential' (the default) simply adds
+        resources/rs to a manifest until their are either the the correct
+        number of rs or the size limit is exceeded, then yields that
+        manifest. With 'packed' see partition_dumps_packed().
+
+        If any of self.time_window, self.time_from or self.time_until are
+        set then see partition_dumps_by_time().
+        """
+        if (self.partition_method not in ('packed', 'sequential')):
+            raise DumpError("Unknown partition method requested (%s)"
+                            % (self.partition_method))
+        if (self.time_window is not None or self.time_from is not None or
+                self.time_until is not None):
+            return(self.partition_dumps_by_time())
+        return(self.partition_resources(self.resources))
+
+    def partition_resources(self, resources):
+        """Partition resources with self.partition_method"""
+        if (self.partition_method == 'packed'):
+            return(self.partition_dumps_packed(resources))
+        return(self.partition_dumps_sequential(resources))
+
+    def partition_dumps_by_time(self):
+        """Yield manifests for resources in windows of time
+
+        Resources are grouped by timestamp into windows of
+        self.time_window seconds, aligned to multiples of time_window
+        since the epoch, and each group is partitioned as by
+        partition_dumps(). The md_until of each manifest is set to the
+        end of its window, limited to self.time_until (default now). So
+        that consecutive packages cover a continuous period, md_from is
+        the md_until of the previous window or, for the first, is
+        self.time_from if set, else the start of the window. If
+        self.time_window is None then there is one window from
+        self.time_from (default the earliest timestamp) to
+        self.time_until.
+
+        Resources without a timestamp, such as deletions, are put in the
+        last window, or if there are no others in the window ending at
+        self.time_until.
+        """
+        time_until = self.time_until
+        if (time_until is None):
+            time_until = time.time()
+        windows = {}
+        untimed = []
+        if (self.time_window is None):
+            resources = list(self.resources)
+            timestamps = [resource.timestamp for resource in resources
+                          if resource.timestamp is not None]
+            if (len(resources) > 0):
+                windows[min(timestamps) if timestamps else 0.0] = resources
+        else:
+            for resource in self.resources:
+                if (resource.timestamp is None):
+                    untimed.append(resource)
+                    continue
+                start = ((resource.timestamp // self.time_window) *
+                         self.time_window)
+                windows.setdefault(start, []).append(resource)
+        if (len(untimed) > 0):
+            if (len(windows) > 0):
+                windows[max(windows)].extend(untimed)
+            else:
+                start = (time_until // self.time_window) * self.time_window
+                if (start >= time_until):
+                    start -= self.time_window
+                windows[start] = untimed
+        md_from = self.time_from
+        for start in sorted(windows):
+            if (md_from is None):
+                md_from = start
+            md_until = time_until
+            if (self.time_window is not None):
+                md_until = min(start + self.time_window, time_until)
+            md_until = max(md_from, md_until)
+            for manifest in self.partition_resources(windows[start]):
+                manifest.md_from = md_from
+                manifest.md_until = md_until
+                yield(manifest)
+            md_from = md_until
+
+    def partition_dumps_packed(self, resources):
+        """Yield manifests packing resources into as few dumps as possible
+
+        Resources are taken in decreasing order of length and each is added
+        to the dump with the least space left that it fits in (best fit
+        decreasing), so that no dump has more than self.max_size bytes or
+        self.max_files rs. This typically gives fewer and more evenly
+        sized dumps than the sequential method. Within each dump the
+        resources are in their original order.
         """
+        resources = list(resources)
+        order = sorted(range(len(resources)),
+                       key=lambda i: resources[i].length or 0, reverse=True)
+        dumps = []  # list of resource indexes in each dump
+        free = []  # sorted (space left, dump index) for dumps not full
+        for i in order:
+            length = resources[i].length or 0
+            pos = bisect.bisect_left(free, (length, -1))
+            if (pos < len(free)):
+                (space, d) = free.pop(pos)
+            else:
+                (space, d) = (self.max_size, len(dumps))
+                dumps.append([])
+            dumps[d].append(i)
+            if (len(dumps[d]) < self.max_files):
+                bisect.insort(free, (space - length, d))
+        for indexes in dumps:
+            manifest = self.manifest_class()
+            manifest.pretty_xml = True
+            manifest.md_at = w3c.datetime_to_str(no_fractions=True)
+            for i in sorted(indexes):
+                manifest.add(resources[i])
+            manifest.md_completed = w3c.datetime_to_str(no_fractions=True)
+            yield(manifest)
+
+    def partition_dumps_sequential(self, resources):
+        """Yield manifests filled in order, see partition_dumps()"""
         manifest = self.manifest_class()
         manifest.pretty_xml = True
         # From http://www.openarchives.org/rs/1.0/resourcesync#ResourceDumpManifest
@@ -184,9 +547,9 @@ class Dump(object):
         manifest_size = 0
         manifest_files = 0
 
-        for resource in self.resources:
+        for resource in resources:
             manifest.add(resource)
-            manifest_size += resource.length
+            manifest_size += (resource.length or 0)
             manifest_files += 1
             if (manifest_size >= self.max_size or
                     manifest_files >= self.max_files):
@@ -0,0 +1,358 @@
+"""Read ZIP dump packages, locally or remotely with HTTP Range requests
+
+A DumpReader opens a ZIP package as written by Dump.write_zip(), for
+a Resource Dump or a Change Dump, parses the manifest.xml it contains
+and gives access to the content of the resources listed:
+
+    reader = DumpReader('http://example.org/dump/rd_00000.zip')
+    for resource in reader.manifest:
+        if (resource.uri in wanted):
+            reader.extract(resource, filename)
+
+When given an http or https URL the package is read through a
+HttpRangeFile so that only the ZIP central directory, the manifest
+and the members extracted are fetched, each with a Range request,
+rather than the whole package.
+
+The length and any digests given in the manifest are checked as each
+resource is extracted. verify() checks or extracts all the resources
+in a package, using several threads for a local package:
+
+    reader = DumpReader('/tmp/rd_00000.zip', workers=4)
+    reader.verify()                      # check only
+    reader.verify(extract_dir='/tmp/x')  # check and extract
+"""
+
+import io
+import logging
+import os
+import os.path
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from xml.etree.ElementTree import parse
+from zipfile import ZipFile, BadZipFile
+
+import requests
+
+from resync.change_dump_manifest import ChangeDumpManifest
+from resync.dump import DumpError
+from resync.resource_dump_manifest import ResourceDumpManifest
+from resync.sitemap import RS_NS
+from resync.utils import copy_and_digest, DIGEST_ALGORITHMS
+
+# Size of the fixed part of a ZIP local file header
+LOCAL_HEADER_SIZE = 30
+
+# Manifest classes by capability, others are read as Resource Dump manifests
+MANIFEST_CLASSES = {'changedump-manifest': ChangeDumpManifest}
+
+
+class HttpRangeFile(io.RawIOBase):
+    """Read-only, seekable file object for a remote file over HTTP
+
+    Data is fetched with Range requests as it is read. Each request
+    fetches at least block_size bytes and the data from the last
+    request is kept so that the many small reads made by zipfile are
+    served from memory. While reads continue sequentially the amount
+    fetched with each request doubles, up to max_block_size bytes.
+    prefetch() may be used to fetch a known range with one request.
+    If the server does not support Range requests then the whole file
+    is fetched with the first read.
+
+    The attributes requests and bytes_fetched count the number of GET
+    requests made and bytes received.
+    """
+
+    def __init__(self, url, session=None, block_size=65536,
+                 max_block_size=8 * 1024 * 1024):
+        super(HttpRangeFile, self).__init__()
+        self.url = url
+        self.session = session if session is not None else requests.Session()
+        self.block_size = block_size
+        self.max_block_size = max_block_size
+        self.pos = 0
+        self.buf = b''
+        self.buf_start = 0
+        self.requests = 0
+        self.bytes_fetched = 0
+        self.logger = logging.getLogger('resync.dump_reader')
+        response = self.session.head(url, allow_redirects=True)
+        response.raise_for_status()
+        if ('Content-Length' not in response.headers):
+            raise DumpError("No Content-Length for %s" % (url))
+        self.size = int(response.headers['Content-Length'])
+
+    def readable(self):
+        return(True)
+
+    def seekable(self):
+        return(True)
+
+    def tell(self):
+        return(self.pos)
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if (whence == io.SEEK_SET):
+            self.pos = offset
+        elif (whence == io.SEEK_CUR):
+            self.pos += offset
+        elif (whence == io.SEEK_END):
+            self.pos = self.size + offset
+        else:
+            raise ValueError("Bad whence (%s)" % (whence))
+        if (self.pos < 0):
+            raise ValueError("Negative seek position %d" % (self.pos))
+        return(self.pos)
+
+    def readinto(self, b):
+        if (self.pos >= self.size):
+            return(0)
+        n = min(len(b), self.size - self.pos)
+        if (not self.buffered(self.pos, n)):
+            block_size = self.block_size
+            if (self.pos == self.buf_start + len(self.buf)):
+                # sequential read, read further ahead
+                block_size = min(max(2 * len(self.buf), block_size),
+                                 self.max_block_size)
+            length = max(n, block_size)
+            # near the end read back from the end instead, as zipfile
+            # reads backwards to find the central directory
+            self.fetch(max(0, min(self.pos, self.size - length)), length)
+        offset = self.pos - self.buf_start
+        n = min(n, len(self.buf) - offset)
+        b[:n] = self.buf[offset:offset + n]
+        self.pos += n
+        return(n)
+
+    def buffered(self, start, length):
+        """True if the range start to start+length-1 is already in memory"""
+        return(self.buf_start <= start and
+               start + length <= self.buf_start + len(self.buf))
+
+    def prefetch(self, start, length):
+        """Fetch data from start to start+length-1 unless already fetched"""
+        length = min(length, self.size - start)
+        if (length > 0 and not self.buffered(start, length)):
+            self.fetch(start, length)
+
+    def fetch(self, start, length):
+        """Fetch length bytes (fewer at end of file) from start"""
+        end = min(start + length, self.size) - 1
+        response = self.session.get(
+            self.url, headers={'Range': 'bytes=%d-%d' % (start, end)})
+        response.raise_for_status()
+        self.requests += 1
+        self.bytes_fetched += len(response.content)
+        if (response.status_code == 206):
+            self.buf_start = start
+        else:
+            self.logger.debug("Range request for %s not supported, got "
+                              "whole file" % (self.url))
+            self.buf_start = 0
+        self.buf = response.content
+        if (not self.buffered(start, end - start + 1)):
+            raise DumpError("Failed to get bytes %d-%d of %s"
+                            % (start, end, self.url))
+
+
+class DumpReader(object):
+    """Reader for a ZIP dump package with a manifest.xml
+
+    file may be the filename or http/https URL of the package, or an
+    open seekable file object.
+
+    workers is the number of threads used by verify(), always 1 for a
+    remote package.
+    """
+
+    def __init__(self, file, workers=1):
+        self.file = file
+        self.workers = workers
+        self.fh = None
+        if (isinstance(file, str) and file.startswith(('http:', 'https:'))):
+            self.fh = HttpRangeFile(file)
+            file = self.fh
+        elif (not isinstance(file, str)):
+            self.fh = file
+        self.zf = ZipFile(file, mode='r')
+        self._manifest = None
+        self.logger = logging.getLogger('resync.dump_reader')
+
+    @property
+    def manifest(self):
+        """Manifest parsed from the package's manifest.xml
+
+        A ChangeDumpManifest for a Change Dump package, else a
+        ResourceDumpManifest.
+        """
+        if (self._manifest is None):
+            self.prefetch_member('manifest.xml')
+            with self.zf.open('manifest.xml') as fh:
+                etree = parse(fh)
+            md = etree.getroot().find('{' + RS_NS + '}md')
+            capability = (md.get('capability') if (md is not None) else None)
+            manifest = MANIFEST_CLASSES.get(capability, ResourceDumpManifest)()
+            manifest.new_sitemap().parse_xml(
+                etree=etree, resources=manifest,
+                capability=manifest.capability_name, sitemapindex=False)
+            self._manifest = manifest
+        return(self._manifest)
+
+    @property
+    def size(self):
+        """Size of the package in bytes"""
+        if (isinstance(self.fh, HttpRangeFile)):
+            return(self.fh.size)
+        elif (self.fh is not None):
+            pos = self.fh.tell()
+            size = self.fh.seek(0, io.SEEK_END)
+            self.fh.seek(pos)
+            return(size)
+        return(os.path.getsize(self.file))
+
+    def prefetch_member(self, name):
+        """Fetch the data for member name in one request if remote
+
+        Large members are fetched in parts of increasing size as read.
+        """
+        if (isinstance(self.fh, HttpRangeFile)):
+            info = self.zf.getinfo(name)
+            # the local header may have different extra fields from the
+            # central directory so allow some slack
+            self.fh.prefetch(info.header_offset,
+                             min(LOCAL_HEADER_SIZE + len(info.filename) * 4 +
+                                 len(info.extra) + 1024 + info.compress_size,
+                                 self.fh.max_block_size))
+
+    def prefetch_all(self):
+        """Fetch the whole package in one request if remote
+
+        Cheaper than fetching members one by one when most are needed.
+        """
+        if (isinstance(self.fh, HttpRangeFile)):
+            self.fh.prefetch(0, self.fh.size)
+
+    def extract(self, resource, filename):
+        """Write the content of resource in the manifest to filename
+
+        Returns the number of bytes written. Raises DumpError, and removes
+        filename, if the content does not match the length or digests
+        in the manifest.
+        """
+        return(self.check_member(resource, filename))
+
+    def check_member(self, resource, filename=None):
+        """Check content of resource in the manifest, and write to filename
+
+        The content is read once, in a stream, to calculate its length
+        and the digests that are given for the resource, and to write
+        it to filename unless filename is None. Returns the length.
+        Raises DumpError if the length or a digest does not match that
+        given, or the resource is not in the package.
+        """
+        if (resource.path is None):
+            raise DumpError("No path in manifest for %s" % (resource.uri))
+        expected = dict((name, getattr(resource, name))
+                        for name in DIGEST_ALGORITHMS
+                        if getattr(resource, name) is not None)
+        try:
+            self.prefetch_member(resource.path)
+            with self.zf.open(resource.path) as src:
+                if (filename is None):
+                    (size, got) = copy_and_digest(src, None, sorted(expected))
+                else:
+                    with open(filename, 'wb') as dst:
+                        (size, got) = copy_and_digest(src, dst,
+                                                      sorted(expected))
+            if (resource.length is not None and size != resource.length):
+                raise DumpError("Size of %s is %d in package, not %d as in "
+                                "manifest" % (resource.path, size,
+                                              resource.length))
+            for (name, digest) in sorted(expected.items()):
+                if (got[name] != digest):
+                    raise DumpError("%s of %s is %s in package, not %s as "
+                                    "in manifest" % (name, resource.path,
+                                                     got[name], digest))
+        except KeyError:
+            raise DumpError("%s listed in manifest is not in package"
+                            % (resource.path))
+        except BadZipFile as e:
+            self.remove_partial(filename)
+            raise DumpError("Bad data for %s (%s)" % (resource.path, str(e)))
+        except BaseException:
+            self.remove_partial(filename)
+            raise
+        return(size)
+
+    def remove_partial(self, filename):
+        if (filename is not None and os.path.exists(filename)):
+            os.unlink(filename)
+
+    def verify(self, extract_dir=None):
+        """Check all the resources in the manifest, and optionally extract
+
+        Each resource is checked as by check_member() and, if extract_dir
+        is given, written to the file at its path below extract_dir.
+        Members are read by self.workers threads (unless remote) with
+        results taken in order, so the first error raised is for the
+        first bad resource in the manifest. Members of the package not
+        listed in the manifest are logged. Returns the number of
+        resources checked, which does not include deletions listed in a
+        Change Dump manifest.
+        """
+        # deleted resources in a Change Dump have no content
+        resources = [resource for resource in self.manifest
+                     if resource.change != 'deleted']
+        listed = set(resource.path for resource in resources)
+        for name in self.zf.namelist():
+            if (name != 'manifest.xml' and name not in listed):
+                self.logger.warning("%s in package but not in manifest"
+                                    % (name))
+        workers = self.workers
+        if (isinstance(self.fh, HttpRangeFile)):
+            workers = 1
+        pool = None
+        pending = deque()
+        if (workers > 1):
+            pool = ThreadPoolExecutor(max_workers=workers)
+        try:
+            for resource in resources:
+                filename = None
+                if (extract_dir is not None):
+                    filename = self.extract_filename(extract_dir, resource)
+                if (pool is None):
+                    self.check_member(resource, filename)
+                    continue
+                pending.append(pool.submit(self.check_member, resource,
+                                           filename))
+                while (len(pending) > 2 * workers):
+                    pending.popleft().result()
+            while (len(pending) > 0):
+                pending.popleft().result()
+        finally:
+            if (pool is not None):
+                pool.shutdown(wait=True, cancel_futures=True)
+        self.logger.info("Checked %d resources in %s"
+                         % (len(resources), self.file))
+        return(len(resources))
+
+    def extract_filename(self, extract_dir, resource):
+        """Filename below extract_dir for resource, creating directories
+
+        Raises DumpError for a path that is not within extract_dir.
+        """
+        if (resource.path is None):
+            raise DumpError("No path in manifest for %s" % (resource.uri))
+        path = os.path.normpath(resource.path)
+        if (os.path.isabs(path) or path == '..' or
+                path.startswith('..' + os.sep)):
+            raise DumpError("Path %s for %s is outside extract directory"
+                            % (resource.path, resource.uri))
+        filename = os.path.join(extract_dir, path)
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        return(filename)
+
+    def close(self):
+        self.zf.close()
+        if (self.fh is not None):
+            self.fh.close()
@@ -0,0 +1,116 @@
+"""Match file and directory names against exclusion rules
+
+A disk scan tests every file name against every exclude pattern so,
+with long exclude lists, pattern matching can dominate the scan.
+ExcludeMatcher combines all the rules of each kind into a single
+compiled regular expression so that each name is tested once:
+
+    em = ExcludeMatcher()
+    em.add_regexes(['sitemap\\d{0,5}.xml', '.*~$'])
+    em.add_globs(['*.tmp', '/data/private/*'])
+    em.add_dirs(['CVS', '.git'])
+    em.compile()
+    if (em.exclude_dir(name, path)):
+        # don't descend
+    if (em.exclude_file(name, path)):
+        # skip file
+
+Rules are of three kinds:
+- regexes are matched (with re.match) against file names
+- globs (fnmatch syntax) without a / are matched against file and
+  directory names, those with a / are matched against the full path
+- dirs are directory names to exclude
+
+A directory excluded by a path glob is pruned so nothing below it is
+scanned. Regexes that cannot be combined with others, because they use
+backreferences, named groups or global flags, are matched separately.
+"""
+
+import fnmatch
+import re
+
+# Regex syntax that depends on group numbering or applies to the whole
+# pattern, such patterns are not combined
+UNCOMBINABLE = re.compile(r'\\[1-9]|\(\?P|\(\?\(')
+DEFAULT_FLAGS = re.compile('').flags
+
+
+class ExcludeMatcher(object):
+    """Combined set of file and directory exclusion rules"""
+
+    def __init__(self):
+        self.regexes = []
+        self.globs = []
+        self.dirs = []
+        self.compiled = False
+        self._name_re = None
+        self._separate_res = []
+        self._name_glob_re = None
+        self._path_glob_re = None
+        self._dir_names = frozenset()
+
+    def add_regexes(self, patterns):
+        """Add regexes to match against file names"""
+        self.regexes.extend(patterns)
+        self.compiled = False
+
+    def add_globs(self, patterns):
+        """Add globs to match against names or, if they contain /, paths"""
+        self.globs.extend(patterns)
+        self.compiled = False
+
+    def add_dirs(self, names):
+        """Add names of directories to exclude"""
+        self.dirs.extend(names)
+        self.compiled = False
+
+    def compile(self):
+        """Compile the rules, must be called after rules are added"""
+        combined = []
+        self._separate_res = []
+        for pattern in self.regexes:
+            compiled = re.compile(pattern)
+            if (compiled.flags != DEFAULT_FLAGS or
+                    UNCOMBINABLE.search(pattern)):
+                self._separate_res.append(compiled)
+            else:
+                combined.append(pattern)
+        self._name_re = self._alternation(combined)
+        name_globs = [fnmatch.translate(g) for g in self.globs if '/' not in g]
+        path_globs = [fnmatch.translate(g) for g in self.globs if '/' in g]
+        self._name_glob_re = self._alternation(name_globs)
+        self._path_glob_re = self._alternation(path_globs)
+        self._dir_names = frozenset(self.dirs)
+        self.compiled = True
+
+    def _alternation(self, patterns):
+        """Compiled regex matching any of patterns, None if no patterns"""
+        if (len(patterns) == 0):
+            return(None)
+        return(re.compile('|'.join('(?:%s)' % p for p in patterns)))
+
+    def exclude_file(self, name, path=None):
+        """True if the file name (at path, if given) should be excluded"""
+        if (not self.compiled):
+            self.compile()
+        if (self._name_re is not None and self._name_re.match(name)):
+            return(True)
+        for compiled in self._separate_res:
+            if (compiled.match(name)):
+                return(True)
+        return(self._exclude_by_glob(name, path))
+
+    def exclude_dir(self, name, path=None):
+        """True if the directory name (at path, if given) should be pruned"""
+        if (not self.compiled):
+            self.compile()
+        if (name in self._dir_names):
+            return(True)
+        return(self._exclude_by_glob(name, path))
+
+    def _exclude_by_glob(self, name, path):
+        if (self._name_glob_re is not None and
+                self._name_glob_re.match(name)):
+            return(True)
+        return(path is not None and self._path_glob_re is not None and
+               self._path_glob_re.match(path) is not None)
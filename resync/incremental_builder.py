@@ -0,0 +1,397 @@
+"""Incremental disk scans to build ResourceList and ChangeList objects
+
+A full scan with ResourceListBuilder.from_disk() lists every directory
+and stats every file on each run. IncrementalResourceListBuilder keeps
+the result of the previous scan in an SQLite state file together with
+the mtime of each directory. On the next scan only directories whose
+mtime has changed (so that files have been added, removed or renamed
+in them) are listed again, the entries of the others being carried
+over from the state file:
+
+    rlb = IncrementalResourceListBuilder('/var/lib/resync/scan.sqlite',
+                                         mapper=mapper)
+    (resource_list, change_list) = rlb.scan()
+
+The change_list describes the changes since the previous scan. On the
+first scan, with no state, all resources are reported as created.
+
+A directory mtime does not change when a file in it is modified in
+place so by default every known file is still stat-ed (but not listed
+or read again). Where files are only ever added or replaced, rather
+than modified in place, setting trust_dir_mtimes avoids this and the
+time taken for a scan then depends on the number of directories and
+on the churn, not the total number of files.
+
+The same paths should be scanned each time with a given state file as
+files in the state but not below the paths scanned are not reported.
+"""
+
+import json
+import os
+import os.path
+import sqlite3
+import sys
+import time
+
+from resync.change_list import ChangeList
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+from resync.resource_list_builder import ResourceListBuilder
+from resync.utils import compute_digests_for_file
+from resync.w3c_datetime import datetime_to_str
+
+
+class IncrementalResourceListBuilder(ResourceListBuilder):
+    """ResourceListBuilder that reuses the state from the previous scan
+
+    state_file - SQLite database file with the state of the last scan,
+        created if it does not exist
+
+    trust_dir_mtimes - set True to carry over entries for files in
+        directories that have not changed without a stat of each file
+
+    racy_window - directories modified less than this number of seconds
+        before the scan are listed again in the next scan, in case they
+        change again within the same mtime tick
+
+    Other arguments are as for ResourceListBuilder. The settings for
+    exclusions, digests and digest_cache are respected. Digests are
+    only calculated for new or changed files.
+    """
+
+    def __init__(self, state_file, mapper=None, trust_dir_mtimes=False,
+                 racy_window=2.0, **kwargs):
+        super(IncrementalResourceListBuilder, self).__init__(
+            mapper=mapper, **kwargs)
+        self.state_file = state_file
+        self.trust_dir_mtimes = trust_dir_mtimes
+        self.racy_window = racy_window
+        self.db = sqlite3.connect(state_file)
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS dirs ("
+            "path TEXT PRIMARY KEY, parent TEXT, mtime_ns INTEGER)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS dirs_parent ON dirs (parent)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS files ("
+            "path TEXT PRIMARY KEY, dir TEXT, timestamp REAL, "
+            "mtime_ns INTEGER, size INTEGER, digests TEXT)")
+        self.db.execute(
+            "CREATE INDEX IF NOT EXISTS files_dir ON files (dir)")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value)")
+        # Counts for the last scan
+        self.dirs_listed = 0
+        self.dirs_carried = 0
+        self.scan_started = time.time()
+
+    @property
+    def last_scan(self):
+        """W3C datetime string for the completion of the last scan or None"""
+        row = self.db.execute(
+            "SELECT value FROM meta WHERE key='last_scan'").fetchone()
+        return(None if (row is None) else row[0])
+
+    def scan(self, paths=None, build_resource_list=True, commit=True):
+        """Scan and return (resource_list, change_list)
+
+        The resource_list describes all the resources found. The
+        change_list has entries for resources created, updated and
+        deleted since the previous scan, with md_from and md_until
+        set to the times of the previous and this scan.
+
+        If paths is specified then these are used instead of the set
+        of local paths in self.mapper. If build_resource_list is False
+        then only the state and change_list are updated and None is
+        returned for resource_list.
+
+        If commit is False then the updated state is not committed, so
+        that the caller can first write out the changes and then call
+        commit(). If close() is called without commit() then the state
+        is left as it was before the scan and the changes will be found
+        again by the next scan.
+        """
+        self.compile_excludes()
+        if (paths is None):
+            paths = [mapping.dst_path for mapping in self.mapper.mappings]
+        resource_list = None
+        if (build_resource_list):
+            resource_list = ResourceList(resources_class=self.resources_class)
+            resource_list.md_at = datetime_to_str()
+        change_list = self.start_change_list()
+        for path in paths:
+            self.logger.info("Incremental scan from %s" % (path))
+            self.scan_path(path, resource_list, change_list)
+        self.finish_change_list(change_list, commit)
+        if (resource_list is not None):
+            resource_list.md_completed = change_list.md_until
+        self.logger.info("Incremental scan listed %d directories, carried "
+                         "over %d, found %d changes" %
+                         (self.dirs_listed, self.dirs_carried,
+                          len(change_list)))
+        return(resource_list, change_list)
+
+    def rescan_dirs(self, dirpaths, commit=True):
+        """Update the state for just the directories in dirpaths
+
+        Each directory is listed again (but not the subdirectories already
+        known) and the ChangeList of changes found is returned. New
+        subdirectories are scanned completely. This is intended for use
+        where something else, such as inotify, reports which directories
+        have changed. The commit argument is as for scan().
+        """
+        self.compile_excludes()
+        change_list = self.start_change_list()
+        for dirpath in sorted(set(dirpaths)):
+            if (not os.path.isdir(dirpath)):
+                self.delete_dir(dirpath, change_list)
+                continue
+            known = set(row[0] for row in self.db.execute(
+                "SELECT path FROM dirs WHERE parent=? AND path!=?",
+                (dirpath, dirpath)))
+            dirs = self.list_dir(dirpath, None, change_list)
+            for subdir in dirs:
+                if (subdir not in known):
+                    self.scan_path(subdir, None, change_list)
+        self.finish_change_list(change_list, commit)
+        return(change_list)
+
+    def start_change_list(self):
+        """New ChangeList for changes since the last scan"""
+        change_list = ChangeList()
+        last_scan = self.last_scan
+        change_list.md_from = (last_scan if (last_scan is not None)
+                               else datetime_to_str())
+        self.dirs_listed = 0
+        self.dirs_carried = 0
+        self.scan_started = time.time()
+        return(change_list)
+
+    def finish_change_list(self, change_list, commit=True):
+        """Set md_until for change_list and record the scan in the state
+
+        The state is committed unless commit is False.
+        """
+        change_list.md_until = datetime_to_str()
+        self.db.execute(
+            "INSERT OR REPLACE INTO meta VALUES ('last_scan', ?)",
+            (change_list.md_until,))
+        if (commit):
+            self.commit()
+
+    def commit(self):
+        """Commit the state, and the digest cache if used"""
+        self.db.commit()
+        if (self.digest_cache is not None):
+            self.digest_cache.commit()
+
+    def rollback(self):
+        """Discard state not yet committed, as if the scan was not done"""
+        self.db.rollback()
+
+    def scan_path(self, path, resource_list, change_list):
+        """Scan the tree at path, adding to resource_list and change_list
+
+        resource_list may be None if only change_list is wanted.
+        """
+        if (not os.path.isdir(path)):
+            raise ValueError("Incremental scan requires a directory, got %s"
+                             % (path))
+        stack = [os.path.normpath(path)]
+        while (len(stack) > 0):
+            dirpath = stack.pop()
+            try:
+                dir_stat = os.stat(dirpath)
+            except OSError:
+                # removed since parent listed
+                self.delete_dir(dirpath, change_list)
+                continue
+            row = self.db.execute("SELECT mtime_ns FROM dirs WHERE path=?",
+                                  (dirpath,)).fetchone()
+            if (row is not None and row[0] == dir_stat.st_mtime_ns):
+                (files, dirs) = self.carry_dir(dirpath, change_list)
+                for (file, file_stat, old) in files:
+                    self.add_scanned_file(file, dirpath, file_stat, old,
+                                          resource_list, change_list)
+            else:
+                dirs = self.list_dir(dirpath, resource_list, change_list,
+                                     dir_stat)
+            for subdir in reversed(dirs):
+                stack.append(subdir)
+
+    def list_dir(self, dirpath, resource_list, change_list, dir_stat=None):
+        """List and record one new or changed directory
+
+        Adds the files in dirpath to resource_list (unless None) and
+        any changes to change_list. Returns the list of subdirectories.
+        """
+        if (dir_stat is None):
+            dir_stat = os.stat(dirpath)
+        (files, dirs) = self.relist_dir(dirpath, change_list)
+        mtime_ns = dir_stat.st_mtime_ns
+        if (dir_stat.st_mtime > self.scan_started - self.racy_window):
+            # might change again within the same mtime tick
+            mtime_ns = -1
+        self.db.execute(
+            "INSERT OR REPLACE INTO dirs VALUES (?,?,?)",
+            (dirpath, os.path.dirname(dirpath), mtime_ns))
+        for (file, file_stat, old) in files:
+            self.add_scanned_file(file, dirpath, file_stat, old,
+                                  resource_list, change_list)
+        return(dirs)
+
+    def carry_dir(self, dirpath, change_list):
+        """Return ([(file, stat, old),...], [subdir,...]) from the state
+
+        Used for a directory that has not changed since the last scan.
+        The stat is None if self.trust_dir_mtimes is set and otherwise
+        from os.stat(), old is the state entry for the file. Entries
+        now excluded are reported as deleted.
+        """
+        self.dirs_carried += 1
+        files = []
+        for old in self.db.execute(
+                "SELECT path, timestamp, mtime_ns, size, digests FROM files "
+                "WHERE dir=? ORDER BY path", (dirpath,)).fetchall():
+            file = old[0]
+            if (self.exclude_file(os.path.basename(file), file)):
+                self.delete_file(old, change_list)
+                continue
+            file_stat = None
+            if (not self.trust_dir_mtimes):
+                try:
+                    file_stat = os.stat(file)
+                except OSError:
+                    # will be reported as deleted when the directory
+                    # is listed in the next scan
+                    continue
+            files.append((file, file_stat, old))
+        dirs = []
+        for row in self.db.execute(
+                "SELECT path FROM dirs WHERE parent=? AND path!=? ORDER BY path",
+                (dirpath, dirpath)).fetchall():
+            if (self.exclude_dir(row[0])):
+                self.delete_dir(row[0], change_list)
+            else:
+                dirs.append(row[0])
+        return(files, dirs)
+
+    def relist_dir(self, dirpath, change_list):
+        """Return ([(file, stat, old),...], [subdir,...]) from listing
+
+        Used for a new or changed directory. Files and subdirectories in
+        the state but no longer present are reported as deleted.
+        """
+        self.dirs_listed += 1
+        (listed_files, dirs) = self._list_dir(dirpath)
+        olds = {}
+        for old in self.db.execute(
+                "SELECT path, timestamp, mtime_ns, size, digests FROM files "
+                "WHERE dir=?", (dirpath,)):
+            olds[old[0]] = old
+        files = []
+        for (file, file_stat) in listed_files:
+            files.append((file, file_stat, olds.pop(file, None)))
+        for file in sorted(olds.keys()):
+            self.delete_file(olds[file], change_list)
+        listed_dirs = set(dirs)
+        for row in self.db.execute(
+                "SELECT path FROM dirs WHERE parent=? AND path!=? ORDER BY path",
+                (dirpath, dirpath)).fetchall():
+            if (row[0] not in listed_dirs):
+                self.delete_dir(row[0], change_list)
+        return(files, dirs)
+
+    def add_scanned_file(self, file, dirpath, file_stat, old,
+                         resource_list, change_list):
+        """Add resource for file, recording any change"""
+        uri = self.mapper.dst_to_src(file)
+        if (uri is None):
+            raise Exception("Internal error, mapping failed")
+        if (file_stat is None):
+            # trusted carry over unless digests needed
+            digests = json.loads(old[4])
+            if (not all((name in digests) for name in self.digests)):
+                try:
+                    file_stat = os.stat(file)
+                except OSError:
+                    return
+        if (file_stat is None):
+            (timestamp, size) = (old[1], old[3])
+            change = None
+        else:
+            timestamp = file_stat.st_mtime
+            size = file_stat.st_size
+            if (old is None):
+                change = 'created'
+            elif (old[2] != file_stat.st_mtime_ns or old[3] != size):
+                change = 'updated'
+            else:
+                change = None
+            digests = ({} if (old is None or change is not None)
+                       else json.loads(old[4]))
+            if (not all((name in digests) for name in self.digests)):
+                try:
+                    digests.update(self.file_digests(file, file_stat))
+                except OSError as e:
+                    sys.stderr.write("Ignoring file %s (error: %s)" %
+                                     (file, str(e)))
+                    return
+                if (change is None and old is not None):
+                    # only the set of digests changed, not the file
+                    self.save_file(file, dirpath, file_stat, digests)
+            if (change is not None):
+                self.save_file(file, dirpath, file_stat, digests)
+        r = Resource.from_fields(
+            uri=uri, timestamp=timestamp,
+            path=(file if self.set_path else None),
+            md5=(digests.get('md5') if self.set_md5 else None),
+            sha1=(digests.get('sha1') if self.set_sha1 else None),
+            sha256=(digests.get('sha256') if self.set_sha256 else None),
+            length=(size if self.set_length else None))
+        if (resource_list is not None):
+            resource_list.add(r)
+        if (change is not None):
+            change_list.add(Resource(resource=r, change=change))
+
+    def file_digests(self, file, file_stat):
+        """Dict of the digests required for file"""
+        if (not self.digests):
+            return({})
+        if (self.digest_cache is not None):
+            return(self.digest_cache.digests_for_file(file, self.digests,
+                                                      file_stat))
+        return(compute_digests_for_file(file, self.digests))
+
+    def save_file(self, file, dirpath, file_stat, digests):
+        self.db.execute(
+            "INSERT OR REPLACE INTO files VALUES (?,?,?,?,?,?)",
+            (file, dirpath, file_stat.st_mtime, file_stat.st_mtime_ns,
+             file_stat.st_size, json.dumps(digests)))
+
+    def delete_file(self, old, change_list):
+        """Remove file from the state and report as deleted"""
+        self.db.execute("DELETE FROM files WHERE path=?", (old[0],))
+        uri = self.mapper.dst_to_src(old[0])
+        if (uri is not None):
+            change_list.add(Resource(uri=uri, timestamp=old[1],
+                                     change='deleted'))
+
+    def delete_dir(self, dirpath, change_list):
+        """Remove directory and everything below it from the state"""
+        # paths below dirpath are those between dirpath + '/' and
+        # dirpath + '0' as '0' follows '/'
+        lower = dirpath + os.sep
+        upper = dirpath + chr(ord(os.sep) + 1)
+        for old in self.db.execute(
+                "SELECT path, timestamp FROM files WHERE path>? AND path<? "
+                "ORDER BY path", (lower, upper)).fetchall():
+            self.delete_file(old, change_list)
+        self.db.execute("DELETE FROM dirs WHERE path=? OR "
+                        "(path>? AND path<?)", (dirpath, lower, upper))
+
+    def close(self):
+        """Close the state database, discarding any uncommitted state"""
+        if (self.db is not None):
+            self.db.close()
+            self.db = None
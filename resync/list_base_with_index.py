@@ -15,6 +15,26 @@ from resync.resource import Resource
 from resync.mapper import MapperError
 from resync.url_authority import UrlAuthority
 from resync.utils import compute_md5_for_file
+from resync.w3c_datetime import str_to_datetime
+
+
+def in_time_window(resource, from_timestamp=None, until_timestamp=None):
+    """True if resource may describe changes in the time window given
+
+    resource is an entry, such as a component sitemap in a sitemapindex or
+    a Change List in a Change List Archive, with md_from and md_until
+    giving the period it covers. It is outside the window if md_until
+    is before from_timestamp or md_from is after until_timestamp. Entries
+    without md_from or md_until are taken to cover all times before or
+    after respectively.
+    """
+    if (from_timestamp is not None and resource.md_until is not None and
+            str_to_datetime(resource.md_until) < from_timestamp):
+        return(False)
+    if (until_timestamp is not None and resource.md_from is not None and
+            str_to_datetime(resource.md_from) > until_timestamp):
+        return(False)
+    return(True)
 
 
 class ListBaseIndexError(Exception):
@@ -71,7 +91,8 @@ class ListBaseWithIndex(ListBase):
 
     # #### INPUT #####
 
-    def read(self, uri=None, resources=None, index_only=False):
+    def read(self, uri=None, resources=None, index_only=False,
+             from_timestamp=None, until_timestamp=None):
         """Read sitemap from a URI including handling sitemapindexes
 
         If index_only is True then individual sitemaps references in a
@@ -79,6 +100,12 @@ class ListBaseWithIndex(ListBase):
         returned and is useful only to read the metadata and links listed in
         the sitemapindex.
 
+        If from_timestamp or until_timestamp is given then only the
+        component sitemaps of a sitemapindex that may have entries in that
+        time window, according to the md_from and md_until given for them
+        in the sitemapindex, are read. Entries of the sitemaps read are not
+        filtered so entries outside the window may still be included.
+
         Includes the subtlety that if the input URI is a local file and is a
         sitemapindex which contains URIs for the individual sitemaps, then
         these are mapped to the filesystem also.
@@ -102,7 +129,9 @@ class ListBaseWithIndex(ListBase):
             pass
         self.logger.info("Read sitemap/sitemapindex from %s" % (uri))
         s = self.new_sitemap()
-        s.parse_xml(fh=fh, resources=self, capability=self.capability_name)
+        index = ListBase()
+        s.parse_xml(fh=fh, resources=self, capability=self.capability_name,
+                    index_resources=index)
         fh.close()
         # what did we read? sitemap or sitemapindex?
         if (s.parsed_index):
@@ -112,18 +141,27 @@ class ListBaseWithIndex(ListBase):
                     "Got sitemapindex from %s but support for sitemapindex "
                     "disabled" % (uri))
             self.logger.info("Parsed as sitemapindex, %d sitemaps" %
-                             (len(self.resources)))
+                             (len(index)))
             sitemapindex_is_file = self.is_file_uri(uri)
             if (index_only):
-                # don't read the component sitemaps
+                # don't read the component sitemaps, keep the index entries
+                # in the storage already in use
                 self.sitemapindex = True
+                if (hasattr(self.resources, 'add')):
+                    for r in index:
+                        self.resources.add(r)
+                else:
+                    self.resources.extend(index)
                 return
             # now loop over all entries to read each sitemap and add to
             # resources
-            sitemaps = self.resources
-            self.resources = self.resources_class()
-            self.logger.info("Now reading %d sitemaps" % len(sitemaps.uris()))
-            for sitemap_uri in sorted(sitemaps.uris()):
+            sitemaps = [r for r in index if
+                        in_time_window(r, from_timestamp, until_timestamp)]
+            if (len(sitemaps) < len(index)):
+                self.logger.info("Skipping %d sitemaps outside time window" %
+                                 (len(index) - len(sitemaps)))
+            self.logger.info("Now reading %d sitemaps" % len(sitemaps))
+            for sitemap_uri in sorted(r.uri for r in sitemaps):
                 if(not sitemap_uri.startswith('http')):
                     sitemap_uri = 'file://' + os.path.abspath(sitemap_uri)
                 self.read_component_sitemap(
@@ -146,6 +184,8 @@ class ListBaseWithIndex(ListBase):
                 sitemap_uri = self.mapper.src_to_dst(remote_uri)
                 self.logger.info("Mapped %s to local file %s" %
                                  (remote_uri, sitemap_uri))
+                if (not re.match(r'\w{3,4}:', sitemap_uri)):
+                    sitemap_uri = 'file://' + os.path.abspath(sitemap_uri)
             else:
                 # The individual sitemaps should be at a URL
                 # (scheme/server/path)
@@ -176,7 +216,7 @@ class ListBaseWithIndex(ListBase):
         component = sitemap.parse_xml(fh=fh, sitemapindex=False)
         # Copy resources into self, check any metadata
         for r in component:
-            self.resources.add(r)
+            self.add(r)
         fh.close()
         # FIXME - if rel="up" check it goes to correct place
         # FIXME - check capability
@@ -1,4 +1,14 @@
-"""Map between source URIs and destination paths"""
+"""Map between source URIs and destination paths
+
+A Mapper holds an ordered list of Map objects, each mapping a source
+base URI to a destination base path. A URI or path is translated by the
+first map in order whose base is a prefix of it (followed by a /).
+Lookups are done through tries over the / separated components of the
+bases, and the result for each directory is cached, so that the cost
+does not grow with the number of maps. The tries are rebuilt if maps
+are added or the mappings list is replaced, but not if the Map objects
+are changed in place.
+"""
 import os.path
 import re
 import urllib.parse
@@ -14,6 +24,8 @@ class Mapper():
     def __init__(self, mappings=None, use_default_path=False):
         self.logger = logging.getLogger('resync.mapper')
         self.mappings = []
+        self.cache_size = 10000
+        self._indexed = None
         if (mappings):
             self.parse(mappings, use_default_path)
 
@@ -92,25 +104,61 @@ class Mapper():
 
     def dst_to_src(self, dst_file):
         """Map destination path to source URI"""
-        for mapping in self.mappings:
-            src_uri = mapping.dst_to_src(dst_file)
-            if (src_uri is not None):
-                return(src_uri)
-        # Must have failed if loop exited
-        raise MapperError(
-            "Unable to translate destination path (%s) into a source URI."
-            "" % (dst_file))
+        self._check_index()
+        mapping = self._find(dst_file, self._dst_trie, self._dst_cache)
+        if (mapping is None):
+            raise MapperError(
+                "Unable to translate destination path (%s) into a source URI."
+                "" % (dst_file))
+        return(mapping.src_uri + dst_file[len(mapping.dst_path):])
 
     def src_to_dst(self, src_uri):
         """Map source URI to destination path"""
-        for mapping in self.mappings:
-            dst_path = mapping.src_to_dst(src_uri)
-            if (dst_path is not None):
-                return(dst_path)
-        # Must have failed if loop exited
-        raise MapperError(
-            "Unable to translate source URI (%s) into a destination path."
-            "" % (src_uri))
+        self._check_index()
+        mapping = self._find(src_uri, self._src_trie, self._src_cache)
+        if (mapping is None):
+            raise MapperError(
+                "Unable to translate source URI (%s) into a destination path."
+                "" % (src_uri))
+        return(mapping.dst_path + src_uri[len(mapping.src_uri):])
+
+    def _find(self, name, trie, cache):
+        """First Map in order with a base that is a prefix of name
+
+        Only the part of name up to the last / can affect which map
+        applies so the result is cached for that part.
+        """
+        slash = name.rfind('/')
+        if (slash < 0):
+            return(None)
+        dirname = name[:slash]
+        try:
+            return(cache[dirname])
+        except KeyError:
+            pass
+        if (len(cache) >= self.cache_size):
+            cache.clear()
+        mapping = trie.first_prefix_of(dirname.split('/'))
+        cache[dirname] = mapping
+        return(mapping)
+
+    def _check_index(self):
+        """Rebuild the tries if self.mappings has been changed"""
+        if (self._indexed is not self.mappings or
+                self._indexed_len != len(self.mappings)):
+            self._index()
+
+    def _index(self):
+        """Build the tries over self.mappings and reset the caches"""
+        self._dst_trie = _ComponentTrie()
+        self._src_trie = _ComponentTrie()
+        for (order, mapping) in enumerate(self.mappings):
+            self._dst_trie.add(mapping.dst_path.split('/'), order, mapping)
+            self._src_trie.add(mapping.src_uri.split('/'), order, mapping)
+        self._dst_cache = {}
+        self._src_cache = {}
+        self._indexed = self.mappings
+        self._indexed_len = len(self.mappings)
 
     def path_from_uri(self, uri):
         """Make a safe path name from uri
@@ -147,7 +195,6 @@ class Map:
     def __init__(self, src_uri=None, dst_path=None):
         self.src_uri = self.strip_trailing_slashes(src_uri)
         self.dst_path = self.strip_trailing_slashes(dst_path)
-        self.logger = logging.getLogger(__name__)
 
     def strip_trailing_slashes(self, path):
         """Return input path minus any trailing slashes"""
@@ -160,27 +207,23 @@ class Map:
         """Return the src URI from the dst filepath
 
         This does not rely on the destination filepath actually existing on
-        the local filesystem, just on pattern matching. Return source URI on
+        the local filesystem, just on prefix matching. Return source URI on
         success, None on failure.
         """
-        m = re.match(self.dst_path + "/(.*)$", dst_file)
-        self.logger.debug(self.dst_path + "/(.*)$ - " + dst_file)
-        if (m is None):
+        prefix = self.dst_path + '/'
+        if (not dst_file.startswith(prefix)):
             return(None)
-        rel_path = m.group(1)
-        self.logger.debug('src_uri:'+self.src_uri)
-        return(self.src_uri + '/' + rel_path)
+        return(self.src_uri + dst_file[len(self.dst_path):])
 
     def src_to_dst(self, src_uri):
         """Return the dst filepath from the src URI
 
         Returns None on failure, destination path on success.
         """
-        m = re.match(self.src_uri + "/(.*)$", src_uri)
-        if (m is None):
+        prefix = self.src_uri + '/'
+        if (not src_uri.startswith(prefix)):
             return(None)
-        rel_path = m.group(1)
-        return(self.dst_path + '/' + rel_path)
+        return(self.dst_path + src_uri[len(self.src_uri):])
 
     def unsafe(self):
         """True is the mapping is unsafe for an update
@@ -199,3 +242,36 @@ class Map:
 
     def __repr__(self):
         return("Map( %s -> %s )" % (self.src_uri, self.dst_path))
+
+
+class _ComponentTrie(object):
+    """Trie over the / separated components of map bases
+
+    Each node is a [children, order, mapping] list where order and
+    mapping are set for a node at the end of a base, with the lowest
+    order if several maps have the same base.
+    """
+
+    def __init__(self):
+        self.root = [{}, None, None]
+
+    def add(self, components, order, mapping):
+        node = self.root
+        for component in components:
+            node = node[0].setdefault(component, [{}, None, None])
+        if (node[1] is None or order < node[1]):
+            node[1] = order
+            node[2] = mapping
+
+    def first_prefix_of(self, components):
+        """Mapping with the lowest order that has a base which is all or a
+        leading part of components, else None"""
+        best = None
+        node = self.root
+        for component in components:
+            node = node[0].get(component)
+            if (node is None):
+                break
+            if (node[1] is not None and (best is None or node[1] < best[1])):
+                best = node
+        return(None if (best is None) else best[2])
@@ -158,6 +158,41 @@ class Resource(object):
         if (self.uri is None):
             raise ValueError("Cannot create resource without a URI")
 
+    @classmethod
+    def from_fields(cls, uri, timestamp=None, length=None, md5=None,
+                    sha1=None, sha256=None, mime_type=None, change=None,
+                    path=None, extra=None, ln=None):
+        """Fast construction of a Resource from core attribute values
+
+        Intended for trusted input such as values already parsed from a
+        sitemap or taken from a disk scan where many resources are created.
+        Unlike __init__(), values are assigned directly to the slots without
+        going through __setattr__, and there is no support for copying from
+        another resource or for setting timestamps from W3C Datetime strings.
+        The change value and the presence of uri are still checked. The extra
+        parameter may be a dict of non-core attributes (e.g. ts_at), which is
+        used without copying.
+        """
+        if (uri is None):
+            raise ValueError("Cannot create resource without a URI")
+        if (change is not None and Resource.CHANGE_TYPES and
+                change not in Resource.CHANGE_TYPES):
+            raise ChangeTypeError(change)
+        r = object.__new__(cls)
+        set_slot = object.__setattr__
+        set_slot(r, 'uri', uri)
+        set_slot(r, 'timestamp', timestamp)
+        set_slot(r, 'length', length)
+        set_slot(r, 'mime_type', mime_type)
+        set_slot(r, 'md5', md5)
+        set_slot(r, 'sha1', sha1)
+        set_slot(r, 'sha256', sha256)
+        set_slot(r, 'change', change)
+        set_slot(r, 'path', path)
+        set_slot(r, '_extra', extra)
+        set_slot(r, 'ln', ln)
+        return(r)
+
     def __setattr__(self, prop, value):
         # Add validity check for self.change
         if (prop == 'change' and Resource.CHANGE_TYPES and
@@ -10,7 +10,7 @@ base class for ResourceList, ChangeList, etc. This class provides
 only the data storage and manipulation, the ListBase class
 adds IO.
 """
-import collections
+import collections.abc
 from resync.w3c_datetime import datetime_to_str
 
 
@@ -38,6 +38,9 @@ class ResourceContainer(object):
         self.ln = (ln if (ln is not None) else [])
         self.uri = uri
         self.capability_name = capability_name
+        if (hasattr(self.resources, 'attach')):
+            # storage that keeps md and ln, e.g. ResourceListSqlite
+            self.resources.attach(self)
 
     def __iter__(self):
         """Iterator over all the resources in this resource list
@@ -189,7 +192,7 @@ class ResourceContainer(object):
 
         Must be implemented in derived class
         """
-        if isinstance(resource, collections.Iterable):
+        if isinstance(resource, collections.abc.Iterable):
             for r in resource:
                 self.resources.append(r)
         else:
@@ -17,9 +17,10 @@ Described in specification at:
 http://www.openarchives.org/rs/resourcesync#DescResources
 """
 
-import collections
+import collections.abc
 
 from resync.list_base_with_index import ListBaseWithIndex
+from resync.resource_list_compare import compare_iter, hash_compare_iter
 
 
 class ResourceListDict(dict):
@@ -30,6 +31,8 @@ class ResourceListDict(dict):
     - is iterable and results given in alphanumeric order by resource.uri
     """
 
+    uri_ordered = True
+
     def __iter__(self):
         """Iterator over all the resources in this resource_list"""
         self._iter_next_list = sorted(self.keys())
@@ -123,6 +126,11 @@ class ResourceList(ListBaseWithIndex):
 
     rl = ResourceList( resources_class=ResourceDictOrdered )
 
+    For lists too big to hold in memory the resources may instead be
+    stored on disk, see ResourceListSqlite:
+
+    rl = ResourceList( resources_class=ResourceListSqlite )
+
     In normal use it is expected that any Resource List Index will be
     created automatically when writing out a large Resource List in
     multiple sitemap rs. However, should it be necessary to
@@ -145,7 +153,7 @@ class ResourceList(ListBaseWithIndex):
                                            resources_class=resources_class)
 
     def remove(self, resource):
-        if isinstance(resource, collections.Iterable):
+        if isinstance(resource, collections.abc.Iterable):
             for r in resource:
                 self.resources.remove(r)
 
@@ -155,7 +163,7 @@ class ResourceList(ListBaseWithIndex):
         Will throw a ValueError if the resource (ie. same uri) already
         exists in the resource_list, unless replace=True.
         """
-        if isinstance(resource, collections.Iterable):
+        if isinstance(resource, collections.abc.Iterable):
             for r in resource:
                 self.resources.add(r, replace)
         else:
@@ -169,44 +177,39 @@ class ResourceList(ListBaseWithIndex):
         written to work for any objects in self and sc, provided that the
         == operator can be used to compare them.
 
-        The functioning of this method depends on the iterators for self and
-        src providing access to the resource objects in URI order.
+        If the resources of both self and src are stored in classes that
+        iterate in URI order (with the uri_ordered attribute set True) then
+        a merge of the two is used, otherwise a hash join that does not
+        depend on order. Results are the same either way. The results are
+        stored using self.resources_class.
         """
-        dst_iter = iter(self.resources)
-        src_iter = iter(src.resources)
-        same = ResourceList()
-        updated = ResourceList()
-        deleted = ResourceList()
-        created = ResourceList()
-        dst_cur = next(dst_iter, None)
-        src_cur = next(src_iter, None)
-        while ((dst_cur is not None) and (src_cur is not None)):
-            # print 'dst='+dst_cur+'  src='+src_cur
-            if (dst_cur.uri == src_cur.uri):
-                if (dst_cur == src_cur):
-                    same.add(dst_cur)
-                else:
-                    updated.add(src_cur)
-                dst_cur = next(dst_iter, None)
-                src_cur = next(src_iter, None)
-            elif (not src_cur or dst_cur.uri < src_cur.uri):
-                deleted.add(dst_cur)
-                dst_cur = next(dst_iter, None)
-            elif (not dst_cur or dst_cur.uri > src_cur.uri):
-                created.add(src_cur)
-                src_cur = next(src_iter, None)
-            else:
-                raise Exception("this should not be possible")
-        # what do we have leftover in src or dst lists?
-        while (dst_cur is not None):
-            deleted.add(dst_cur)
-            dst_cur = next(dst_iter, None)
-        while (src_cur is not None):
-            created.add(src_cur)
-            src_cur = next(src_iter, None)
+        same = ResourceList(resources_class=self.resources_class)
+        updated = ResourceList(resources_class=self.resources_class)
+        deleted = ResourceList(resources_class=self.resources_class)
+        created = ResourceList(resources_class=self.resources_class)
+        results = {'same': same, 'updated': updated,
+                   'deleted': deleted, 'created': created}
+        for (status, resource) in self.compare_iter(src, include_same=True):
+            results[status].add(resource)
         # have now gone through both lists
         return(same, updated, deleted, created)
 
+    def compare_iter(self, src, include_same=False):
+        """Iterator over (status, resource) from comparison with src
+
+        Same comparison as compare() but results are yielded one at a
+        time instead of being accumulated in new ResourceList objects,
+        and resources that are the same are skipped unless include_same
+        is True. See resync.resource_list_compare.compare_iter() and
+        hash_compare_iter().
+        """
+        if (getattr(self.resources, 'uri_ordered', False) and
+                getattr(src.resources, 'uri_ordered', False)):
+            return(compare_iter(iter(self.resources), iter(src.resources),
+                                include_same=include_same))
+        return(hash_compare_iter(self.resources, src.resources,
+                                 include_same=include_same))
+
     def has_md5(self):
         """Return true if at least one contained resource-like object has md5
         data"""
@@ -5,29 +5,42 @@ Currently implements build from files on disk only.
 Attributes:
 - set_path set true to add path attribute for each resource
 - set_md5 set true to calculate MD5 sums for all files
+- set_sha1, set_sha256 set true to calculate SHA-1 and SHA-256 digests,
+  all digests requested are calculated in a single read of each file
 - set_length set true to include file length in resource_list (defaults true)
+- exclude_files is a list of regexes matched against file names
 - exclude_dirs is a list of directory names to exclude
   (defaults to ['CVS','.git'))
-
-FIXME - should add options to set sha1 and sha256 in addition or as
-alternatives to md5.
+- exclude_globs is a list of glob patterns, those without a / are matched
+  against file and directory names and those with a / against full paths
+- scan_workers is the number of threads used to list directories
+  concurrently (defaults to 4), useful for high-latency file systems
+- checksum_workers is the number of threads used to calculate digests
+  in parallel with the scan when any digest is set (defaults to 1, to
+  calculate inline)
+- digest_cache may be set to a DigestCache object so that digests are
+  calculated only for files that have changed since they were cached
 """
 
 import sys
+import os
 import os.path
-import re
 import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 
+from resync.exclude_matcher import ExcludeMatcher
 from resync.resource import Resource
-from resync.resource_list import ResourceList
-from resync.utils import compute_md5_for_file
+from resync.resource_list import ResourceList, ResourceListDict
+from resync.utils import compute_digests_for_file
 from resync.w3c_datetime import datetime_to_str
 
 
 class ResourceListBuilder():
 
     def __init__(self, mapper=None, set_md5=False, set_length=True,
-                 set_path=False):
+                 set_path=False, resources_class=ResourceListDict,
+                 set_sha1=False, set_sha256=False):
         """Create ResourceListBuilder object, optionally set options
 
         The mapper attribute must be set before a call to from_disk() in order
@@ -38,19 +51,39 @@ class ResourceListBuilder():
         - set_md5 - True to add md5 digests for each resource. This may add
         significant time to the scan process as each file has to be read to
         compute the sum
+        - set_sha1, set_sha256 - True to add sha1 and/or sha256 digests, these
+        are calculated in the same read of each file as any md5
         - set_length - False to not add length for each resources
         - set_path - True to add local path information for each file/resource
+
+        The resources_class is used to create the storage for a new
+        ResourceList, e.g. ResourceListSqlite for lists bigger than memory.
         """
         self.mapper = mapper
+        self.resources_class = resources_class
         self.set_path = set_path
         self.set_md5 = set_md5
+        self.set_sha1 = set_sha1
+        self.set_sha256 = set_sha256
         self.set_length = set_length
         self.exclude_files = ['sitemap\d{0,5}.xml']
         self.exclude_dirs = ['CVS', '.git']
+        self.exclude_globs = []
         self.include_symlinks = False
+        self.scan_workers = 4
+        self.checksum_workers = 1
+        self.digest_cache = None
         # Used internally only:
         self.logger = logging.getLogger('resync.resource_list_builder')
-        self.compiled_exclude_files = []
+        self.excluder = ExcludeMatcher()
+
+    @property
+    def digests(self):
+        """Tuple of names of the digests to calculate for each file"""
+        return(tuple(name for (name, flag) in (('md5', self.set_md5),
+                                               ('sha1', self.set_sha1),
+                                               ('sha256', self.set_sha256))
+                     if flag))
 
     def add_exclude_files(self, exclude_patterns):
         """Add more patterns of rs to exclude while building
@@ -59,17 +92,24 @@ class ResourceListBuilder():
             self.exclude_files.append(pattern)
 
     def compile_excludes(self):
-        """Compile a set of regexps for rs to be exlcuded from scans"""
-        self.compiled_exclude_files = []
-        for pattern in self.exclude_files:
-            self.compiled_exclude_files.append(re.compile(pattern))
+        """Compile the exclude rules for files and dirs into self.excluder
+
+        Must be called again after changes to exclude_files, exclude_dirs
+        or exclude_globs.
+        """
+        self.excluder = ExcludeMatcher()
+        self.excluder.add_regexes(self.exclude_files)
+        self.excluder.add_dirs(self.exclude_dirs)
+        self.excluder.add_globs(self.exclude_globs)
+        self.excluder.compile()
 
-    def exclude_file(self, file):
+    def exclude_file(self, file, path=None):
         """True if file should be exclude based on name pattern"""
-        for pattern in self.compiled_exclude_files:
-            if (pattern.match(file)):
-                return(True)
-        return(False)
+        return(self.excluder.exclude_file(file, path))
+
+    def exclude_dir(self, dirpath):
+        """True if directory dirpath should not be scanned"""
+        return(self.excluder.exclude_dir(os.path.basename(dirpath), dirpath))
 
     def from_disk(self, resource_list=None, paths=None):
         """Create or extend resource_list with resources from disk scan
@@ -98,7 +138,7 @@ class ResourceListBuilder():
         """
         # Either use resource_list passed in or make a new one
         if (resource_list is None):
-            resource_list = ResourceList()
+            resource_list = ResourceList(resources_class=self.resources_class)
         # Compile exclude pattern matches
         self.compile_excludes()
         # Work out start paths from map if not explicitly specified
@@ -114,6 +154,8 @@ class ResourceListBuilder():
         for path in paths:
             self.logger.info("Scanning disk from %s" % (path))
             self.from_disk_add_path(path=path, resource_list=resource_list)
+        if (self.digest_cache is not None):
+            self.digest_cache.commit()
         # Set end time
         resource_list.md_completed = datetime_to_str()
         return(resource_list)
@@ -127,56 +169,200 @@ class ResourceListBuilder():
         # is path a directory or a file? for each file: create Resource object,
         # add, increment counter
         if os.path.isdir(path):
+            if (self.digests and self.checksum_workers > 1):
+                self.add_files_hashed_in_pool(resource_list,
+                                              self.scan_dir(path))
+                return
             num_files = 0
-            for dirpath, dirs, files in os.walk(path, topdown=True):
-                for file_in_dirpath in files:
-                    num_files += 1
-                    if (num_files % 50000 == 0):
-                        self.logger.info(
-                            "ResourceListBuilder.from_disk_add_path: "
-                            "%d rs..." % (num_files))
-                    self.add_file(resource_list=resource_list,
-                                  resource_dir=dirpath, file=file_in_dirpath)
-                    # prune list of dirs based on self.exclude_dirs
-                    for exclude in self.exclude_dirs:
-                        if exclude in dirs:
-                            self.logger.debug("Excluding dir %s" % (exclude))
-                            dirs.remove(exclude)
+            for (file, file_stat) in self.scan_dir(path):
+                num_files += 1
+                if (num_files % 50000 == 0):
+                    self.logger.info(
+                        "ResourceListBuilder.from_disk_add_path: "
+                        "%d rs..." % (num_files))
+                self.add_file(resource_list=resource_list, file=file,
+                              file_stat=file_stat)
         else:
             # single file
             self.add_file(resource_list=resource_list, file=path)
 
-    def add_file(self, resource_list=None, resource_dir=None, file=None):
+    def add_files_hashed_in_pool(self, resource_list, files):
+        """Add files to resource_list with digests from a pool of threads
+
+        The files iterable gives (file, stat) pairs as from scan_dir().
+        The digest for each file is calculated by one of
+        self.checksum_workers threads (hashlib releases the GIL while
+        hashing), the scan continuing meanwhile. Resources are added in
+        the same order as files with a limited number of digests pending
+        at any one time. Digests found in self.digest_cache are not
+        recalculated.
+        """
+        digests = self.digests
+        max_pending = 4 * self.checksum_workers
+        pending = deque()
+        num_files = 0
+        with ThreadPoolExecutor(max_workers=self.checksum_workers) as pool:
+            for (file, file_stat) in files:
+                num_files += 1
+                if (num_files % 50000 == 0):
+                    self.logger.info(
+                        "ResourceListBuilder.add_files_hashed_in_pool: "
+                        "%d rs..." % (num_files))
+                cached = None
+                if (self.digest_cache is not None):
+                    cached = self.digest_cache.get(file_stat, digests)
+                if (cached is not None):
+                    future = _Done(dict, cached)
+                else:
+                    future = pool.submit(compute_digests_for_file, file,
+                                         digests)
+                pending.append((file, file_stat, future, cached is None))
+                if (len(pending) > max_pending):
+                    self._add_hashed_file(resource_list, *pending.popleft())
+            while (len(pending) > 0):
+                self._add_hashed_file(resource_list, *pending.popleft())
+
+    def _add_hashed_file(self, resource_list, file, file_stat, future,
+                         new_digests):
+        """Add file once the digest calculation in future is complete"""
+        try:
+            digests = future.result()
+        except OSError as e:
+            sys.stderr.write("Ignoring file %s (error: %s)" % (file, str(e)))
+            return
+        if (new_digests and self.digest_cache is not None):
+            self.digest_cache.put(file_stat, digests)
+        self.add_file(resource_list=resource_list, file=file,
+                      file_stat=file_stat, digests=digests)
+
+    def scan_dir(self, path):
+        """Iterator over (file, stat) for files in the tree under path
+
+        Files are given in a deterministic order: those in each directory
+        sorted by name and then each subdirectory in turn. Directories
+        and files excluded by self.excluder (see compile_excludes()) and,
+        unless self.include_symlinks is set, symlinks are skipped.
+        Symlinks to directories are never followed.
+
+        Directories are listed with os.scandir() and the files stat-ed
+        by up to self.scan_workers threads so that listing of the
+        directories ahead of the current one proceeds concurrently.
+        """
+        if (self.scan_workers > 1):
+            pool = ThreadPoolExecutor(max_workers=self.scan_workers)
+            submit = pool.submit
+        else:
+            pool = None
+            submit = _Done
+        try:
+            stack = [submit(self._list_dir, path)]
+            while (len(stack) > 0):
+                (files, dirs) = stack.pop().result()
+                for file_and_stat in files:
+                    yield file_and_stat
+                for dirpath in reversed(dirs):
+                    stack.append(submit(self._list_dir, dirpath))
+        finally:
+            if (pool is not None):
+                pool.shutdown(wait=True, cancel_futures=True)
+
+    def _list_dir(self, dirpath):
+        """Return ([(file, stat),...], [subdir,...]) for one directory
+
+        Both lists are sorted by name. Uses the DirEntry objects from
+        os.scandir() so that, at most, one stat is needed for each file.
+        """
+        files = []
+        dirs = []
+        try:
+            entries = sorted(os.scandir(dirpath), key=_entry_name)
+        except OSError as e:
+            self.logger.warning("Ignoring directory %s (error: %s)" %
+                                (dirpath, str(e)))
+            return(files, dirs)
+        for entry in entries:
+            try:
+                if (entry.is_dir(follow_symlinks=False)):
+                    if (self.excluder.exclude_dir(entry.name, entry.path)):
+                        self.logger.debug("Excluding dir %s" % (entry.path))
+                    else:
+                        dirs.append(entry.path)
+                elif (entry.is_file() and
+                      (self.include_symlinks or not entry.is_symlink())):
+                    if self.excluder.exclude_file(entry.name, entry.path):
+                        self.logger.debug("Excluding file %s" % (entry.name))
+                    else:
+                        files.append((entry.path, entry.stat()))
+            except OSError as e:
+                sys.stderr.write("Ignoring file %s (error: %s)" %
+                                 (entry.path, str(e)))
+        return(files, dirs)
+
+    def add_file(self, resource_list=None, resource_dir=None, file=None,
+                 file_stat=None, digests=None):
         """Add a single file to resource_list
 
-        Follows object settings of set_path, set_md5 and set_length.
+        Follows object settings of set_path, set_md5, set_sha1, set_sha256
+        and set_length.
+
+        If file_stat is given then the file is taken to have been checked
+        already (as by scan_dir()) and no further tests are made. If
+        digests is given (a dict as from compute_digests_for_file()) then
+        it is used instead of calculating the digests.
         """
         try:
-            if self.exclude_file(file):
+            if (file_stat is None and self.exclude_file(file)):
                 self.logger.debug("Excluding file %s" % (file))
                 return
             # get abs filename and also URL
             if (resource_dir is not None):
                 file = os.path.join(resource_dir, file)
-            if (not os.path.isfile(file) or not
-                    (self.include_symlinks or not os.path.islink(file))):
-                return
+            if (file_stat is None):
+                if (not os.path.isfile(file) or not
+                        (self.include_symlinks or not os.path.islink(file))):
+                    return
+                file_stat = os.stat(file)
             uri = self.mapper.dst_to_src(file)
             if (uri is None):
                 raise Exception("Internal error, mapping failed")
-            file_stat = os.stat(file)
         except OSError as e:
             sys.stderr.write("Ignoring file %s (error: %s)" % (file, str(e)))
             return
         timestamp = file_stat.st_mtime  # UTC
-        r = Resource(uri=uri, timestamp=timestamp)
-        if (self.set_path):
+        if (digests is None):
+            digests = {}
+            if (self.digests):
+                try:
+                    if (self.digest_cache is not None):
+                        digests = self.digest_cache.digests_for_file(
+                            file, self.digests, file_stat)
+                    else:
+                        digests = compute_digests_for_file(file, self.digests)
+                except OSError as e:
+                    sys.stderr.write("Ignoring file %s (error: %s)" %
+                                     (file, str(e)))
+                    return
+        r = Resource.from_fields(
+            uri=uri, timestamp=timestamp,
             # add full local path
-            r.path = file
-        if (self.set_md5):
-            # add md5
-            r.md5 = compute_md5_for_file(file)
-        if (self.set_length):
+            path=(file if self.set_path else None),
+            # add digests
+            md5=digests.get('md5'), sha1=digests.get('sha1'),
+            sha256=digests.get('sha256'),
             # add length
-            r.length = file_stat.st_size
+            length=(file_stat.st_size if self.set_length else None))
         resource_list.add(r)
+
+
+def _entry_name(entry):
+    return(entry.name)
+
+
+class _Done(object):
+    """Stand-in for a Future when the result is available immediately"""
+
+    def __init__(self, func, *args):
+        self.value = func(*args)
+
+    def result(self):
+        return(self.value)
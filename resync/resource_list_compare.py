@@ -0,0 +1,259 @@
+"""Streaming comparison of resource lists
+
+ResourceList.compare() builds four new ResourceList objects (same,
+updated, deleted, created) and so needs memory proportional to the
+size of the lists. The functions here instead work on iterators
+of resources and yield results one at a time:
+
+    for (status, resource) in compare_iter(iter(dst), iter(src)):
+        # status is one of 'updated', 'deleted', 'created' (and 'same'
+        # if include_same is True)
+
+Both iterators must provide resources in URI order. Where resources
+are not available in that order, external_sort() will sort an
+iterable of resources of any size using sorted runs written to
+temporary files which are then merged:
+
+    for (status, resource) in compare_iter(external_sort(dst),
+                                           external_sort(src)):
+        ...
+
+Where the resources are in no particular order then hash_compare_iter()
+gives the same results in linear time without any sorting by building
+a dict of the smaller list and streaming the larger one.
+
+Where the lists are already held in columnar form (ResourceColumns)
+then compare_columns() does the same comparison with NumPy array
+operations instead of a Python loop over every resource. NumPy is
+an optional dependency needed only for this.
+"""
+
+import heapq
+import logging
+import pickle
+import tempfile
+
+
+def compare_iter(dst_iter, src_iter, include_same=False):
+    """Yield (status, resource) for each difference between two lists
+
+    The dst_iter and src_iter must be iterators over resources of
+    the destination and the source respectively, each in URI order.
+    The status is 'updated' (with the src resource) if the URI is in
+    both but the resources are not equal, 'deleted' (with the dst
+    resource) if only in the destination, and 'created' (with the
+    src resource) if only in the source. If include_same is True
+    then 'same' (with the dst resource) is yielded for URIs with
+    equal resources, otherwise they are skipped.
+
+    This is the same logic as ResourceList.compare() but with
+    memory use that does not depend on the size of the lists.
+    """
+    dst_cur = next(dst_iter, None)
+    src_cur = next(src_iter, None)
+    while ((dst_cur is not None) and (src_cur is not None)):
+        if (dst_cur.uri == src_cur.uri):
+            if (dst_cur == src_cur):
+                if (include_same):
+                    yield('same', dst_cur)
+            else:
+                yield('updated', src_cur)
+            dst_cur = next(dst_iter, None)
+            src_cur = next(src_iter, None)
+        elif (dst_cur.uri < src_cur.uri):
+            yield('deleted', dst_cur)
+            dst_cur = next(dst_iter, None)
+        else:
+            yield('created', src_cur)
+            src_cur = next(src_iter, None)
+    # what do we have leftover in src or dst lists?
+    while (dst_cur is not None):
+        yield('deleted', dst_cur)
+        dst_cur = next(dst_iter, None)
+    while (src_cur is not None):
+        yield('created', src_cur)
+        src_cur = next(src_iter, None)
+
+
+def hash_compare_iter(dst, src, include_same=False):
+    """Yield (status, resource) for each difference between two lists
+
+    The same as compare_iter() except that dst and src may be any
+    iterables of resources supporting len(), in any order. The smaller
+    is indexed in a dict by URI and the larger is streamed, so memory use
+    is proportional to the size of the smaller list. Results are yielded
+    in no particular order.
+    """
+    if (len(dst) <= len(src)):
+        index = dict((r.uri, r) for r in dst)
+        for src_cur in src:
+            dst_cur = index.pop(src_cur.uri, None)
+            if (dst_cur is None):
+                yield('created', src_cur)
+            elif (dst_cur == src_cur):
+                if (include_same):
+                    yield('same', dst_cur)
+            else:
+                yield('updated', src_cur)
+        for dst_cur in index.values():
+            yield('deleted', dst_cur)
+    else:
+        index = dict((r.uri, r) for r in src)
+        for dst_cur in dst:
+            src_cur = index.pop(dst_cur.uri, None)
+            if (src_cur is None):
+                yield('deleted', dst_cur)
+            elif (dst_cur == src_cur):
+                if (include_same):
+                    yield('same', dst_cur)
+            else:
+                yield('updated', src_cur)
+        for src_cur in index.values():
+            yield('created', src_cur)
+
+
+def external_sort(resources, run_size=100000, tmpdir=None):
+    """Yield resources from iterable resources in URI order
+
+    Resources are read in chunks of run_size, each chunk is sorted and
+    written as a run to a temporary file (in tmpdir if specified), and
+    the runs are then merged. Memory use is thus limited by run_size
+    rather than the number of resources. If all the resources fit in
+    a single run then no temporary file is used.
+    """
+    logger = logging.getLogger('resync.resource_list_compare')
+    runs = []
+    chunk = []
+    try:
+        for resource in resources:
+            chunk.append(resource)
+            if (len(chunk) >= run_size):
+                runs.append(_write_run(chunk, tmpdir))
+                chunk = []
+        if (len(runs) == 0):
+            chunk.sort(key=_uri)
+            for resource in chunk:
+                yield resource
+            return
+        if (len(chunk) > 0):
+            runs.append(_write_run(chunk, tmpdir))
+            chunk = []
+        logger.info("Merging %d sorted runs" % (len(runs)))
+        for resource in heapq.merge(*[_read_run(run) for run in runs],
+                                    key=_uri):
+            yield resource
+    finally:
+        for run in runs:
+            run.close()
+
+
+def _uri(resource):
+    return(resource.uri)
+
+
+def _write_run(chunk, tmpdir=None):
+    """Sort chunk and write to a temporary file, return the file"""
+    chunk.sort(key=_uri)
+    fh = tempfile.TemporaryFile(dir=tmpdir)
+    pickler = pickle.Pickler(fh, protocol=pickle.HIGHEST_PROTOCOL)
+    for resource in chunk:
+        pickler.dump(resource)
+        # Don't let the pickler memo keep every resource in memory
+        pickler.clear_memo()
+    return(fh)
+
+
+def _read_run(fh):
+    """Iterator over resources in a run written by _write_run()"""
+    fh.seek(0)
+    unpickler = pickle.Unpickler(fh)
+    while True:
+        try:
+            yield unpickler.load()
+        except EOFError:
+            return
+
+
+class ResourceColumns(object):
+    """Columnar form of a resource list for use with compare_columns()
+
+    Holds the data needed for comparison as parallel NumPy arrays:
+    - uri - URIs, must be unique
+    - timestamp - float timestamps, NaN where not specified
+    - length - integer lengths, -1 where not specified
+    - md5 - md5 digest strings, empty string where not specified
+    """
+
+    def __init__(self, uri, timestamp, length, md5):
+        np = _numpy()
+        self.uri = np.asarray(uri, dtype=str)
+        self.timestamp = np.asarray(timestamp, dtype=np.float64)
+        self.length = np.asarray(length, dtype=np.int64)
+        self.md5 = np.asarray(md5, dtype=str)
+
+    def __len__(self):
+        return(len(self.uri))
+
+    @classmethod
+    def from_resources(cls, resources):
+        """Create from an iterable of resource objects"""
+        uri = []
+        timestamp = []
+        length = []
+        md5 = []
+        for r in resources:
+            uri.append(r.uri)
+            timestamp.append(
+                float('nan') if (r.timestamp is None) else r.timestamp)
+            length.append(-1 if (r.length is None) else r.length)
+            md5.append('' if (r.md5 is None) else r.md5)
+        return(cls(uri, timestamp, length, md5))
+
+
+def compare_columns(dst, src, delta=1.0):
+    """Compare two ResourceColumns objects, dst and src
+
+    Returns (same, updated, deleted, created) where each is an array
+    of indexes: same and deleted are indexes into dst, updated and
+    created are indexes into src. Each is given in URI order. The
+    equality rules are those of Resource.equal(other, delta) where
+    the default delta of 1.0 is that used by Resource.__eq__, and so
+    results match ResourceList.compare().
+    """
+    np = _numpy()
+    (_, di, si) = np.intersect1d(dst.uri, src.uri, assume_unique=True,
+                                 return_indices=True)
+    # Only one side present
+    in_dst = np.zeros(len(dst.uri), dtype=bool)
+    in_dst[di] = True
+    deleted = np.flatnonzero(~in_dst)
+    deleted = deleted[np.argsort(dst.uri[deleted], kind='stable')]
+    in_src = np.zeros(len(src.uri), dtype=bool)
+    in_src[si] = True
+    created = np.flatnonzero(~in_src)
+    created = created[np.argsort(src.uri[created], kind='stable')]
+    # Both present: md5 decides if specified for both, else timestamp
+    # within delta if specified for either, and same length if specified
+    # for both
+    dmd5 = dst.md5[di]
+    smd5 = src.md5[si]
+    have_md5 = (dmd5 != '') & (smd5 != '')
+    dts = dst.timestamp[di]
+    sts = src.timestamp[si]
+    with np.errstate(invalid='ignore'):
+        ts_ok = ((np.isnan(dts) & np.isnan(sts)) |
+                 (np.abs(dts - sts) < delta))
+    dlen = dst.length[di]
+    slen = src.length[si]
+    len_ok = (dlen < 0) | (slen < 0) | (dlen == slen)
+    equal = np.where(have_md5, dmd5 == smd5, ts_ok & len_ok)
+    return(di[equal], si[~equal], deleted, created)
+
+
+def _numpy():
+    """Load NumPy late as it is needed only for the columnar compare"""
+    try:
+        import numpy
+    except ImportError:
+        raise ImportError("NumPy is required for columnar compare")
+    return(numpy)
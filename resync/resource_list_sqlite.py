@@ -0,0 +1,222 @@
+"""Disk-backed storage for resources in a ResourceList
+
+ResourceListSqlite is an alternative to ResourceListDict that keeps
+the resources in an SQLite database on disk rather than in memory.
+It may be used as the resources_class of a ResourceList (or passed
+in directly as the resources object) to handle lists that are far
+bigger than available memory:
+
+    rl = ResourceList(resources_class=ResourceListSqlite)
+
+in which case each new storage object will use a temporary database
+file that is deleted when the object is closed. To build a list that
+can be reopened later without reparsing XML, supply a filename:
+
+    rl = ResourceList(resources=ResourceListSqlite('/tmp/rl.sqlite'))
+    rl.read(uri='http://example.org/resourcelist.xml')
+    rl.resources.close()
+    ...
+    rl = ResourceList(resources=ResourceListSqlite('/tmp/rl.sqlite'))
+
+The metadata (such as md_at and md_completed) and links of the list
+are saved with the resources when the database is committed or closed,
+and are restored when the list is created with a reopened database.
+
+Iteration is in alphanumeric order by resource.uri, just as for
+ResourceListDict, so that ResourceList.compare() works unchanged.
+"""
+
+import json
+import os
+import sqlite3
+import tempfile
+import weakref
+
+from resync.resource import Resource
+from resync.resource_list import ResourceListDupeError
+
+# Core Resource attributes stored as columns, others go in extra (JSON)
+COLUMNS = ('uri', 'timestamp', 'length', 'md5', 'sha1', 'sha256',
+           'mime_type', 'change', 'path')
+
+
+class ResourceListSqlite(object):
+    """Implementation of class to store resources in an SQLite database
+
+    Key properties of this class are the same as for ResourceListDict:
+    - has add(resource, replace) and remove(resource) methods
+    - has uris() method and supports len()
+    - is iterable and results given in alphanumeric order by resource.uri
+
+    filename - database file to use. If not specified then a temporary
+        file is created and it is removed by close()
+
+    resource_class - class of objects created when iterating, defaults
+        to Resource
+
+    fetch_size - number of rows read from the database at a time when
+        iterating
+    """
+
+    uri_ordered = True
+
+    def __init__(self, filename=None, resource_class=Resource,
+                 fetch_size=1000):
+        self.temporary = (filename is None)
+        if (self.temporary):
+            (fd, filename) = tempfile.mkstemp(prefix='resync_', suffix='.sqlite')
+            os.close(fd)
+        self.filename = filename
+        self.resource_class = resource_class
+        self.fetch_size = fetch_size
+        self.db = sqlite3.connect(filename)
+        if (self.temporary):
+            # No need for crash safety for scratch data
+            self.db.execute("PRAGMA journal_mode=OFF")
+            self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS meta (name TEXT PRIMARY KEY, "
+            "value TEXT)")
+        self.container = None
+        self.db.execute(
+            "CREATE TABLE IF NOT EXISTS resources ("
+            "uri TEXT PRIMARY KEY, timestamp REAL, length INTEGER, "
+            "md5 TEXT, sha1 TEXT, sha256 TEXT, mime_type TEXT, "
+            "change TEXT, path TEXT, extra TEXT, ln TEXT)")
+        self.count = self.db.execute(
+            "SELECT COUNT(*) FROM resources").fetchone()[0]
+
+    def __len__(self):
+        return(self.count)
+
+    def __contains__(self, uri):
+        return(self.db.execute("SELECT 1 FROM resources WHERE uri=?",
+                               (uri,)).fetchone() is not None)
+
+    def __getitem__(self, uri):
+        row = self.db.execute("SELECT * FROM resources WHERE uri=?",
+                              (uri,)).fetchone()
+        if (row is None):
+            raise KeyError(uri)
+        return(self.resource_from_row(row))
+
+    def __iter__(self):
+        """Iterator over all the resources in order of resource.uri"""
+        cursor = self.db.execute("SELECT * FROM resources ORDER BY uri")
+        while True:
+            rows = cursor.fetchmany(self.fetch_size)
+            if (not rows):
+                break
+            for row in rows:
+                yield self.resource_from_row(row)
+
+    def uris(self):
+        """Return list of all URIs in sorted order"""
+        return([row[0] for row in
+                self.db.execute("SELECT uri FROM resources ORDER BY uri")])
+
+    def add(self, resource, replace=False):
+        """Add just a single resource"""
+        row = self.row_from_resource(resource)
+        if (replace):
+            exists = (resource.uri in self)
+            self.db.execute("INSERT OR REPLACE INTO resources VALUES "
+                            "(?,?,?,?,?,?,?,?,?,?,?)", row)
+            if (not exists):
+                self.count += 1
+        else:
+            try:
+                self.db.execute("INSERT INTO resources VALUES "
+                                "(?,?,?,?,?,?,?,?,?,?,?)", row)
+            except sqlite3.IntegrityError:
+                raise ResourceListDupeError(
+                    "Attempt to add resource already in resource_list")
+            self.count += 1
+
+    def remove(self, resource):
+        cursor = self.db.execute("DELETE FROM resources WHERE uri=?",
+                                 (resource.uri,))
+        self.count -= cursor.rowcount
+
+    def attach(self, container):
+        """Attach to the ResourceContainer that uses this storage
+
+        Any md and ln saved in the database are restored to container,
+        without replacing md values or links it already has. The md and
+        ln of container are saved by commit() and close().
+        """
+        self.container = weakref.ref(container)
+        for (name, value) in self.db.execute("SELECT name, value FROM meta"):
+            value = json.loads(value)
+            if (name == 'ln'):
+                if (not container.ln):
+                    container.ln = value
+            elif (name not in container.md):
+                container.md[name] = value
+
+    def save_meta(self):
+        """Save the md and ln of the attached container, if any"""
+        container = (self.container() if (self.container is not None)
+                     else None)
+        if (container is None):
+            return
+        self.db.execute("DELETE FROM meta")
+        meta = [(name, json.dumps(value))
+                for (name, value) in container.md.items()]
+        meta.append(('ln', json.dumps(container.ln)))
+        self.db.executemany("INSERT INTO meta VALUES (?,?)", meta)
+
+    def commit(self):
+        """Commit any pending changes to the database file"""
+        self.save_meta()
+        self.db.commit()
+
+    def close(self):
+        """Commit and close the database, removing it if temporary"""
+        if (self.db is None):
+            return
+        self.save_meta()
+        self.db.commit()
+        self.db.close()
+        self.db = None
+        if (self.temporary and os.path.exists(self.filename)):
+            os.unlink(self.filename)
+
+    def __del__(self):
+        try:
+            self.close()
+        except Exception:
+            pass
+
+    def row_from_resource(self, resource):
+        """Tuple of column values to store for resource"""
+        row = [getattr(resource, att, None) for att in COLUMNS]
+        extra = getattr(resource, '_extra', None)
+        row.append(None if (not extra) else json.dumps(extra))
+        ln = getattr(resource, 'ln', None)
+        row.append(None if (not ln) else json.dumps(ln))
+        return(row)
+
+    def resource_from_row(self, row):
+        """New resource object from a database row
+
+        Uses the from_fields() fast path if resource_class has it, else
+        the constructor with the core attributes, then sets the extra
+        attributes and links.
+        """
+        extra = (None if (row[9] is None) else json.loads(row[9]))
+        ln = (None if (row[10] is None) else json.loads(row[10]))
+        if (hasattr(self.resource_class, 'from_fields')):
+            return(self.resource_class.from_fields(
+                uri=row[0], timestamp=row[1], length=row[2], md5=row[3],
+                sha1=row[4], sha256=row[5], mime_type=row[6],
+                change=row[7], path=row[8], extra=extra, ln=ln))
+        resource = self.resource_class(
+            uri=row[0], timestamp=row[1], length=row[2], md5=row[3],
+            sha1=row[4], sha256=row[5], mime_type=row[6], change=row[7],
+            path=row[8])
+        for (att, value) in (extra or {}).items():
+            setattr(resource, att, value)
+        if (ln is not None):
+            resource.ln = ln
+        return(resource)
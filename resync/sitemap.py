@@ -8,6 +8,7 @@ import io
 
 from resync.resource import Resource
 from resync.resource_container import ResourceContainer
+from resync.w3c_datetime import str_to_datetime, DatetimeFormatter
 
 SITEMAP_NS = 'http://www.sitemaps.org/schemas/sitemap/0.9'
 RS_NS = 'http://www.openarchives.org/rs/terms/'
@@ -68,6 +69,8 @@ class Sitemap(object):
         self.resources_created = 0    # Set during parsing sitemap
         # Set True for sitemapindex, False for sitemap
         self.parsed_index = None
+        # Used for <lastmod> values, shared by all documents written
+        self.datetime_formatter = DatetimeFormatter()
 
     # #### Write the XML for a sitemap or sitemapindex #####
 
@@ -131,7 +134,7 @@ class Sitemap(object):
     # #### Read/parse an XML sitemap or sitemapindex #####
 
     def parse_xml(self, fh=None, etree=None, resources=None, capability=None,
-                  sitemapindex=None):
+                  sitemapindex=None, index_resources=None):
         """Parse XML Sitemap from fh or etree and add resources to a
         resorces object (which must support the add method). Returns
         the resources object.
@@ -151,6 +154,11 @@ class Sitemap(object):
         document was read:
         - False - sitemap
         - True - sitemapindex
+
+        If index_resources is given then the entries of a sitemapindex are
+        added to it instead of to resources, which still gets the metadata
+        and links. This is used where resources checks entries in a way
+        that sitemapindex entries would fail, as for a ChangeList.
         """
         if (resources is None):
             resources = ResourceContainer()
@@ -180,17 +188,20 @@ class Sitemap(object):
                 "" % root_tag)
 
         # have what we expect, read it
+        entries = resources
+        if (self.parsed_index and index_resources is not None):
+            entries = index_resources
         in_preamble = True
         self.resources_created = 0
         seen_top_level_md = False
-        for e in etree.getroot().getchildren():
+        for e in list(etree.getroot()):
             # look for <rs:md> and <rs:ln>, first <url> ends
             # then look for resources in <url> blocks
             if (e.tag == resource_tag):
                 in_preamble = False  # any later rs:md or rs:ln is error
                 r = self.resource_from_etree(e, self.resource_class)
                 try:
-                    resources.add(r)
+                    entries.add(r)
                 except SitemapDupeError:
                     self.logger.warning(
                         "dupe of: %s (lastmod=%s)" % (r.uri, r.lastmod))
@@ -248,7 +259,8 @@ class Sitemap(object):
         if (resource.timestamp is not None):
             # Create appriate element for timestamp
             sub = Element('lastmod')
-            sub.text = str(resource.lastmod)  # W3C Datetime in UTC
+            # W3C Datetime in UTC, same as resource.lastmod
+            sub.text = self.datetime_formatter(resource.timestamp)
             e.append(sub)
         md_atts = {}
         for att in ('capability', 'change', 'hash', 'length', 'path',
@@ -311,17 +323,19 @@ class Sitemap(object):
             raise SitemapParseError(
                 "Bad <loc> element with no content while parsing <url> "
                 "in sitemap")
-        # must at least have a URI, make this object
-        resource = resource_class(uri=loc)
-        # and hopefully a lastmod datetime (but none is OK)
+        # must at least have a URI, and hopefully a lastmod datetime (but
+        # none is OK)
+        timestamp = None
         lastmod_elements = etree.findall('{' + SITEMAP_NS + "}lastmod")
         if (len(lastmod_elements) > 1):
             raise SitemapParseError(
                 "Multiple <lastmod> elements while parsing <url> in sitemap")
         elif (len(lastmod_elements) == 1):
-            resource.lastmod = lastmod_elements[0].text
+            timestamp = str_to_datetime(lastmod_elements[0].text,
+                                        context='lastmod')
         # proceed to look for other resource attributes in an rs:md element
         md_elements = etree.findall('{' + RS_NS + "}md")
+        md = {}
         if (len(md_elements) > 1):
             raise SitemapParseError(
                 "Found multiple (%d) <rs:md> elements for %s",
@@ -329,8 +343,19 @@ class Sitemap(object):
         elif (len(md_elements) == 1):
             # have on element, look at attributes
             md = self.md_from_etree(md_elements[0], context=loc)
-            # simple attributes that map directly to Resource object attributes
-            for att in ('capability', 'change', 'length', 'path', 'mime_type', 'md_at', 'md_completed', 'md_datetime'):
+        # make this object using the fast path for core attributes that map
+        # directly to Resource object attributes, if the class has it
+        fields = dict(uri=loc, timestamp=timestamp, length=md.get('length'),
+                      mime_type=md.get('mime_type'), change=md.get('change'),
+                      path=md.get('path'))
+        if (hasattr(resource_class, 'from_fields')):
+            resource = resource_class.from_fields(**fields)
+        else:
+            resource = resource_class(**fields)
+        if (len(md) > 0):
+            # other simple attributes that are not core attributes
+            for att in ('capability', 'md_at', 'md_completed', 'md_from',
+                        'md_until', 'md_datetime'):
                 if (att in md):
                     setattr(resource, att, md[att])
             # The ResourceSync beta spec lists md5, sha-1 and sha-256 fixity
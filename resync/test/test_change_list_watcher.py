@@ -0,0 +1,141 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from resync.change_list import ChangeList
+from resync.change_list_watcher import ChangeListWatcher, Inotify, InotifyError
+from resync.incremental_builder import IncrementalResourceListBuilder
+from resync.mapper import Mapper
+
+try:
+    Inotify().close()
+    HAVE_INOTIFY = True
+except InotifyError:
+    HAVE_INOTIFY = False
+
+
+class TestChangeListWatcher(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'root')
+        os.mkdir(self.root)
+        os.mkdir(os.path.join(self.root, 'a'))
+        self.write('x', 'x')
+        self.write('a/y', 'y')
+        self.basename = os.path.join(self.root, 'changelist.xml')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data):
+        with open(os.path.join(self.root, name), 'w') as fh:
+            fh.write(data)
+
+    def watcher(self, **kwargs):
+        rlb = IncrementalResourceListBuilder(
+            os.path.join(self.tmpdir, 'state.sqlite'),
+            mapper=Mapper(['http://example.org/t', self.root]))
+        watcher = ChangeListWatcher(rlb, self.basename, **kwargs)
+        watcher.start()
+        return(watcher)
+
+    def changes(self):
+        """All (path, change) in the Change List written"""
+        changes = []
+        n = 0
+        while os.path.exists(self.segment_file(n)):
+            cl = ChangeList()
+            with open(self.segment_file(n), 'rb') as fh:
+                cl.parse(fh=fh)
+            changes += [(r.uri[len('http://example.org/t/'):], r.change)
+                        for r in cl]
+            n += 1
+        return(changes)
+
+    def segment_file(self, n):
+        return(os.path.join(self.root, 'changelist%05d.xml' % n))
+
+    def test01_poll(self):
+        w = self.watcher(use_inotify=False)
+        self.assertEqual(self.changes(), [('x', 'created'),
+                                          ('a/y', 'created')])
+        self.assertTrue(os.path.exists(self.basename))
+        self.write('a/z', 'z')
+        os.unlink(os.path.join(self.root, 'x'))
+        self.assertEqual(w.check(timeout=0), 2)
+        self.assertEqual(sorted(self.changes()[2:]),
+                         [('a/z', 'created'), ('x', 'deleted')])
+        self.assertEqual(w.check(timeout=0), 0)
+        w.close()
+
+    def test02_rotate_and_restart(self):
+        w = self.watcher(use_inotify=False)
+        w.max_sitemap_entries = 3
+        for n in range(4):
+            self.write('f%d' % n, 'f')
+        self.assertEqual(w.check(timeout=0), 4)
+        self.assertEqual(len(self.changes()), 6)
+        self.assertTrue(os.path.exists(self.segment_file(1)))
+        w.close()
+        # restart appends to last segment
+        self.write('g', 'g')
+        w = self.watcher(use_inotify=False)
+        self.assertEqual(len(w.segments), 2)
+        self.assertEqual(self.changes()[-1], ('g', 'created'))
+        self.assertEqual(len(self.changes()), 7)
+        w.close()
+
+    def test04_failed_write(self):
+        w = self.watcher(use_inotify=False)
+        write_segment = w.writer.write_segment
+
+        def fail():
+            raise IOError("disk full")
+        self.write('a/z', 'z')
+        w.writer.write_segment = fail
+        self.assertRaises(IOError, w.check, timeout=0)
+        # the changes are found again by the next scan
+        w.writer.write_segment = write_segment
+        self.assertEqual(w.check(timeout=0), 1)
+        self.assertEqual(self.changes()[2:], [('a/z', 'created')])
+        # and by a rescan of the dirty directories
+        self.write('a/w', 'w')
+        w.mark_dirty(os.path.join(self.root, 'a'))
+        w.writer.write_segment = fail
+        self.assertRaises(IOError, w.process_dirty)
+        self.assertEqual(w.dirty, set([os.path.join(self.root, 'a')]))
+        w.writer.write_segment = write_segment
+        self.assertEqual(w.process_dirty(), 1)
+        self.assertEqual(self.changes()[2:], [('a/z', 'created'),
+                                              ('a/w', 'created')])
+        w.close()
+
+    @unittest.skipIf(not HAVE_INOTIFY, "inotify not available")
+    def test03_inotify(self):
+        w = self.watcher(settle_time=0.05)
+        self.assertTrue(w.inotify is not None)
+        os.mkdir(os.path.join(self.root, 'b'))
+        self.write('b/new', 'new')
+        self.write('a/y', 'changed')
+        n = 0
+        for i in range(50):
+            n += w.check()
+            if (n >= 2):
+                break
+        self.assertEqual(sorted(self.changes()[2:]),
+                         [('a/y', 'updated'), ('b/new', 'created')])
+        # new directory is watched
+        self.write('b/newer', 'newer')
+        for i in range(50):
+            if (w.check() > 0):
+                break
+        self.assertEqual(self.changes()[-1], ('b/newer', 'created'))
+        w.close()
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestChangeListWatcher)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,120 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from resync.change_list import ChangeList
+from resync.change_list_writer import ChangeListWriter
+from resync.list_base import ListBase
+from resync.mapper import Mapper
+from resync.resource import Resource
+from resync.sitemap import Sitemap
+
+
+class TestChangeListWriter(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.basename = os.path.join(self.tmpdir, 'changelist.xml')
+        self.mapper = Mapper(['http://example.org/rs', self.tmpdir])
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def writer(self, **kwargs):
+        writer = ChangeListWriter(self.basename, self.mapper, **kwargs)
+        writer.read_index()
+        return(writer)
+
+    def changes(self, names, change='created'):
+        cl = ChangeList()
+        for name in names:
+            cl.add(Resource('http://example.org/t/' + name,
+                            timestamp=1000000000, change=change))
+        return(cl)
+
+    def read_index(self):
+        index = ListBase()
+        with open(self.basename, 'rb') as fh:
+            Sitemap().parse_xml(fh=fh, resources=index, sitemapindex=True)
+        return(index)
+
+    def read_segment(self, n):
+        cl = ChangeList()
+        with open(os.path.join(self.tmpdir, 'changelist%05d.xml' % n),
+                  'rb') as fh:
+            cl.parse(fh=fh)
+        return(cl)
+
+    def test01_segments(self):
+        w = self.writer(max_sitemap_entries=2)
+        self.assertEqual(w.append(self.changes(['a', 'b', 'c', 'd', 'e'])),
+                         5)
+        index = self.read_index()
+        self.assertEqual(index.capability, 'changelist')
+        self.assertEqual(index.uris(),
+                         ['http://example.org/rs/changelist00000.xml',
+                          'http://example.org/rs/changelist00001.xml',
+                          'http://example.org/rs/changelist00002.xml'])
+        segments = list(index)
+        self.assertEqual(index.md_from, segments[0].md_from)
+        # closed segments have md_until, the next starts where they end
+        self.assertTrue(segments[0].md_until is not None)
+        self.assertEqual(segments[1].md_from, segments[0].md_until)
+        self.assertEqual(segments[2].md_from, segments[1].md_until)
+        self.assertEqual(segments[2].md_until, None)
+        self.assertEqual(len(self.read_segment(0)), 2)
+        self.assertEqual(self.read_segment(1).md_until, segments[1].md_until)
+        self.assertEqual(self.read_segment(2).uris(),
+                         ['http://example.org/t/e'])
+        # closed segments are not written again
+        closed = os.path.join(self.tmpdir, 'changelist00000.xml')
+        os.utime(closed, (1000000000, 1000000000))
+        w.append(self.changes(['f']))
+        self.assertEqual(os.stat(closed).st_mtime, 1000000000)
+        self.assertEqual(len(self.read_segment(2)), 2)
+        self.assertEqual(w.append(ChangeList()), 0)
+
+    def test02_segment_window(self):
+        w = self.writer(segment_window=3600)
+        w.append(self.changes(['a']))
+        self.assertFalse(w.segment_expired())
+        # pretend that the segment was opened two hours ago
+        w.segment.md_from = '2001-01-01T00:00:00Z'
+        w.segments[0].md_from = '2001-01-01T00:00:00Z'
+        self.assertTrue(w.segment_expired())
+        # expired segment is closed even with no new changes
+        w.append(ChangeList())
+        self.assertEqual(w.segment, None)
+        self.assertTrue(self.read_segment(0).md_until is not None)
+        w.append(self.changes(['b']))
+        segments = list(self.read_index())
+        self.assertEqual(len(segments), 2)
+        self.assertEqual(segments[0].md_from, '2001-01-01T00:00:00Z')
+        self.assertEqual(segments[1].md_from, segments[0].md_until)
+
+    def test03_restart(self):
+        w = self.writer(max_sitemap_entries=2)
+        w.append(self.changes(['a', 'b', 'c']))
+        # continue with the open segment
+        w = self.writer(max_sitemap_entries=2)
+        self.assertEqual(len(w.segments), 2)
+        self.assertEqual(w.segments[0].md_until,
+                         self.read_segment(0).md_until)
+        w.append(self.changes(['x'], change='deleted'))
+        self.assertEqual([r.change for r in self.read_segment(1)],
+                         ['created', 'deleted'])
+        # all closed so start a new segment
+        w.close_segment()
+        w = self.writer(max_sitemap_entries=2)
+        self.assertEqual(w.segment, None)
+        w.append(self.changes(['y']))
+        self.assertEqual(len(self.read_index()), 3)
+        self.assertEqual(self.read_segment(2).uris(),
+                         ['http://example.org/t/y'])
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestChangeListWriter)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -5,8 +5,18 @@ import logging
 import sys
 import io
 import contextlib
+import shutil
+import tempfile
+import time
+import zipfile
 
 from resync.client import Client, ClientFatalError
+from resync.change_dump import ChangeDump
+from resync.change_dump_manifest import ChangeDumpManifest
+from resync.resource import Resource
+from resync.resource_list import ResourceList
+from resync.change_list import ChangeList
+from resync.w3c_datetime import datetime_to_str, str_to_datetime
 
 # From
 # http://stackoverflow.com/questions/2654834/capturing-stdout-within-the-same-process-in-python
@@ -152,6 +162,102 @@ class TestClient(unittest.TestCase):
         # self.assertTrue( re.search(r'<url><loc>http://example.org/dir1/file_a</loc><lastmod>[\w\-:]+</lastmod><rs:md length="20" /></url>', capturer.result ) )
         # self.assertTrue( re.search(r'<url><loc>http://example.org/dir1/file_b</loc><lastmod>[\w\-:]+</lastmod><rs:md length="45" /></url>', capturer.result ) )
 
+    def test50_write_change_dump(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data = os.path.join(tmpdir, 'data')
+            dumps = os.path.join(tmpdir, 'dumps')
+            os.mkdir(data)
+            os.mkdir(dumps)
+            for name in ('a', 'b'):
+                with open(os.path.join(data, name), 'w') as fh:
+                    fh.write(name)
+                os.utime(os.path.join(data, name), (1000000000, 1000000000))
+            ref = os.path.join(tmpdir, 'ref.xml')
+            rl = ResourceList()
+            rl.add(Resource('http://example.org/t/c', timestamp=1000000000))
+            rl.write(basename=ref)
+            c = Client()
+            c.set_mappings(['http://example.org/t=' + data,
+                            'http://example.org/dumps=' + dumps])
+            outfile = os.path.join(dumps, 'changedump.xml')
+            c.write_change_list(paths=data, outfile=outfile,
+                                ref_sitemap='file:' + ref, dump=True)
+            # c deleted, a and b created
+            with zipfile.ZipFile(os.path.join(dumps, 'changedump00000.zip'),
+                                 'r') as zf:
+                self.assertEqual(sorted(zf.namelist()),
+                                 ['a', 'b', 'manifest.xml'])
+                manifest = ChangeDumpManifest()
+                with zf.open('manifest.xml') as fh:
+                    manifest.parse(fh=fh)
+            self.assertEqual(sorted((r.uri, r.change, r.path)
+                                    for r in manifest),
+                             [('http://example.org/t/a', 'created', 'a'),
+                              ('http://example.org/t/b', 'created', 'b'),
+                              ('http://example.org/t/c', 'deleted', None)])
+            self.assertEqual(manifest.md_from, '2001-09-09T01:46:40Z')
+            # nothing new
+            c.write_change_list(paths=data, outfile=outfile,
+                                ref_sitemap='file:' + ref, dump=True)
+            self.assertFalse(os.path.exists(
+                os.path.join(dumps, 'changedump00001.zip')))
+            # b changed since the last dump
+            future = time.time() + 100
+            os.utime(os.path.join(data, 'b'), (future, future))
+            c.write_change_list(paths=data, outfile=outfile,
+                                ref_sitemap='file:' + ref, dump=True)
+            with zipfile.ZipFile(os.path.join(dumps, 'changedump00001.zip'),
+                                 'r') as zf:
+                self.assertEqual(sorted(zf.namelist()),
+                                 ['b', 'manifest.xml'])
+            change_dump = ChangeDump()
+            with open(outfile, 'rb') as fh:
+                change_dump.parse(fh=fh)
+            self.assertEqual(change_dump.uris(),
+                             ['http://example.org/dumps/changedump00000.zip',
+                              'http://example.org/dumps/changedump00001.zip'])
+            package = change_dump.resources[
+                'http://example.org/dumps/changedump00001.zip']
+            self.assertEqual(package.link('contents')['href'],
+                             'http://example.org/dumps/changedump00001.xml')
+            for package in change_dump:
+                self.assertTrue(package.md_from is not None)
+                self.assertTrue(package.md_until is not None)
+            # md_until is the time of the scan given, so that changes made
+            # after the scan started are included next time
+            with open(os.path.join(data, 'd'), 'w') as fh:
+                fh.write('d')
+            cl = c.build_resource_list(paths=data, set_path=True)
+            scan_start = str_to_datetime(cl.md_at)
+            changes = ChangeList()
+            changes.add_changed_resources([cl.resources[
+                'http://example.org/t/d']], change='created')
+            c.write_dump_if_requested(changes, outfile, until=scan_start)
+            manifest = ChangeDumpManifest()
+            with open(os.path.join(dumps, 'changedump00002.xml'), 'rb') as fh:
+                manifest.parse(fh=fh)
+            self.assertEqual(manifest.md_until,
+                             datetime_to_str(scan_start))
+            # a file added with an old, preserved, modification time is
+            # included as it is not in any package
+            with open(os.path.join(data, 'e'), 'w') as fh:
+                fh.write('e')
+            os.utime(os.path.join(data, 'e'), (1000000000, 1000000000))
+            c.write_change_list(paths=data, outfile=outfile,
+                                ref_sitemap='file:' + ref, dump=True)
+            with zipfile.ZipFile(os.path.join(dumps, 'changedump00003.zip'),
+                                 'r') as zf:
+                self.assertEqual(sorted(zf.namelist()),
+                                 ['e', 'manifest.xml'])
+            # missing manifest of an earlier package
+            os.unlink(os.path.join(dumps, 'changedump00000.xml'))
+            self.assertRaises(ClientFatalError, c.write_change_list,
+                              paths=data, outfile=outfile,
+                              ref_sitemap='file:' + ref, dump=True)
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestClient)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,81 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from resync.digest_cache import DigestCache
+from resync.resource_list_builder import ResourceListBuilder
+from resync.mapper import Mapper
+
+
+class TestDigestCache(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.file = os.path.join(self.tmpdir, 'f')
+        self.write_file(b'A file\n', 1000000000)
+        self.cache = DigestCache(os.path.join(self.tmpdir, 'cache.sqlite'))
+
+    def tearDown(self):
+        self.cache.close()
+        shutil.rmtree(self.tmpdir)
+
+    def write_file(self, data, mtime):
+        with open(self.file, 'wb') as fh:
+            fh.write(data)
+        os.utime(self.file, (mtime, mtime))
+
+    def test01_hit_and_miss(self):
+        d = self.cache.digests_for_file(self.file, ['md5'])
+        self.assertEqual(d, {'md5': 'j912liHgA/48DCHpkptJHg=='})
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.digests_for_file(self.file, ['md5']), d)
+        self.assertEqual(self.cache.hits, 1)
+        # other digest not cached yet, then both are
+        self.assertEqual(self.cache.get(os.stat(self.file), ['sha1']), None)
+        d = self.cache.digests_for_file(self.file, ['sha1'])
+        self.assertEqual(d, {'sha1': 'SYRN0hGqMwcaJS183CUKUs85rzM='})
+        self.assertEqual(self.cache.get(os.stat(self.file), ['md5', 'sha1']),
+                         {'md5': 'j912liHgA/48DCHpkptJHg==',
+                          'sha1': 'SYRN0hGqMwcaJS183CUKUs85rzM='})
+
+    def test02_invalidate(self):
+        self.cache.digests_for_file(self.file, ['md5'])
+        # same size, different mtime
+        self.write_file(b'B file\n', 1000000001)
+        self.assertEqual(self.cache.get(os.stat(self.file), ['md5']), None)
+        d = self.cache.digests_for_file(self.file, ['md5'])
+        self.assertNotEqual(d, {'md5': 'j912liHgA/48DCHpkptJHg=='})
+        # reset mtime, ctime still changes
+        self.write_file(b'A file\n', 1000000000)
+        self.assertEqual(self.cache.get(os.stat(self.file), ['md5']), None)
+
+    def test03_racy(self):
+        self.write_file(b'A file\n', int(os.stat(self.tmpdir).st_mtime) + 10)
+        self.cache.digests_for_file(self.file, ['md5'])
+        self.assertEqual(self.cache.get(os.stat(self.file), ['md5']), None)
+
+    def test04_persistent(self):
+        self.cache.digests_for_file(self.file, ['md5'])
+        self.cache.close()
+        self.cache = DigestCache(os.path.join(self.tmpdir, 'cache.sqlite'))
+        self.assertEqual(self.cache.get(os.stat(self.file), ['md5']),
+                         {'md5': 'j912liHgA/48DCHpkptJHg=='})
+
+    def test05_builder(self):
+        for workers in (1, 2):
+            rlb = ResourceListBuilder(set_md5=True)
+            rlb.mapper = Mapper(['http://example.org/t', self.tmpdir])
+            rlb.exclude_files.append('cache')
+            rlb.checksum_workers = workers
+            rlb.digest_cache = self.cache
+            rl = rlb.from_disk()
+            self.assertEqual([r.md5 for r in rl],
+                             ['j912liHgA/48DCHpkptJHg=='])
+        self.assertEqual(self.cache.misses, 1)
+        self.assertEqual(self.cache.hits, 1)
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestDigestCache)
+    unittest.TextTestRunner(verbosity=2).run(suite)
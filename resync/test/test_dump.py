@@ -3,7 +3,7 @@ import unittest
 import tempfile
 import shutil
 import zipfile
-from resync.dump import Dump, DumpError
+from resync.dump import Dump, DumpError, CompressionPolicy
 from resync.resource_list import ResourceList
 from resync.change_list import ChangeList
 from resync.resource import Resource
@@ -174,6 +174,182 @@ class TestDump(unittest.TestCase):
         self.assertTrue(d.check_files(check_length=False))
         self.assertRaises(DumpError, d.check_files)
 
+    def test12_check_digests(self):
+        rl = ResourceList()
+        rl.add(Resource('http://ex.org/a', path='resync/test/testdata/a',
+                        md5='j912liHgA/48DCHpkptJHg=='))
+        d = Dump(rl)
+        self.assertTrue(d.check_files(digests=['sha256']))
+        r = rl.resources['http://ex.org/a']
+        self.assertEqual(r.sha256,
+                         'af5jFKlIAEVq+VnTgPXWkyBSR46gPVzKx7oKFL1eZ8Y=')
+        self.assertEqual(r.sha1, None)
+        r.md5 = 'bad'
+        self.assertRaises(DumpError, d.check_files, digests=[])
+
+    def test13_workers(self):
+        names = {}
+        for workers in (1, 3):
+            rl = ResourceList()
+            for letter in map(chr, range(ord('a'), ord('l') + 1)):
+                rl.add(Resource('http://ex.org/%s' % (letter),
+                                path='resync/test/testdata/a_to_z/%s' % letter))
+            d = Dump(rl)
+            d.workers = workers
+            d.max_files = 4
+            tmpbase = os.path.join(self.tmpdir, 'test13_%d_' % (workers))
+            self.assertEqual(d.write(tmpbase), 3)
+            names[workers] = []
+            for n in range(3):
+                with zipfile.ZipFile(tmpbase + '%05d.zip' % (n), 'r') as zo:
+                    names[workers].append(zo.namelist())
+                    if (n == 0):
+                        with open('resync/test/testdata/a_to_z/b', 'rb') as fh:
+                            self.assertEqual(zo.read('b'), fh.read())
+                    # separate manifest is that in the package
+                    with open(tmpbase + '%05d.xml' % (n), 'rb') as fh:
+                        self.assertEqual(fh.read(), zo.read('manifest.xml'))
+        self.assertEqual(names[1], names[3])
+        self.assertEqual(names[1][2], ['manifest.xml', 'i', 'j', 'k', 'l'])
+
+    def test14_bad_size_when_written(self):
+        for workers in (1, 2):
+            rl = ResourceList()
+            rl.add(Resource('http://ex.org/a', length=9999,
+                            path='resync/test/testdata/a'))
+            d = Dump(rl)
+            d.workers = workers
+            tmpbase = os.path.join(self.tmpdir, 'test14_%d_' % (workers))
+            self.assertRaises(DumpError, d.write, tmpbase)
+            self.assertFalse(os.path.exists(tmpbase + '00000.zip'))
+
+    def test15_partition_packed(self):
+        rl = ResourceList()
+        for letter in map(chr, range(ord('a'), ord('l') + 1)):
+            rl.add(Resource('http://ex.org/%s' % (letter),
+                            path='resync/test/testdata/a_to_z/%s' % letter))
+        d = Dump(rl)
+        d.check_files()
+        d.max_size = 2000
+        d.partition_method = 'packed'
+        manifests = list(d.partition_dumps())
+        sizes = [sum(r.length for r in m) for m in manifests]
+        self.assertTrue(max(sizes) <= 2000)
+        self.assertEqual(sum(sizes), d.total_size)
+        self.assertEqual(len(manifests), (d.total_size + 1999) // 2000)
+        uris = [r.uri for m in manifests for r in m]
+        self.assertEqual(sorted(uris), rl.uris())
+        for m in manifests:
+            self.assertEqual([r.uri for r in m], sorted(r.uri for r in m))
+        d.max_files = 5
+        manifests = list(d.partition_dumps())
+        self.assertEqual(len(manifests), 3)
+        self.assertEqual(sorted(len(m) for m in manifests), [2, 5, 5])
+        self.assertTrue(max(sum(r.length for r in m)
+                            for m in manifests) <= 2000)
+        d.partition_method = 'other'
+        self.assertRaises(DumpError, d.partition_dumps)
+
+    def test16_compression_policy(self):
+        policy = CompressionPolicy()
+        self.assertEqual(policy.compress_type('a.JPG'), zipfile.ZIP_STORED)
+        self.assertEqual(policy.compress_type('a', 'image/png'),
+                         zipfile.ZIP_STORED)
+        self.assertEqual(policy.compress_type('a', 'text/plain'),
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(policy.compress_type('a', None, b'a' * 1000),
+                         zipfile.ZIP_DEFLATED)
+        self.assertEqual(policy.compress_type('a', None, os.urandom(1000)),
+                         zipfile.ZIP_STORED)
+        # write a package with an "image", text and random data
+        srcdir = os.path.join(self.tmpdir, 'test16')
+        os.mkdir(srcdir)
+        for (name, data) in (('a', b'not really an image'),
+                             ('b', b'text ' * 1000),
+                             ('random.bin', os.urandom(5000))):
+            with open(os.path.join(srcdir, name), 'wb') as fh:
+                fh.write(data)
+        rl = ResourceList()
+        rl.add(Resource('http://ex.org/a', path=os.path.join(srcdir, 'a'),
+                        mime_type='image/jpeg'))
+        rl.add(Resource('http://ex.org/b', path=os.path.join(srcdir, 'b')))
+        rl.add(Resource('http://ex.org/r',
+                        path=os.path.join(srcdir, 'random.bin')))
+        d = Dump(rl)
+        d.compression_policy = CompressionPolicy(compresslevel=1)
+        tmpbase = os.path.join(self.tmpdir, 'test16_')
+        self.assertEqual(d.write(tmpbase), 1)
+        with zipfile.ZipFile(tmpbase + '00000.zip', 'r') as zo:
+            types = dict((i.filename, i.compress_type) for i in zo.infolist())
+            self.assertEqual(zo.testzip(), None)
+        self.assertEqual(types['a'], zipfile.ZIP_STORED)
+        self.assertEqual(types['b'], zipfile.ZIP_DEFLATED)
+        self.assertEqual(types['random.bin'], zipfile.ZIP_STORED)
+        self.assertEqual(types['manifest.xml'], zipfile.ZIP_DEFLATED)
+
+    def test16a_compress_level(self):
+        srcdir = os.path.join(self.tmpdir, 'test16a')
+        os.mkdir(srcdir)
+        with open(os.path.join(srcdir, 'b'), 'w') as fh:
+            fh.write(' '.join(str(i * i) for i in range(20000)))
+        sizes = []
+        for level in (1, 9):
+            # writing sets the resource paths to those within the package
+            rl = ResourceList()
+            rl.add(Resource('http://ex.org/b',
+                            path=os.path.join(srcdir, 'b')))
+            d = Dump(rl)
+            d.compression_policy = CompressionPolicy(compresslevel=level)
+            tmpbase = os.path.join(self.tmpdir, 'test16a_%d_' % level)
+            d.write(tmpbase)
+            with zipfile.ZipFile(tmpbase + '00000.zip', 'r') as zo:
+                sizes.append(zo.getinfo('b').compress_size)
+        self.assertTrue(sizes[0] > sizes[1])
+
+    def test17_partition_by_time(self):
+        cl = ChangeDumpManifest()
+        for (name, timestamp) in (('a', 1000001000), ('b', 1000001500),
+                                  ('c', 1000005000)):
+            cl.add(Resource('http://ex.org/' + name, timestamp=timestamp,
+                            change='updated'))
+        d = Dump(cl)
+        d.manifest_class = ChangeDumpManifest
+        d.time_from = 1000000900
+        d.time_until = 1000006000
+        # one package from time_from, not the earliest change
+        manifests = list(d.partition_dumps())
+        self.assertEqual(len(manifests), 1)
+        self.assertEqual(manifests[0].md_from, '2001-09-09T02:01:40Z')
+        self.assertEqual(manifests[0].md_until, '2001-09-09T03:26:40Z')
+        # windows cover a continuous period
+        d.time_window = 1000
+        manifests = list(d.partition_dumps())
+        self.assertEqual([m.uris() for m in manifests],
+                         [['http://ex.org/a', 'http://ex.org/b'],
+                          ['http://ex.org/c']])
+        self.assertEqual(manifests[0].md_from, '2001-09-09T02:01:40Z')
+        self.assertEqual(manifests[0].md_until, '2001-09-09T02:20:00Z')
+        self.assertEqual(manifests[1].md_from, '2001-09-09T02:20:00Z')
+        self.assertEqual(manifests[1].md_until, '2001-09-09T03:26:40Z')
+        # deletions without a timestamp go in the last window
+        cl.add(Resource('http://ex.org/x', change='deleted'))
+        manifests = list(d.partition_dumps())
+        self.assertEqual([m.uris() for m in manifests],
+                         [['http://ex.org/a', 'http://ex.org/b'],
+                          ['http://ex.org/c', 'http://ex.org/x']])
+        # or in the window ending at time_until if there are no others,
+        # here the one before as time_until is at the start of a window
+        cl = ChangeDumpManifest()
+        cl.add(Resource('http://ex.org/x', change='deleted'))
+        d = Dump(cl)
+        d.manifest_class = ChangeDumpManifest
+        d.time_window = 1000
+        d.time_until = 1000006000
+        manifests = list(d.partition_dumps())
+        self.assertEqual(len(manifests), 1)
+        self.assertEqual(manifests[0].md_from, '2001-09-09T03:10:00Z')
+        self.assertEqual(manifests[0].md_until, '2001-09-09T03:26:40Z')
+
 if __name__ == '__main__':
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestDump)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,241 @@
+import functools
+import http.server
+import os
+import os.path
+import re
+import shutil
+import tempfile
+import threading
+import unittest
+import zipfile
+
+from resync.client import Client
+from resync.dump import Dump, DumpError
+from resync.dump_reader import DumpReader, HttpRangeFile
+from resync.resource import Resource
+from resync.resource_dump import ResourceDump
+from resync.resource_dump_manifest import ResourceDumpManifest
+from resync.resource_list import ResourceList
+from resync.change_dump_manifest import ChangeDumpManifest
+from resync.change_list import ChangeList
+
+
+class RangeRequestHandler(http.server.SimpleHTTPRequestHandler):
+    """Static file server with support for single Range requests"""
+
+    def do_GET(self):
+        match = re.match(r'bytes=(\d+)-(\d+)$',
+                         self.headers.get('Range', ''))
+        if (match is None):
+            return(super(RangeRequestHandler, self).do_GET())
+        (start, end) = (int(match.group(1)), int(match.group(2)))
+        with open(self.translate_path(self.path), 'rb') as fh:
+            size = os.fstat(fh.fileno()).st_size
+            fh.seek(start)
+            data = fh.read(end - start + 1)
+        self.send_response(206)
+        self.send_header('Content-Range', 'bytes %d-%d/%d'
+                         % (start, start + len(data) - 1, size))
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class TestDumpReader(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.src = os.path.join(self.tmpdir, 'src')
+        self.www = os.path.join(self.tmpdir, 'www')
+        os.mkdir(self.src)
+        os.mkdir(self.www)
+        self.data = {'small': b'small file\n',
+                     'text': b'some text ' * 1000,
+                     'big': os.urandom(300000)}
+        rl = ResourceList()
+        for (name, data) in sorted(self.data.items()):
+            filename = os.path.join(self.src, name)
+            with open(filename, 'wb') as fh:
+                fh.write(data)
+            rl.add(Resource('http://example.org/r/' + name, path=filename,
+                            timestamp=1000000000))
+        Dump(rl).write(basename=os.path.join(self.www, 'rd_'))
+        handler = functools.partial(RangeRequestHandler, directory=self.www)
+        self.server = http.server.ThreadingHTTPServer(('127.0.0.1', 0),
+                                                      handler)
+        self.base = 'http://127.0.0.1:%d/' % (self.server.server_port)
+        self.thread = threading.Thread(target=self.server.serve_forever)
+        self.thread.start()
+
+    def tearDown(self):
+        self.server.shutdown()
+        self.server.server_close()
+        self.thread.join()
+        shutil.rmtree(self.tmpdir)
+
+    def test01_local(self):
+        reader = DumpReader(os.path.join(self.www, 'rd_00000.zip'))
+        self.assertEqual(reader.manifest.uris(),
+                         ['http://example.org/r/big',
+                          'http://example.org/r/small',
+                          'http://example.org/r/text'])
+        out = os.path.join(self.tmpdir, 'out')
+        for resource in reader.manifest:
+            self.assertEqual(reader.extract(resource, out),
+                             len(self.data[resource.path]))
+            with open(out, 'rb') as fh:
+                self.assertEqual(fh.read(), self.data[resource.path])
+        reader.close()
+
+    def test02_http_range(self):
+        reader = DumpReader(self.base + 'rd_00000.zip')
+        self.assertEqual(len(reader.manifest), 3)
+        small = reader.manifest.resources['http://example.org/r/small']
+        out = os.path.join(self.tmpdir, 'out')
+        reader.extract(small, out)
+        with open(out, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data['small'])
+        # central directory, manifest and member but not the big file
+        self.assertTrue(reader.fh.requests <= 4)
+        self.assertTrue(reader.fh.bytes_fetched < reader.size / 2)
+        big = reader.manifest.resources['http://example.org/r/big']
+        reader.extract(big, out)
+        with open(out, 'rb') as fh:
+            self.assertEqual(fh.read(), self.data['big'])
+        reader.close()
+
+    def test03_http_range_file(self):
+        rf = HttpRangeFile(self.base + 'rd_00000.zip', block_size=100)
+        with open(os.path.join(self.www, 'rd_00000.zip'), 'rb') as fh:
+            data = fh.read()
+        self.assertEqual(rf.size, len(data))
+        rf.seek(-10, 2)
+        self.assertEqual(rf.read(), data[-10:])
+        rf.seek(1000)
+        self.assertEqual(rf.read(10), data[1000:1010])
+        self.assertEqual(rf.requests, 2)
+        # served from buffer
+        rf.seek(1050)
+        self.assertEqual(rf.read(50), data[1050:1100])
+        self.assertEqual(rf.requests, 2)
+        # sequential reads fetch increasing amounts
+        rf.seek(0)
+        self.assertEqual(rf.read(), data)
+        self.assertTrue(rf.requests < 15)
+
+    def test04_client_from_dump(self):
+        rd = ResourceDump()
+        rd.add(Resource(self.base + 'rd_00000.zip'))
+        rd.write(basename=os.path.join(self.www, 'resourcedump.xml'))
+        dst = os.path.join(self.tmpdir, 'dst')
+        c = Client()
+        c.set_mappings(['http://example.org/r', dst])
+        c.resource_dump = self.base + 'resourcedump.xml'
+        c.last_timestamp = 0
+        changes = [(Resource('http://example.org/r/small',
+                             length=len(self.data['small']),
+                             timestamp=1000000000), 'created'),
+                   (Resource('http://example.org/r/text', length=1,
+                             timestamp=1000000000), 'updated'),
+                   (Resource('http://example.org/r/other'), 'created')]
+        done = c.update_from_resource_dump(changes)
+        # text has the wrong length so is not taken from the dump
+        self.assertEqual(done, set(['http://example.org/r/small']))
+        with open(os.path.join(dst, 'small'), 'rb') as fh:
+            self.assertEqual(fh.read(), self.data['small'])
+        self.assertEqual(os.stat(os.path.join(dst, 'small')).st_mtime,
+                         1000000000)
+        self.assertFalse(os.path.exists(os.path.join(dst, 'text')))
+
+    def write_dump_with_digests(self):
+        rl = ResourceList()
+        for name in sorted(self.data):
+            rl.add(Resource('http://example.org/r/' + name,
+                            path=os.path.join(self.src, name)))
+        d = Dump(rl)
+        d.check_files(digests=['md5', 'sha256'])
+        d.write(basename=os.path.join(self.tmpdir, 'dg_'))
+        return(os.path.join(self.tmpdir, 'dg_00000.zip'))
+
+    def test05_verify(self):
+        package = self.write_dump_with_digests()
+        for workers in (1, 3):
+            reader = DumpReader(package, workers=workers)
+            self.assertTrue(reader.manifest.resources[
+                'http://example.org/r/big'].sha256 is not None)
+            self.assertEqual(reader.verify(), 3)
+            out = os.path.join(self.tmpdir, 'out%d' % (workers))
+            self.assertEqual(reader.verify(extract_dir=out), 3)
+            for (name, data) in self.data.items():
+                with open(os.path.join(out, name), 'rb') as fh:
+                    self.assertEqual(fh.read(), data)
+            reader.close()
+        # remote, with range requests
+        shutil.copy(package, self.www)
+        reader = DumpReader(self.base + 'dg_00000.zip', workers=3)
+        self.assertEqual(reader.verify(), 3)
+        reader.close()
+
+    def write_bad_package(self, resources, members):
+        package = os.path.join(self.tmpdir, 'bad.zip')
+        manifest = ResourceDumpManifest(resources=resources)
+        with zipfile.ZipFile(package, 'w') as zf:
+            zf.writestr('manifest.xml', manifest.as_xml())
+            for (name, data) in members:
+                zf.writestr(name, data)
+        return(package)
+
+    def test06_verify_errors(self):
+        # wrong md5
+        package = self.write_bad_package(
+            [Resource('http://example.org/r/a', path='a', length=3,
+                      md5='j912liHgA/48DCHpkptJHg==')], [('a', b'abc')])
+        reader = DumpReader(package, workers=2)
+        self.assertRaises(DumpError, reader.verify)
+        out = os.path.join(self.tmpdir, 'out')
+        self.assertRaises(DumpError, reader.verify, extract_dir=out)
+        self.assertFalse(os.path.exists(os.path.join(out, 'a')))
+        # wrong length
+        package = self.write_bad_package(
+            [Resource('http://example.org/r/a', path='a', length=4)],
+            [('a', b'abc')])
+        self.assertRaises(DumpError, DumpReader(package).verify)
+        # missing from package
+        package = self.write_bad_package(
+            [Resource('http://example.org/r/a', path='a')], [('b', b'abc')])
+        self.assertRaises(DumpError, DumpReader(package).verify)
+        # path outside extract directory
+        package = self.write_bad_package(
+            [Resource('http://example.org/r/a', path='../a')],
+            [('../a', b'abc')])
+        self.assertRaises(DumpError, DumpReader(package).verify,
+                          extract_dir=out)
+
+    def test07_change_dump(self):
+        c = Client()
+        c.set_mappings(['http://example.org/r', self.src])
+        rl = c.build_resource_list(paths=self.src, set_path=True)
+        cl = ChangeList()
+        cl.add_changed_resources(rl, change='created')
+        cl.add(Resource('http://example.org/r/gone', timestamp=1000000000,
+                        change='deleted'))
+        outfile = os.path.join(self.src, 'cd.xml')
+        self.assertEqual(c.write_dump_if_requested(cl, outfile), 1)
+        reader = DumpReader(os.path.join(self.src, 'cd00000.zip'))
+        self.assertTrue(isinstance(reader.manifest, ChangeDumpManifest))
+        self.assertEqual(len(reader.manifest), 4)
+        # the deleted resource has no content to check
+        resources = [r for r in reader.manifest if r.change != 'deleted']
+        out = os.path.join(self.tmpdir, 'out')
+        for resource in resources:
+            self.assertEqual(reader.extract(resource, out),
+                             len(self.data[resource.path]))
+        self.assertEqual(reader.verify(), 3)
+        reader.close()
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestDumpReader)
+    unittest.TextTestRunner(verbosity=2).run(suite)
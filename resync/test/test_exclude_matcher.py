@@ -0,0 +1,54 @@
+import unittest
+
+from resync.exclude_matcher import ExcludeMatcher
+
+
+class TestExcludeMatcher(unittest.TestCase):
+
+    def test01_regexes(self):
+        em = ExcludeMatcher()
+        em.add_regexes([r'sitemap\d{0,5}.xml', 'a+b', '.*~$'])
+        self.assertTrue(em.exclude_file('sitemap.xml'))
+        self.assertTrue(em.exclude_file('sitemap00001.xml'))
+        self.assertTrue(em.exclude_file('aab'))
+        self.assertTrue(em.exclude_file('file~'))
+        # match is anchored at start only, as re.match()
+        self.assertTrue(em.exclude_file('abc'))
+        self.assertFalse(em.exclude_file('xab'))
+        self.assertFalse(em.exclude_file('file'))
+        self.assertFalse(em.exclude_dir('sitemap.xml'))
+
+    def test02_uncombinable(self):
+        em = ExcludeMatcher()
+        em.add_regexes(['(.)\\1', '(?i)upper', '(?P<x>y)(?P=x)', '(z)'])
+        em.compile()
+        self.assertEqual(len(em._separate_res), 3)
+        self.assertTrue(em.exclude_file('aa'))
+        self.assertFalse(em.exclude_file('ab'))
+        self.assertTrue(em.exclude_file('UPPER'))
+        self.assertTrue(em.exclude_file('yy'))
+        self.assertTrue(em.exclude_file('z'))
+
+    def test03_globs_and_dirs(self):
+        em = ExcludeMatcher()
+        em.add_globs(['*.tmp', '/data/private/*', '/data/*/secret.txt'])
+        em.add_dirs(['CVS', '.git'])
+        self.assertTrue(em.exclude_file('x.tmp', '/data/x.tmp'))
+        self.assertTrue(em.exclude_file('x', '/data/private/x'))
+        self.assertTrue(em.exclude_file('secret.txt', '/data/a/secret.txt'))
+        self.assertFalse(em.exclude_file('x', '/data/x'))
+        self.assertFalse(em.exclude_file('x', None))
+        self.assertFalse(em.exclude_file('CVS', '/data/CVS'))
+        self.assertTrue(em.exclude_dir('CVS', '/data/CVS'))
+        self.assertTrue(em.exclude_dir('private', '/data/private/'))
+        self.assertTrue(em.exclude_dir('d.tmp', '/data/d.tmp'))
+        self.assertFalse(em.exclude_dir('private', '/data/private'))
+        self.assertFalse(em.exclude_dir('public', '/data/public'))
+        # new rules are used
+        em.add_dirs(['public'])
+        self.assertTrue(em.exclude_dir('public', '/data/public'))
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestExcludeMatcher)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -0,0 +1,141 @@
+import os
+import os.path
+import shutil
+import tempfile
+import unittest
+
+from resync.incremental_builder import IncrementalResourceListBuilder
+from resync.mapper import Mapper
+
+
+class TestIncrementalBuilder(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.root = os.path.join(self.tmpdir, 'root')
+        self.state = os.path.join(self.tmpdir, 'state.sqlite')
+        os.mkdir(self.root)
+        os.mkdir(os.path.join(self.root, 'a'))
+        os.mkdir(os.path.join(self.root, 'a', 'b'))
+        self.write('x', 'x')
+        self.write('a/y', 'y')
+        self.write('a/b/z', 'z')
+        self.dir_mtime = 1000000000
+        self.age_dirs()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def write(self, name, data, mtime=1000000000):
+        filename = os.path.join(self.root, name)
+        with open(filename, 'w') as fh:
+            fh.write(data)
+        os.utime(filename, (mtime, mtime))
+
+    def age_dirs(self):
+        # Directory mtimes well in the past so they are not racy, but
+        # different each time as if changes made in separate ticks
+        self.dir_mtime += 10
+        for (dirpath, dirs, files) in os.walk(self.root):
+            os.utime(dirpath, (self.dir_mtime, self.dir_mtime))
+
+    def builder(self, **kwargs):
+        rlb = IncrementalResourceListBuilder(
+            self.state, mapper=Mapper(['http://example.org/t', self.root]),
+            **kwargs)
+        return(rlb)
+
+    def changes(self, cl):
+        return([(r.uri[len('http://example.org/t/'):], r.change) for r in cl])
+
+    def test01_first_and_unchanged(self):
+        rlb = self.builder(set_md5=True)
+        (rl, cl) = rlb.scan()
+        self.assertEqual(rl.uris(), ['http://example.org/t/a/b/z',
+                                     'http://example.org/t/a/y',
+                                     'http://example.org/t/x'])
+        self.assertEqual(self.changes(cl), [('x', 'created'),
+                                            ('a/y', 'created'),
+                                            ('a/b/z', 'created')])
+        self.assertEqual(rlb.dirs_listed, 3)
+        rlb.close()
+        rlb = self.builder(set_md5=True)
+        (rl2, cl) = rlb.scan()
+        self.assertEqual(len(cl), 0)
+        self.assertEqual(rlb.dirs_listed, 0)
+        self.assertEqual(rlb.dirs_carried, 3)
+        self.assertEqual([(r.uri, r.md5, r.length, r.timestamp) for r in rl],
+                         [(r.uri, r.md5, r.length, r.timestamp) for r in rl2])
+        self.assertTrue(cl.md_from is not None)
+        self.assertTrue(cl.md_until is not None)
+        rlb.close()
+
+    def test02_changes(self):
+        rlb = self.builder()
+        rlb.scan()
+        # modify in place, add, delete file and directory
+        self.write('a/y', 'yy', mtime=1000000005)
+        self.write('a/new', 'new')
+        os.unlink(os.path.join(self.root, 'x'))
+        shutil.rmtree(os.path.join(self.root, 'a', 'b'))
+        self.age_dirs()
+        (rl, cl) = rlb.scan()
+        self.assertEqual(rl.uris(), ['http://example.org/t/a/new',
+                                     'http://example.org/t/a/y'])
+        self.assertEqual(sorted(self.changes(cl)),
+                         [('a/b/z', 'deleted'), ('a/new', 'created'),
+                          ('a/y', 'updated'), ('x', 'deleted')])
+        (rl, cl) = rlb.scan()
+        self.assertEqual(len(cl), 0)
+        rlb.close()
+
+    def test03_trust_dir_mtimes(self):
+        rlb = self.builder(trust_dir_mtimes=True)
+        rlb.scan()
+        # in place modification not seen when trusting directory mtimes
+        self.write('a/y', 'yy', mtime=1000000005)
+        (rl, cl) = rlb.scan()
+        self.assertEqual(len(cl), 0)
+        rlb.trust_dir_mtimes = False
+        (rl, cl) = rlb.scan()
+        self.assertEqual(self.changes(cl), [('a/y', 'updated')])
+        self.assertEqual(rl.resources['http://example.org/t/a/y'].length, 2)
+        rlb.close()
+
+    def test04_racy_dir(self):
+        rlb = self.builder()
+        self.write('a/new', 'new')
+        # a/ now has a recent mtime so is listed again next time
+        rlb.scan()
+        rlb.scan()
+        self.assertEqual(rlb.dirs_listed, 1)
+        rlb.close()
+    def test05_uncommitted_scan(self):
+        rlb = self.builder()
+        rlb.scan()
+        rlb.close()
+        self.write('a/new', 'new')
+        self.age_dirs()
+        # state not committed so the change is found again
+        rlb = self.builder()
+        (rl, cl) = rlb.scan(commit=False)
+        self.assertEqual(self.changes(cl), [('a/new', 'created')])
+        rlb.close()
+        rlb = self.builder()
+        cl = rlb.rescan_dirs([os.path.join(self.root, 'a')], commit=False)
+        self.assertEqual(self.changes(cl), [('a/new', 'created')])
+        rlb.close()
+        rlb = self.builder()
+        (rl, cl) = rlb.scan(commit=False)
+        self.assertEqual(self.changes(cl), [('a/new', 'created')])
+        rlb.commit()
+        rlb.close()
+        rlb = self.builder()
+        (rl, cl) = rlb.scan()
+        self.assertEqual(len(cl), 0)
+        rlb.close()
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(
+        TestIncrementalBuilder)
+    unittest.TextTestRunner(verbosity=2).run(suite)
@@ -1,8 +1,16 @@
 import sys
 import unittest
 import io
+import os
+import shutil
+import tempfile
 from resync.resource import Resource
-from resync.list_base_with_index import ListBaseWithIndex, ListBaseIndexError
+from resync.archives import ChangeListArchive
+from resync.change_list import ChangeList
+from resync.change_list_writer import ChangeListWriter
+from resync.list_base_with_index import ListBaseWithIndex, ListBaseIndexError, in_time_window
+from resync.mapper import Mapper
+from resync.w3c_datetime import str_to_datetime
 
 # etree gives ParseError in 2.7, ExpatError in 2.6
 etree_error_class = None
@@ -54,6 +62,63 @@ class TestListBaseWithIndex(unittest.TestCase):
         lb.parse(fh=io.StringIO(xml))
         self.assertEqual(len(lb.resources), 2, 'got 2 resources')
 
+    def test_12_in_time_window(self):
+        r = Resource(uri='a', md_from='2013-01-02T00:00:00Z',
+                     md_until='2013-01-03T00:00:00Z')
+        jan = dict((d, str_to_datetime('2013-01-%02dT00:00:00Z' % d))
+                   for d in range(1, 5))
+        self.assertTrue(in_time_window(r))
+        self.assertTrue(in_time_window(r, jan[1]))
+        self.assertTrue(in_time_window(r, jan[3]))
+        self.assertFalse(in_time_window(r, jan[4]))
+        self.assertTrue(in_time_window(r, until_timestamp=jan[2]))
+        self.assertFalse(in_time_window(r, until_timestamp=jan[1]))
+        # open ended
+        self.assertTrue(in_time_window(Resource(uri='b'), jan[4], jan[1]))
+        cla = ChangeListArchive()
+        cla.add(r)
+        cla.add(Resource(uri='c', md_from='2013-01-03T00:00:00Z'))
+        self.assertEqual(cla.uris_in_time_window(jan[4]), ['c'])
+        self.assertEqual(cla.uris_in_time_window(jan[1], jan[2]), ['a'])
+
+    def test_13_read_time_window(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            mapper = Mapper(['http://example.org/rs', tmpdir])
+            basename = os.path.join(tmpdir, 'changelist.xml')
+            writer = ChangeListWriter(basename, mapper)
+            for day in range(1, 6):
+                # one segment for each day
+                cl = ChangeList()
+                cl.add(Resource(uri='http://example.org/t/%d' % day,
+                                lastmod='2013-01-%02dT12:00:00Z' % day,
+                                change='updated'))
+                if (day == 1):
+                    writer.new_segment('2013-01-01T00:00:00Z')
+                else:
+                    writer.new_segment()
+                writer.append(cl)
+                writer.close_segment('2013-01-%02dT00:00:00Z' % (day + 1))
+            uri = 'file://' + basename
+            cl = ChangeList(mapper=mapper)
+            cl.read(uri=uri)
+            self.assertEqual(len(cl), 5)
+            self.assertEqual(cl.num_files, 6)
+            # changes since the middle of the 4th read only the last two
+            cl = ChangeList(mapper=mapper)
+            cl.read(uri=uri,
+                    from_timestamp=str_to_datetime('2013-01-04T06:00:00Z'))
+            self.assertEqual(cl.num_files, 3)
+            self.assertEqual(cl.uris(), ['http://example.org/t/4',
+                                         'http://example.org/t/5'])
+            cl = ChangeList(mapper=mapper)
+            cl.read(uri=uri,
+                    from_timestamp=str_to_datetime('2013-01-02T06:00:00Z'),
+                    until_timestamp=str_to_datetime('2013-01-02T18:00:00Z'))
+            self.assertEqual(cl.uris(), ['http://example.org/t/2'])
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestListBaseWithIndex)
     unittest.TextTestRunner(verbosity=2).run(suite)
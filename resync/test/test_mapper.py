@@ -102,6 +102,35 @@ class TestMapper(unittest.TestCase):
         self.assertTrue(Map('path/a', 'path').unsafe())
         self.assertTrue(Map('path', 'path/b').unsafe())
 
+    def test11_order_and_nesting(self):
+        # First map in order wins even if a later one is more specific
+        m = Mapper(['http://e.org/a=/tmp/a', 'http://f.org/ab=/tmp/a/b'])
+        self.assertEqual(m.dst_to_src('/tmp/a/b/c'), 'http://e.org/a/b/c')
+        self.assertEqual(m.src_to_dst('http://f.org/ab/c'), '/tmp/a/b/c')
+        m = Mapper(['http://f.org/ab=/tmp/a/b', 'http://e.org/a=/tmp/a'])
+        self.assertEqual(m.dst_to_src('/tmp/a/b/c'), 'http://f.org/ab/c')
+        self.assertEqual(m.dst_to_src('/tmp/a/c'), 'http://e.org/a/c')
+        # cached result for directory used again
+        self.assertEqual(m.dst_to_src('/tmp/a/b/d'), 'http://f.org/ab/d')
+        # new list of mappings is seen
+        m.mappings = list(reversed(m.mappings))
+        self.assertEqual(m.dst_to_src('/tmp/a/b/d'), 'http://e.org/a/b/d')
+
+    def test12_no_regex_chars(self):
+        # . in a base matches only .
+        m = Mapper(['http://e.org/p.q', '/tmp/a.b'])
+        self.assertEqual(m.dst_to_src('/tmp/a.b/c'), 'http://e.org/p.q/c')
+        self.assertRaises(MapperError, m.dst_to_src, '/tmp/axb/c')
+        self.assertRaises(MapperError, m.src_to_dst, 'http://e.org/pxq/c')
+        self.assertEqual(Map('http://e.org/p', '/tmp/a+').dst_to_src(
+            '/tmp/a+/c'), 'http://e.org/p/c')
+
+    def test13_many_maps(self):
+        m = Mapper(['http://e.org/%d=/tmp/d%d' % (n, n) for n in range(500)])
+        self.assertEqual(m.dst_to_src('/tmp/d321/x/y'), 'http://e.org/321/x/y')
+        self.assertEqual(m.src_to_dst('http://e.org/7/z'), '/tmp/d7/z')
+        self.assertRaises(MapperError, m.dst_to_src, '/tmp/d500/x')
+
 if __name__ == '__main__':
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestMapper)
     unittest.TextTestRunner(verbosity=2).run(suite)
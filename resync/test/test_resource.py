@@ -210,6 +210,36 @@ class TestResource(unittest.TestCase):
         r = Resource(uri='tv2')
         self.assertEqual(r.mime_type, None)
 
+    def test14_from_fields(self):
+        r = Resource.from_fields('ff1', timestamp=1234.5, length=10,
+                                 md5='aaa', sha256='ccc', change='created',
+                                 path='/tmp/ff1', mime_type='text/plain')
+        self.assertEqual(r, Resource(uri='ff1', timestamp=1234.5, length=10,
+                                     md5='aaa'))
+        self.assertEqual(repr(r), repr(
+            Resource(uri='ff1', timestamp=1234.5, length=10, md5='aaa',
+                     sha256='ccc', change='created', path='/tmp/ff1',
+                     mime_type='text/plain')))
+        self.assertEqual(r.sha1, None)
+        self.assertEqual(r.capability, None)
+        # extra attributes and links
+        r = Resource.from_fields('ff2', extra={'ts_at': 0.0},
+                                 ln=[{'rel': 'up', 'href': 'http://a.b/'}])
+        self.assertEqual(r.md_at, '1970-01-01T00:00:00Z')
+        self.assertEqual(r.up, 'http://a.b/')
+        # still usable as a normal object
+        r.capability = 'resourcelist'
+        self.assertEqual(r.capability, 'resourcelist')
+        # checks
+        self.assertRaises(ValueError, Resource.from_fields, None)
+        change_types = Resource.CHANGE_TYPES
+        Resource.CHANGE_TYPES = ['created', 'updated', 'deleted']
+        try:
+            self.assertRaises(ChangeTypeError, Resource.from_fields, 'ff3',
+                              change='bad')
+        finally:
+            Resource.CHANGE_TYPES = change_types
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestResource)
     unittest.TextTestRunner(verbosity=2).run(suite)
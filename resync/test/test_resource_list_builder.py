@@ -1,5 +1,7 @@
 import unittest
 import os
+import shutil
+import tempfile
 from resync.resource_list_builder import ResourceListBuilder
 from resync.mapper import Mapper
 
@@ -122,6 +124,76 @@ class TestResourceListBuilder(unittest.TestCase):
         self.assertEqual(r.length, 20)
         self.assertEqual(r.path, 'resync/test/testdata/dir1/file_a')
 
+    def test06_scan_excludes_and_symlinks(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            for d in ('a', 'a/b', 'a/.git', 'c', 'empty'):
+                os.mkdir(os.path.join(tmpdir, d))
+            for f in ('x', 'a/y', 'a/b/z', 'a/.git/HEAD', 'c/sitemap.xml',
+                      'c/w'):
+                with open(os.path.join(tmpdir, f), 'w') as fh:
+                    fh.write(f)
+            os.symlink(os.path.join(tmpdir, 'x'),
+                       os.path.join(tmpdir, 'c/link'))
+            os.symlink(os.path.join(tmpdir, 'a'),
+                       os.path.join(tmpdir, 'c/dirlink'))
+            uris = {}
+            for workers in (1, 3):
+                rlb = ResourceListBuilder()
+                rlb.scan_workers = workers
+                rlb.mapper = Mapper(['http://example.org/t', tmpdir])
+                rl = rlb.from_disk()
+                uris[workers] = [r.uri for r in rl]
+                rlb.include_symlinks = True
+                rl = rlb.from_disk()
+                self.assertTrue('http://example.org/t/c/link' in rl.uris())
+                self.assertEqual(len(rl), 5)
+                files = [f for (f, s) in rlb.scan_dir(tmpdir)]
+                self.assertEqual(
+                    [f[len(tmpdir):] for f in files],
+                    ['/x', '/a/y', '/a/b/z', '/c/link', '/c/w'])
+            self.assertEqual(uris[1], uris[3])
+            self.assertEqual(uris[1], ['http://example.org/t/a/b/z',
+                                       'http://example.org/t/a/y',
+                                       'http://example.org/t/c/w',
+                                       'http://example.org/t/x'])
+            # glob rules on names and paths, a/b pruned
+            rlb = ResourceListBuilder()
+            rlb.mapper = Mapper(['http://example.org/t', tmpdir])
+            rlb.exclude_globs = ['w', os.path.join(tmpdir, 'a', 'b')]
+            rl = rlb.from_disk()
+            self.assertEqual(rl.uris(), ['http://example.org/t/a/y',
+                                         'http://example.org/t/x'])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test07_checksum_workers(self):
+        rlb = ResourceListBuilder(set_md5=True)
+        rlb.mapper = Mapper(['http://example.org/t', 'resync/test/testdata'])
+        rl1 = rlb.from_disk()
+        rlb.checksum_workers = 3
+        rl3 = rlb.from_disk()
+        self.assertTrue(len(rl1) > 2)
+        self.assertEqual([(r.uri, r.md5, r.length) for r in rl1],
+                         [(r.uri, r.md5, r.length) for r in rl3])
+        self.assertEqual(
+            rl3.resources.get('http://example.org/t/dir1/file_a').md5,
+            'a/Jv1mYBtSjS4LR+qoft/Q==')
+
+    def test08_sha_digests(self):
+        rlb = ResourceListBuilder(set_sha1=True, set_sha256=True)
+        rlb.mapper = Mapper(['http://example.org/t', 'resync/test/testdata'])
+        self.assertEqual(rlb.digests, ('sha1', 'sha256'))
+        rl = rlb.from_disk()
+        r = rl.resources.get('http://example.org/t/a')
+        self.assertEqual(r.md5, None)
+        self.assertEqual(r.sha1, 'SYRN0hGqMwcaJS183CUKUs85rzM=')
+        self.assertEqual(r.sha256,
+                         'af5jFKlIAEVq+VnTgPXWkyBSR46gPVzKx7oKFL1eZ8Y=')
+        rlb.checksum_workers = 2
+        rl2 = rlb.from_disk()
+        self.assertEqual([r.hash for r in rl], [r.hash for r in rl2])
+
 if __name__ == '__main__':
     suite = unittest.defaultTestLoader.loadTestsFromTestCase(
         TestResourceListBuilder)
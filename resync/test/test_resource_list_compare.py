@@ -0,0 +1,172 @@
+import unittest
+import random
+from resync.resource import Resource
+from resync.resource_list import ResourceList, ResourceListOrdered
+from resync.resource_list_compare import compare_iter, hash_compare_iter, \
+    external_sort, ResourceColumns, compare_columns
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+
+class TestResourceListCompare(unittest.TestCase):
+
+    def test01_compare_iter(self):
+        dst = [Resource('a', timestamp=1), Resource('b', timestamp=2),
+               Resource('c', timestamp=3)]
+        src = [Resource('a', timestamp=1), Resource('b', timestamp=5),
+               Resource('d', timestamp=4)]
+        events = [(s, r.uri) for (s, r) in compare_iter(iter(dst), iter(src))]
+        self.assertEqual(events, [('updated', 'b'), ('deleted', 'c'),
+                                  ('created', 'd')])
+        events = [(s, r.uri) for (s, r) in
+                  compare_iter(iter(dst), iter(src), include_same=True)]
+        self.assertEqual(events, [('same', 'a'), ('updated', 'b'),
+                                  ('deleted', 'c'), ('created', 'd')])
+        # updated gives the src resource
+        (s, r) = next(compare_iter(iter(dst), iter(src)))
+        self.assertEqual(r.timestamp, 5)
+
+    def test02_compare_iter_empty(self):
+        self.assertEqual(list(compare_iter(iter([]), iter([]))), [])
+        events = [(s, r.uri) for (s, r) in
+                  compare_iter(iter([Resource('a')]), iter([]))]
+        self.assertEqual(events, [('deleted', 'a')])
+        events = [(s, r.uri) for (s, r) in
+                  compare_iter(iter([]), iter([Resource('a')]))]
+        self.assertEqual(events, [('created', 'a')])
+
+    def test03_resource_list_compare_iter(self):
+        src = ResourceList()
+        src.add(Resource('a', timestamp=1))
+        src.add(Resource('c', timestamp=3))
+        dst = ResourceList()
+        dst.add(Resource('a', timestamp=2))
+        dst.add(Resource('b', timestamp=2))
+        events = [(s, r.uri) for (s, r) in dst.compare_iter(src)]
+        self.assertEqual(events, [('updated', 'a'), ('deleted', 'b'),
+                                  ('created', 'c')])
+
+    def test04_external_sort(self):
+        uris = ['r%04d' % ((n * 7919) % 1000) for n in range(1000)]
+        resources = [Resource(uri, timestamp=n, length=n, md5='x%d' % n)
+                     for (n, uri) in enumerate(uris)]
+        # single run
+        out = list(external_sort(resources))
+        self.assertEqual([r.uri for r in out], sorted(uris))
+        # many runs through temporary files
+        out = list(external_sort(iter(resources), run_size=64))
+        self.assertEqual([r.uri for r in out], sorted(uris))
+        r = out[0]
+        self.assertEqual(r.uri, 'r0000')
+        self.assertEqual(r.md5, 'x%d' % (r.timestamp))
+        self.assertEqual(r.length, r.timestamp)
+
+    def test05_external_sort_compare(self):
+        dst = [Resource('r%03d' % n, timestamp=n) for n in range(0, 300, 2)]
+        src = [Resource('r%03d' % n, timestamp=n) for n in range(0, 300, 3)]
+        dst.reverse()
+        src.reverse()
+        counts = {'same': 0, 'updated': 0, 'deleted': 0, 'created': 0}
+        for (status, r) in compare_iter(external_sort(dst, run_size=10),
+                                        external_sort(src, run_size=10),
+                                        include_same=True):
+            counts[status] += 1
+        self.assertEqual(counts, {'same': 50, 'updated': 0,
+                                  'deleted': 100, 'created': 50})
+
+    def test06_hash_compare_iter(self):
+        dst = [Resource('c', timestamp=3), Resource('b', timestamp=2),
+               Resource('a', timestamp=1)]
+        src = [Resource('d', timestamp=4), Resource('a', timestamp=1),
+               Resource('b', timestamp=5)]
+        expected = [('created', 'd'), ('deleted', 'c'),
+                    ('same', 'a'), ('updated', 'b')]
+        events = sorted((s, r.uri) for (s, r) in
+                        hash_compare_iter(dst, src, include_same=True))
+        self.assertEqual(events, expected)
+        # smaller src side indexed instead
+        events = sorted((s, r.uri) for (s, r) in
+                        hash_compare_iter(dst, src[:2], include_same=True))
+        self.assertEqual(events, [('created', 'd'), ('deleted', 'b'),
+                                  ('deleted', 'c'), ('same', 'a')])
+        events = sorted((s, r.uri) for (s, r) in hash_compare_iter(dst, src))
+        self.assertEqual(events, [('created', 'd'), ('deleted', 'c'),
+                                  ('updated', 'b')])
+
+    def test07_compare_unordered(self):
+        src = ResourceList(resources_class=ResourceListOrdered)
+        src.add(Resource('c', timestamp=3))
+        src.add(Resource('a', timestamp=1))
+        src.add(Resource('d', timestamp=4))
+        dst = ResourceList(resources_class=ResourceListOrdered)
+        dst.add(Resource('d', timestamp=4))
+        dst.add(Resource('b', timestamp=2))
+        dst.add(Resource('a', timestamp=9))
+        (same, updated, deleted, created) = dst.compare(src)
+        self.assertEqual(same.uris(), ['d'])
+        self.assertEqual(updated.uris(), ['a'])
+        self.assertEqual(deleted.uris(), ['b'])
+        self.assertEqual(created.uris(), ['c'])
+        # mixed ordered and unordered
+        src2 = ResourceList()
+        src2.add(src)
+        (same, updated, deleted, created) = dst.compare(src2)
+        self.assertEqual(same.uris(), ['d'])
+        self.assertEqual(created.uris(), ['c'])
+
+    @unittest.skipIf(numpy is None, "NumPy not installed")
+    def test08_compare_columns(self):
+        dst = ResourceColumns.from_resources(
+            [Resource('d', timestamp=4),
+             Resource('a', timestamp=1.0),
+             Resource('b', timestamp=2, length=5),
+             Resource('c', md5='m1', timestamp=9),
+             Resource('e')])
+        src = ResourceColumns.from_resources(
+            [Resource('a', timestamp=1.5),
+             Resource('b', timestamp=2, length=6),
+             Resource('c', md5='m1', timestamp=3),
+             Resource('f', timestamp=6),
+             Resource('e', timestamp=7)])
+        (same, updated, deleted, created) = compare_columns(dst, src)
+        self.assertEqual(list(dst.uri[same]), ['a', 'c'])
+        self.assertEqual(list(src.uri[updated]), ['b', 'e'])
+        self.assertEqual(list(dst.uri[deleted]), ['d'])
+        self.assertEqual(list(src.uri[created]), ['f'])
+        # Empty lists
+        empty = ResourceColumns([], [], [], [])
+        (same, updated, deleted, created) = compare_columns(empty, src)
+        self.assertEqual(len(same) + len(updated) + len(deleted), 0)
+        self.assertEqual(len(created), 5)
+
+    @unittest.skipIf(numpy is None, "NumPy not installed")
+    def test09_compare_columns_matches_compare(self):
+        rnd = random.Random(42)
+
+        def rand_resource(n):
+            return(Resource('r%03d' % n,
+                            timestamp=rnd.choice([None, 1, 1.5, 3]),
+                            length=rnd.choice([None, 10, 11]),
+                            md5=rnd.choice([None, None, 'x', 'y'])))
+        dst = ResourceList()
+        src = ResourceList()
+        for n in range(200):
+            if (rnd.random() < 0.8):
+                dst.add(rand_resource(n))
+            if (rnd.random() < 0.8):
+                src.add(rand_resource(n))
+        expected = [[r.uri for r in rl] for rl in dst.compare(src)]
+        dstc = ResourceColumns.from_resources(dst)
+        srcc = ResourceColumns.from_resources(src)
+        (same, updated, deleted, created) = compare_columns(dstc, srcc)
+        self.assertEqual([list(dstc.uri[same]), list(srcc.uri[updated]),
+                          list(dstc.uri[deleted]), list(srcc.uri[created])],
+                         expected)
+
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestResourceListCompare)
+    unittest.TextTestRunner().run(suite)
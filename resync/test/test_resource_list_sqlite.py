@@ -0,0 +1,174 @@
+import os.path
+import unittest
+import tempfile
+import shutil
+from resync.resource import Resource
+from resync.resource_list import ResourceList, ResourceListDupeError
+from resync.resource_list_sqlite import ResourceListSqlite
+
+
+class TestResourceListSqlite(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test01_add_iter_len(self):
+        rls = ResourceListSqlite()
+        rls.add(Resource('c', timestamp=3))
+        rls.add(Resource('a', timestamp=1, length=10, md5='aabbcc'))
+        rls.add(Resource('b', timestamp=2, mime_type='text/plain'))
+        self.assertEqual(len(rls), 3)
+        self.assertEqual(rls.uris(), ['a', 'b', 'c'])
+        self.assertEqual([r.uri for r in rls], ['a', 'b', 'c'])
+        a = rls['a']
+        self.assertEqual(a.timestamp, 1)
+        self.assertEqual(a.length, 10)
+        self.assertEqual(a.md5, 'aabbcc')
+        self.assertEqual(rls['b'].mime_type, 'text/plain')
+        self.assertTrue('c' in rls)
+        self.assertFalse('d' in rls)
+        tmpfile = rls.filename
+        self.assertTrue(os.path.exists(tmpfile))
+        rls.close()
+        self.assertFalse(os.path.exists(tmpfile))
+
+    def test02_dupe_replace_remove(self):
+        rls = ResourceListSqlite()
+        rls.add(Resource('a', timestamp=1))
+        self.assertRaises(ResourceListDupeError, rls.add,
+                          Resource('a', timestamp=2))
+        rls.add(Resource('a', timestamp=2), replace=True)
+        self.assertEqual(len(rls), 1)
+        self.assertEqual(rls['a'].timestamp, 2)
+        rls.add(Resource('b', timestamp=2), replace=True)
+        self.assertEqual(len(rls), 2)
+        rls.remove(Resource('a'))
+        rls.remove(Resource('x'))
+        self.assertEqual(len(rls), 1)
+        self.assertEqual(rls.uris(), ['b'])
+        rls.close()
+
+    def test03_extra_and_links(self):
+        rls = ResourceListSqlite()
+        r = Resource('a', lastmod='2013-01-01T00:00:00Z', change='updated',
+                     md_at='2013-01-02T00:00:00Z', capability='resourcelist')
+        r.link_set('duplicate', 'http://mirror.example.org/a', pri=1)
+        rls.add(r)
+        a = rls['a']
+        self.assertEqual(a.lastmod, '2013-01-01T00:00:00Z')
+        self.assertEqual(a.change, 'updated')
+        self.assertEqual(a.md_at, '2013-01-02T00:00:00Z')
+        self.assertEqual(a.capability, 'resourcelist')
+        self.assertEqual(a.link_href('duplicate'),
+                         'http://mirror.example.org/a')
+        self.assertEqual(a.link('duplicate')['pri'], 1)
+        rls.close()
+
+    def test04_resource_list_reopen(self):
+        filename = os.path.join(self.tmpdir, 'rl.sqlite')
+        rl = ResourceList(resources=ResourceListSqlite(filename))
+        rl.add([Resource('b', timestamp=2), Resource('a', timestamp=1)])
+        self.assertEqual(len(rl), 2)
+        rl.resources.close()
+        self.assertTrue(os.path.exists(filename))
+        rl = ResourceList(resources=ResourceListSqlite(filename))
+        self.assertEqual(len(rl), 2)
+        self.assertEqual(rl.uris(), ['a', 'b'])
+        rl.resources.close()
+
+    def test05_compare(self):
+        src = ResourceList(resources_class=ResourceListSqlite)
+        src.add(Resource('a', timestamp=1))
+        src.add(Resource('b', timestamp=2))
+        src.add(Resource('d', timestamp=4))
+        dst = ResourceList(resources_class=ResourceListSqlite)
+        dst.add(Resource('a', timestamp=1))
+        dst.add(Resource('b', timestamp=3))
+        dst.add(Resource('c', timestamp=3))
+        (same, updated, deleted, created) = dst.compare(src)
+        self.assertEqual(same.uris(), ['a'])
+        self.assertEqual(updated.uris(), ['b'])
+        self.assertEqual(deleted.uris(), ['c'])
+        self.assertEqual(created.uris(), ['d'])
+
+    def test05a_compare_results_on_disk(self):
+        src = ResourceList(resources_class=ResourceListSqlite)
+        src.add(Resource('a', timestamp=1))
+        dst = ResourceList(resources_class=ResourceListSqlite)
+        (same, updated, deleted, created) = dst.compare(src)
+        for result in (same, updated, deleted, created):
+            self.assertTrue(isinstance(result.resources, ResourceListSqlite))
+        self.assertEqual(created.uris(), ['a'])
+
+    def test05b_read_index_only(self):
+        xml = '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/"><rs:md capability="resourcelist" /><sitemap><loc>http://e.com/sitemap00001.xml</loc></sitemap><sitemap><loc>http://e.com/sitemap00000.xml</loc></sitemap></sitemapindex>'
+        filename = os.path.join(self.tmpdir, 'sitemap.xml')
+        with open(filename, 'w') as fh:
+            fh.write(xml)
+        rl = ResourceList(resources_class=ResourceListSqlite)
+        rl.read('file://' + filename, index_only=True)
+        self.assertTrue(rl.sitemapindex)
+        self.assertTrue(isinstance(rl.resources, ResourceListSqlite))
+        self.assertEqual(rl.uris(), ['http://e.com/sitemap00000.xml',
+                                     'http://e.com/sitemap00001.xml'])
+
+    def test06_parse_and_write(self):
+        xml = '<?xml version=\'1.0\' encoding=\'UTF-8\'?>\n<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/"><rs:md capability="resourcelist" /><url><loc>http://e.com/b</loc><lastmod>2012-03-14T18:37:36Z</lastmod><rs:md length="12" /></url><url><loc>http://e.com/a</loc><lastmod>2012-03-14T18:37:36Z</lastmod><rs:md length="12" /></url></urlset>'
+        rl = ResourceList(resources_class=ResourceListSqlite)
+        rl.parse(string=xml)
+        self.assertEqual(len(rl), 2)
+        self.assertEqual(rl.uris(), ['http://e.com/a', 'http://e.com/b'])
+        out = rl.as_xml()
+        self.assertTrue(out.index('http://e.com/a') < out.index('http://e.com/b'))
+
+    def test07_reopen_md_and_ln(self):
+        filename = os.path.join(self.tmpdir, 'rl.sqlite')
+        rl = ResourceList(resources=ResourceListSqlite(filename))
+        rl.add(Resource('a', timestamp=1))
+        rl.md_at = '2013-01-03T00:00:00Z'
+        rl.md_completed = '2013-01-03T01:00:00Z'
+        rl.link_set('describedby', 'http://example.org/about')
+        rl.resources.close()
+        rl = ResourceList(resources=ResourceListSqlite(filename))
+        self.assertEqual(rl.md_at, '2013-01-03T00:00:00Z')
+        self.assertEqual(rl.md_completed, '2013-01-03T01:00:00Z')
+        self.assertEqual(rl.link_href('describedby'),
+                         'http://example.org/about')
+        # values given on creation are not replaced
+        rl.resources.close()
+        rl = ResourceList(resources=ResourceListSqlite(filename),
+                          md={'md_at': '2014-01-01T00:00:00Z'})
+        self.assertEqual(rl.md_at, '2014-01-01T00:00:00Z')
+        self.assertEqual(rl.md_completed, '2013-01-03T01:00:00Z')
+        rl.resources.close()
+    def test08_resource_class_without_from_fields(self):
+        class SimpleResource(object):
+            def __init__(self, uri, timestamp=None, length=None, md5=None,
+                         sha1=None, sha256=None, mime_type=None,
+                         change=None, path=None):
+                self.uri = uri
+                self.timestamp = timestamp
+                self.length = length
+                self.change = change
+        rls = ResourceListSqlite(resource_class=SimpleResource)
+        r = Resource('a', timestamp=1, length=10, change='updated',
+                     md_at='2013-01-02T00:00:00Z')
+        r.link_set('duplicate', 'http://mirror.example.org/a')
+        rls.add(r)
+        a = rls['a']
+        self.assertTrue(isinstance(a, SimpleResource))
+        self.assertEqual(a.timestamp, 1)
+        self.assertEqual(a.length, 10)
+        self.assertEqual(a.change, 'updated')
+        # non-core attributes are set as stored by Resource
+        self.assertEqual(a.ts_at, 1357084800)
+        self.assertEqual(a.ln[0]['href'], 'http://mirror.example.org/a')
+        self.assertEqual([r.uri for r in rls], ['a'])
+        rls.close()
+
+if __name__ == '__main__':
+    suite = unittest.defaultTestLoader.loadTestsFromTestCase(TestResourceListSqlite)
+    unittest.TextTestRunner().run(suite)
@@ -2,6 +2,7 @@ import sys
 import unittest
 import io
 from resync.resource import Resource
+from resync.resource_container import ResourceContainer
 from resync.resource_list import ResourceList
 from resync.sitemap import Sitemap, SitemapIndexError, SitemapParseError
 
@@ -289,6 +290,43 @@ class TestSitemap(unittest.TestCase):
         self.assertEqual(r2.uri, '/tmp/rs_test/src/file_b')
         self.assertEqual(r2.change, None)
 
+    def test_31_parse_resource_class_without_from_fields(self):
+        class SimpleResource(object):
+            def __init__(self, uri, timestamp=None, length=None,
+                         mime_type=None, change=None, path=None):
+                self.uri = uri
+                self.timestamp = timestamp
+                self.length = length
+                self.change = change
+        xml = '<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\
+<url><loc>http://e.com/a</loc><lastmod>2012-03-14T18:37:36Z</lastmod><rs:md change="updated" length="12" /></url>\
+</urlset>'
+        s = Sitemap()
+        s.resource_class = SimpleResource
+        c = s.parse_xml(fh=io.StringIO(xml), resources=ResourceContainer())
+        r = next(iter(c))
+        self.assertTrue(isinstance(r, SimpleResource))
+        self.assertEqual(r.uri, 'http://e.com/a')
+        self.assertEqual(r.timestamp, 1331750256)
+        self.assertEqual(r.length, 12)
+        self.assertEqual(r.change, 'updated')
+
+    def test_23_parse_sitemapindex_md_from_until(self):
+        s = Sitemap()
+        index = ResourceContainer()
+        c = s.parse_xml(fh=io.StringIO(
+            '<sitemapindex xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/"><rs:md capability="changelist" from="2013-01-01T00:00:00Z"/><sitemap><loc>aaa</loc><rs:md from="2013-01-01T00:00:00Z" until="2013-01-02T00:00:00Z"/></sitemap><sitemap><loc>bbb</loc><rs:md from="2013-01-02T00:00:00Z"/></sitemap></sitemapindex>'),
+            index_resources=index)
+        self.assertTrue(s.parsed_index, 'was a sitemapindex')
+        # entries go to index_resources, metadata to resources
+        self.assertEqual(len(c.resources), 0)
+        self.assertEqual(c.md['md_from'], '2013-01-01T00:00:00Z')
+        (a, b) = index.resources
+        self.assertEqual(a.md_from, '2013-01-01T00:00:00Z')
+        self.assertEqual(a.md_until, '2013-01-02T00:00:00Z')
+        self.assertEqual(b.md_from, '2013-01-02T00:00:00Z')
+        self.assertEqual(b.md_until, None)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestSitemap)
     unittest.TextTestRunner(verbosity=2).run(suite)
@@ -89,6 +89,42 @@ class TestUrlAuthority(unittest.TestCase):
         self.assertFalse(uauth.has_authority_over(
             'http://sub.b.example.org/sitemap.xml'))
 
+    def test07_url_prefix(self):
+        uauth = UrlAuthority('http://example.org/dir/sitemap.xml')
+        self.assertEqual(uauth.url_prefix('http://example.org/a/b'),
+                         'http://example.org/a/')
+        self.assertEqual(uauth.url_prefix('http://example.org/b'),
+                         'http://example.org/')
+        self.assertEqual(uauth.url_prefix('http://example.org'), None)
+        self.assertEqual(uauth.url_prefix('http://example.org/a?b/c'), None)
+        self.assertEqual(uauth.url_prefix('http://example.org/a#b/c'), None)
+        self.assertEqual(uauth.url_prefix('noslash'), None)
+
+    def test08_cached(self):
+        uauth = UrlAuthority('http://example.org/dir/sitemap.xml', True)
+        uauth.cache_size = 2
+        for n in range(3):
+            self.assertTrue(uauth.has_authority_over(
+                'http://example.org/dir/%d' % n))
+            self.assertFalse(uauth.has_authority_over(
+                'http://example.org/%d' % n))
+            self.assertTrue(uauth.has_authority_over(
+                'http://example.org/dir/sub/%d' % n))
+            self.assertFalse(uauth.has_authority_over(
+                'http://example.org/dir?x=/dir/%d' % n))
+        self.assertTrue(len(uauth.cache) <= 2)
+        # changing master clears the cache
+        uauth.set_master('http://example.org/sitemap.xml')
+        self.assertTrue(uauth.has_authority_over('http://example.org/0'))
+
+    def test09_without_authority(self):
+        uauth = UrlAuthority('http://example.org/dir/sitemap.xml', True)
+        urls = ['http://example.org/dir/a', 'http://other.org/dir/b',
+                'http://example.org/dir/c', 'http://example.org/d']
+        self.assertEqual(list(uauth.without_authority(urls)),
+                         ['http://other.org/dir/b', 'http://example.org/d'])
+        self.assertEqual(next(uauth.without_authority(urls[0:1]), None), None)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestUrlAuthority)
     unittest.TextTestRunner(verbosity=2).run(suite)
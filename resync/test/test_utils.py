@@ -18,5 +18,16 @@ class TestUtill(unittest.TestCase):
         file = os.path.join(curr_dir, "testdata/finder.png")
         self.assertEqual('KILnhtMbzHrN3yjI7cRxlg==', resync.utils.compute_md5_for_file(file))
 
+    def test4_digests(self):
+        file = os.path.join(curr_dir, "testdata/finder.png")
+        # small block size to check multiple reads
+        d = resync.utils.compute_digests_for_file(file, ('md5', 'sha1', 'sha256'), block_size=1000)
+        self.assertEqual(d, {'md5': 'KILnhtMbzHrN3yjI7cRxlg==',
+                             'sha1': 'w8UDL8YLZsf7iiC0FLl4BGLNrAE=',
+                             'sha256': 'ZNTgOmI5GyYb+iVBY27PE3OPFBZWCmLfVoRlMZuDuyo='})
+        self.assertEqual(resync.utils.compute_digests_for_file(file, ['sha1']),
+                         {'sha1': 'w8UDL8YLZsf7iiC0FLl4BGLNrAE='})
+        self.assertRaises(ValueError, resync.utils.compute_digests_for_file, file, ['crc32'])
+
 if __name__ == '__main__':
     unittest.main()
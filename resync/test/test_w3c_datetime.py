@@ -1,5 +1,5 @@
 import unittest
-from resync.w3c_datetime import str_to_datetime, datetime_to_str
+from resync.w3c_datetime import str_to_datetime, datetime_to_str, DatetimeFormatter
 
 
 def rt(dts):
@@ -102,6 +102,38 @@ class TestW3cDatetime(unittest.TestCase):
         self.assertEqual(rt('2012-03-14T18:37:36-01:01'),
                          '2012-03-14T17:36:36Z')
 
+    def test6_fast_path_same_as_general(self):
+        for (fast, general) in (
+                ('2012-03-14T18:37:36Z', '2012-03-14T18:37:36+00:00'),
+                ('2012-03-14T18:37:36.5Z', '2012-03-14T18:37:36.5+00:00'),
+                ('1999-12-31T23:59:59.999999Z',
+                 '1999-12-31T23:59:59.999999-00:00'),
+                ('2012-02-29T00:00:00Z', '2012-02-29'),
+                ('1970-01-01T00:00:00Z', '1970')):
+            self.assertEqual(str_to_datetime(fast), str_to_datetime(general))
+        # repeated values come from the cache
+        self.assertEqual(str_to_datetime('2012-03-14T18:37:36Z'), 1331750256)
+        # bad values still rejected
+        self.assertRaises(ValueError, str_to_datetime, "2013-02-29T00:00:00Z")
+        self.assertRaises(ValueError, str_to_datetime, "2012-11-01T24:00:00Z")
+        self.assertRaises(ValueError, str_to_datetime, "2012-11-01T01:01:01.Z")
+
+    def test7_formatter(self):
+        f = DatetimeFormatter()
+        self.assertEqual(f(None), None)
+        for dt in (0, 1331750256, 1331750256.1, 1331750256.5, 1331750256.1,
+                   1331750256.9999996, 1331750257, -1, -0.25, 1e-7,
+                   1331750256.0000001):
+            self.assertEqual(f(dt), datetime_to_str(dt))
+        self.assertEqual(f(1331750256.1), '2012-03-14T18:37:36.100000Z')
+        self.assertTrue(f.hits > 0)
+        # unique values give up on the cache but still correct
+        f = DatetimeFormatter(sample=10)
+        for n in range(100):
+            dt = 1000000000 + n * 1000.25
+            self.assertEqual(f(dt), datetime_to_str(dt))
+        self.assertEqual(f.prefixes, None)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestW3cDatetime)
     unittest.TextTestRunner(verbosity=2).run(suite)
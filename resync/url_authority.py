@@ -22,6 +22,11 @@ Example use:
         # will be true
     if (auth.has_authority_over("http://other.com/res1")):
         # will be false
+
+The decision depends only on the part of a URL up to the last / (unless
+there is a query or fragment) so results are memoized for these
+prefixes. Checking a long list of URLs on a few servers thus parses only
+one URL per directory.
 """
 
 import urllib.parse
@@ -34,6 +39,8 @@ class UrlAuthority(object):
         """Create object and optionally set master url and/or strict mode"""
         self.url = url
         self.strict = strict
+        self.cache_size = 10000
+        self.cache = {}
         if (self.url is not None):
             self.set_master(self.url)
         else:
@@ -47,6 +54,7 @@ class UrlAuthority(object):
         self.master_scheme = m.scheme
         self.master_netloc = m.netloc
         self.master_path = os.path.dirname(m.path)
+        self.cache = {}
 
     def has_authority_over(self, url):
         """Returns True of the current master has authority over url
@@ -55,6 +63,46 @@ class UrlAuthority(object):
         just that the server names match or the query url is a
         sub-domain of the master
         """
+        prefix = self.url_prefix(url)
+        if (prefix is None):
+            return(self._has_authority_over(url))
+        try:
+            return(self.cache[prefix])
+        except KeyError:
+            pass
+        if (len(self.cache) >= self.cache_size):
+            self.cache.clear()
+        result = self._has_authority_over(url)
+        self.cache[prefix] = result
+        return(result)
+
+    def without_authority(self, urls):
+        """Iterator over the urls that the master does not have authority over
+
+        For example, to find the first such URL in a resource list:
+
+            bad = next(auth.without_authority(r.uri for r in rl), None)
+        """
+        for url in urls:
+            if (not self.has_authority_over(url)):
+                yield url
+
+    def url_prefix(self, url):
+        """Part of url that determines authority, or None if not known
+
+        This is url up to and including the last /, provided that it is
+        in the path and there is no query or fragment which might
+        include a /.
+        """
+        if ('?' in url or '#' in url):
+            return(None)
+        slash = url.rfind('/')
+        double = url.find('//')
+        if (slash < 0 or (double >= 0 and slash <= double + 1)):
+            return(None)
+        return(url[:slash + 1])
+
+    def _has_authority_over(self, url):
         s = urllib.parse.urlparse(url)
         if (s.scheme != self.master_scheme):
             return(False)
@@ -5,7 +5,6 @@ util.py: A collection of common util functions used in source and/or client.
 
 import base64
 import hashlib
-from functools import partial
 from logging import Formatter
 from datetime import datetime
 
@@ -76,15 +75,62 @@ def old_compute_md5_for_file(filename, block_size=2**14):
     f.close()
     return base64.b64encode(md5.digest()).decode('utf-8')
 
-def compute_md5_for_file(filename, block_size=2**14):
+# Digest types supported, keyed by the Resource attribute name
+DIGEST_ALGORITHMS = {
+    'md5': hashlib.md5,
+    'sha1': hashlib.sha1,
+    'sha256': hashlib.sha256
+}
+
+
+def compute_md5_for_file(filename, block_size=2**20):
     """Compute MD5 digest for a file
 
     Optional block_size parameter controls memory used to do MD5 calculation.
     This should be a multiple of 128 bytes.
     """
+    return compute_digests_for_file(filename, ('md5',), block_size)['md5']
+
+
+def compute_digests_for_file(filename, digests=('md5',), block_size=2**20):
+    """Compute a set of digests for a file in one read
+
+    digests is an iterable of names from DIGEST_ALGORITHMS ('md5', 'sha1',
+    'sha256'). Returns a dict of base64 encoded digest strings keyed by
+    name, for example {'md5': ..., 'sha256': ...}.
+
+    The file is read once with a single buffer of block_size bytes which
+    is passed to each digest. hashlib releases the GIL while hashing large
+    buffers so this may be called from several threads in parallel.
+    """
     with open(filename, mode='rb') as f:
-        d = hashlib.md5()
-        for buf in iter(partial(f.read, block_size), b''):
-            d.update(buf)
+        return copy_and_digest(f, None, digests, block_size)[1]
+
+
+def copy_and_digest(src, dst=None, digests=('md5',), block_size=2**20):
+    """Copy file object src to dst computing digests on the way
 
-    return base64.b64encode(d.digest()).decode('utf-8')
\ No newline at end of file
+    Reads src to the end with a single buffer of block_size bytes which
+    is passed to each digest and written to dst unless dst is None.
+    Returns (size, digests) where size is the number of bytes read and
+    digests a dict as from compute_digests_for_file().
+    """
+    hashers = []
+    for name in digests:
+        if (name not in DIGEST_ALGORITHMS):
+            raise ValueError("Unsupported digest type %s" % (name))
+        hashers.append((name, DIGEST_ALGORITHMS[name]()))
+    buf = bytearray(block_size)
+    view = memoryview(buf)
+    size = 0
+    while True:
+        n = src.readinto(buf)
+        if not n:
+            break
+        size += n
+        for (name, h) in hashers:
+            h.update(view[:n])
+        if (dst is not None):
+            dst.write(view[:n])
+    return (size, dict((name, base64.b64encode(h.digest()).decode('utf-8'))
+                       for (name, h) in hashers))
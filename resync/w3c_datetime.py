@@ -7,12 +7,22 @@ provides ISO8601 format string access to the timestamp.
 The timestamp is assumed to be stored in UTC.
 """
 
+import math
 import time
 from calendar import timegm
 from datetime import datetime
+from functools import lru_cache
 from dateutil import parser as dateutil_parser
 import re
 
+# The canonical form written by datetime_to_str(), parsed without dateutil
+CANONICAL_DATETIME = re.compile(
+    r"(\d\d\d\d)-(\d\d)-(\d\d)T(\d\d):(\d\d):(\d\d)(\.\d+)?Z$")
+DATE_ONLY = re.compile(r"\d\d\d\d(\-\d\d(\-\d\d)?)?$")
+FRACTIONAL_SECONDS = re.compile(r"(.*\d{2}:\d{2}:\d{2})(\.\d+)([^\d].*)?$")
+DATETIME_WITH_TZ = re.compile(
+    r"(\d\d\d\d\-\d\d\-\d\dT\d\d:\d\d(:\d\d)?)(Z|([+-])(\d\d):(\d\d))$")
+
 
 def datetime_to_str(dt='now', no_fractions=False):
     """The Last-Modified data in ISO8601 syntax, Z notation
@@ -36,6 +46,63 @@ def datetime_to_str(dt='now', no_fractions=False):
     return datetime.utcfromtimestamp(dt).isoformat() + 'Z'
 
 
+class DatetimeFormatter(object):
+    """Format many timestamps as datetime_to_str(dt) would
+
+    Intended for writing sitemaps where the same whole second often
+    appears in many timestamps (files copied or generated together).
+    The YYYY-MM-DDThh:mm:ss prefix for each whole second is cached
+    and only the fraction formatted for each call, so output is
+    identical to datetime_to_str(dt) but without creating a datetime
+    object each time.
+
+    Where timestamps are all different the cache would only add
+    overhead so after sample misses without as many hits the cache
+    is dropped and every call simply uses datetime_to_str().
+
+    size - maximum number of cached prefixes, the cache is cleared
+        when full
+
+    sample - number of cache misses after which the hit rate is checked
+    """
+
+    def __init__(self, size=65536, sample=1000):
+        self.size = size
+        self.sample = sample
+        self.prefixes = {}
+        self.hits = 0
+        self.misses = 0
+
+    def __call__(self, dt):
+        """W3C datetime string for timestamp dt, or None if dt is None"""
+        if (dt is None or self.prefixes is None):
+            return datetime_to_str(dt)
+        (frac, whole) = math.modf(dt)
+        # utcfromtimestamp() rounds to the nearest microsecond, leave
+        # negative timestamps and rounding up to the next second to it
+        us = round(frac * 1e6)
+        if (frac < 0.0 or us >= 1000000):
+            return datetime_to_str(dt)
+        prefix = self.prefixes.get(whole)
+        if (prefix is not None):
+            self.hits += 1
+            if (us):
+                return('%s.%06dZ' % (prefix, us))
+            return(prefix + 'Z')
+        s = datetime_to_str(dt)
+        self.misses += 1
+        if (self.misses >= self.sample):
+            if (self.hits < self.misses):
+                self.prefixes = None
+                return(s)
+            self.hits = 0
+            self.misses = 0
+        if (len(self.prefixes) >= self.size):
+            self.prefixes.clear()
+        self.prefixes[whole] = s[:19]
+        return(s)
+
+
 def str_to_datetime(s, context='datetime'):
     """Set timestamp from an W3C Datetime Last-Modified value
 
@@ -69,14 +136,33 @@ def str_to_datetime(s, context='datetime'):
 
     Datetimes not specified to the level of seconds are intepreted
     as 00.0 seconds.
+
+    Results are cached because the same values are very common in
+    bulk exports, and the canonical YYYY-MM-DDThh:mm:ss(.s)Z form is
+    parsed without using the general dateutil parser.
     """
     t = None
     if (s is None):
         return(t)
     if (s == ''):
         raise ValueError('Attempt to set empty %s' % (context))
+    return(_str_to_datetime(s))
+
+
+@lru_cache(maxsize=65536)
+def _str_to_datetime(s):
+    """Parse non-empty W3C Datetime string s, see str_to_datetime()"""
+    m = CANONICAL_DATETIME.match(s)
+    if (m is not None):
+        # Fast path, datetime() checks the values are in range
+        fields = [int(x) for x in m.groups()[:6]]
+        datetime(*fields)
+        t = timegm(fields)
+        if (m.group(7) is not None):
+            t += float(m.group(7))
+        return(t)
     # Make a date into a full datetime
-    m = re.match(r"\d\d\d\d(\-\d\d(\-\d\d)?)?$", s)
+    m = DATE_ONLY.match(s)
     if (m is not None):
         if (m.group(1) is None):
             s += '-01-01'
@@ -84,7 +170,7 @@ def str_to_datetime(s, context='datetime'):
             s += '-01'
         s += 'T00:00:00Z'
     # Now have datetime with timezone info
-    m = re.match(r"(.*\d{2}:\d{2}:\d{2})(\.\d+)([^\d].*)?$", s)
+    m = FRACTIONAL_SECONDS.match(s)
     # Chop out fractional seconds if present
     fractional_seconds = 0
     if (m is not None):
@@ -99,8 +185,7 @@ def str_to_datetime(s, context='datetime'):
     # Seems that one should be able to handle timezone offset
     # with dt.tzinfo module but this has variation in behavior
     # between python 2.6 and 2.7... so do here for now
-    m = re.match(
-        r"(\d\d\d\d\-\d\d\-\d\dT\d\d:\d\d(:\d\d)?)(Z|([+-])(\d\d):(\d\d))$", s)
+    m = DATETIME_WITH_TZ.match(s)
     if (m is None):
         raise ValueError("Bad datetime format (%s)" % s)
     str_date = m.group(1) + 'Z'
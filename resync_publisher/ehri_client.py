@@ -10,6 +10,8 @@ Created on 24 sep. 2015
 import logging, os.path, urllib.parse, platform
 from resync.client import Client
 from resync.change_list import ChangeList
+from resync.change_list_writer import ChangeListWriter
+from resync.resource import Resource
 
 logger = logging.getLogger(__name__)
 
@@ -20,6 +22,40 @@ def normalizePath(absolutepath):
     else:
         return absolutepath
 
+def create_empty_sitemap(uri, capability):
+    """ Write a sitemap with no entries at the local path of uri unless
+    there is already a file there
+    """
+    p = normalizePath(urllib.parse.urlparse(uri).path)
+    if not os.path.exists(p):
+        logger.debug("creating empty %s. path = %s", capability, p)
+        with open(p, mode='w', encoding='utf-8') as file:
+            file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+            file.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\n')
+            file.write('<rs:md capability="%s" />\n' % capability)
+            file.write('</urlset>')
+
+def unpublished_changes(rl, published, links=None):
+    """ Return ChangeList of the changes needed to bring the change list
+    from the last change already published for each resource, as given
+    by published which maps uri to (change, lastmod), to the resources
+    in ResourceList rl.
+    """
+    cl = ChangeList(ln=links)
+    uris = set()
+    for r in rl:
+        uris.add(r.uri)
+        last = published.get(r.uri)
+        if last is None or last[0] == 'deleted':
+            cl.add(Resource(resource=r, change='created'))
+        elif last[1] != r.lastmod:
+            cl.add(Resource(resource=r, change='updated'))
+    for uri in sorted(published):
+        (change, lastmod) = published[uri]
+        if change != 'deleted' and uri not in uris:
+            cl.add(Resource(uri=uri, lastmod=lastmod, change='deleted'))
+    return cl
+
 class ResourceSyncPublisherClient(Client):
     '''
     ResourceSyncPublisherClient
@@ -30,6 +66,8 @@ class ResourceSyncPublisherClient(Client):
         Constructor
         '''
         super(ResourceSyncPublisherClient, self).__init__(checksum, verbose, dryrun)
+        # Seconds after which a segment of the change list is closed
+        self.segment_window = None
 
     def calculate_changelist(self, paths=None, outfile=None,
                              resource_sitemap=None, changelist_sitemap=None,
@@ -37,39 +75,57 @@ class ResourceSyncPublisherClient(Client):
         """ Build a ChangeList describing the updated/new rs on local disk
         Based on the combined set of the referenced ResourceList, ChangeList
         and the local rs.
-        """
-        # create fresh resourcelist, the combination of
 
+        If scan_state_file is set then the state of the local rs as
+        published is kept there. Once it exists only the directories that
+        have changed are scanned and the changes found are appended to
+        the change list, so the time taken depends on the number of
+        changes rather than the number of rs. The first run does the full
+        calculation and records the state. In this case the change list
+        at outfile is written with a ChangeListWriter as a sitemapindex
+        of segments, of which only the last is written again, and the
+        ChangeList returned holds only the new changes. If the state is
+        lost then the full calculation is done again and only the changes
+        not already in the change list are appended.
+        """
         # When we start with a fresh directory, there will be no resource_sitemap. Just create an empty xml file
         # to get things started
-        if not os.path.exists(resource_sitemap):
-            p = normalizePath(urllib.parse.urlparse(resource_sitemap).path)
-            logger.debug("creating empty resourcelist. path = %s", p)
-            #finalPath = os.path.abspath(os.path.join(p.netloc, p.path))
-            with open(p, mode='w', encoding='utf-8') as file:
-                file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-                file.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\n')
-                file.write('<rs:md capability="resourcelist" />\n')
-                file.write('</urlset>')
-                file.close()
-
+        create_empty_sitemap(resource_sitemap, 'resourcelist')
         # Same for changelist_sitemap
-        if not os.path.exists(changelist_sitemap):
-            p = normalizePath(urllib.parse.urlparse(changelist_sitemap).path)
-            logger.debug("creating empty changelist. path = %s", p)
-            with open(p, mode='w', encoding='utf-8') as file:
-                file.write('<?xml version="1.0" encoding="UTF-8"?>\n')
-                file.write('<urlset xmlns="http://www.sitemaps.org/schemas/sitemap/0.9" xmlns:rs="http://www.openarchives.org/rs/terms/">\n')
-                file.write('<rs:md capability="changelist" />\n')
-                file.write('</urlset>')
-                file.close()
+        create_empty_sitemap(changelist_sitemap, 'changelist')
 
+        rlb = None
+        if self.scan_state_file is not None:
+            rlb = self.resource_list_builder()
+            if rlb.last_scan is not None:
+                return self.append_changes(rlb, paths, outfile,
+                                           changelist_sitemap, links)
+            logger.info("No publisher state in %s, doing full scan",
+                        self.scan_state_file)
+        try:
+            return self.calculate_full_changelist(
+                rlb, paths, outfile, resource_sitemap, changelist_sitemap,
+                links)
+        finally:
+            if rlb is not None:
+                rlb.close()
+
+    def calculate_full_changelist(self, rlb, paths, outfile,
+                                  resource_sitemap, changelist_sitemap,
+                                  links=None):
+        """ Build the ChangeList from the combined set of the referenced
+        ResourceList, ChangeList and a full scan of the local rs. If rlb
+        is not None it is the IncrementalResourceListBuilder for the
+        publisher state, which is committed once the change list has been
+        written.
+        """
 
         old_rl = self.read_reference_resource_list(resource_sitemap)
-        cl = ChangeList()
-        cl.mapper = self.mapper
-        cl.read(uri=changelist_sitemap, index_only=(not self.allow_multifile))
+        cl = self.read_published_changelist(changelist_sitemap)
+        # last change already published for each resource
+        published = {}
         for r in cl.resources:
+            published[r.uri] = (r.change, r.lastmod)
             if(r.change == 'deleted'):
                 old_rl.remove(r)
             else:
@@ -77,8 +133,9 @@ class ResourceSyncPublisherClient(Client):
                 old_rl.add(r, True)
         combined_rl = old_rl
         # update resourcelist
-        # Build a new Resource List from the rs on local disk
-        new_rl = self.build_resource_list(paths=paths, set_path=None)
+        # Build a new Resource List from the rs on local disk, this also
+        # updates the publisher state if scan_state_file is set
+        new_rl = self.build_resource_list(paths=paths, set_path=None, rlb=rlb)
         (_, updated, _, created) = combined_rl.compare(new_rl)
         combined_rl.add(updated, True)
         combined_rl.add(created, True)
@@ -89,6 +146,81 @@ class ResourceSyncPublisherClient(Client):
         cl.add_changed_resources(updated, change='updated')
         cl.add_changed_resources(deleted, change='deleted')
         cl.add_changed_resources(created, change='created')
+        if self.scan_state_file is not None and outfile is not None:
+            # continue any existing segmented change list, the segments
+            # already published are not written again
+            writer = self.change_list_writer(outfile, links)
+            writer.read_index()
+            cl = unpublished_changes(new_rl, published, links)
+            writer.append(cl)
+            rlb.commit()
+            return cl
+        cl = self.write_changelist(cl, outfile)
+        if rlb is not None:
+            rlb.commit()
+        return cl
+
+    def append_changes(self, rlb, paths, outfile, changelist_sitemap,
+                       links=None):
+        """ Scan with the IncrementalResourceListBuilder rlb and append the
+        changes since the last scan to the change list at outfile, returning
+        a ChangeList of these changes. If outfile is None then the change
+        list read from changelist_sitemap with the changes appended is
+        printed and returned.
+
+        The scan state is only committed once the changes have been
+        written, so that they are found again if writing fails. rlb is
+        closed.
+        """
+        if paths is not None:
+            paths = paths.split(',')
+        try:
+            (_, changes) = rlb.scan(paths=paths, build_resource_list=False,
+                                    commit=False)
+            if outfile is not None:
+                writer = self.change_list_writer(outfile, links)
+                writer.read_index()
+                writer.append(changes)
+                rlb.commit()
+                logger.info("Appended %d changes to change list %s",
+                            len(changes), outfile)
+                return changes
+            cl = self.read_published_changelist(changelist_sitemap)
+            if links is not None:
+                cl.ln = links
+            for r in changes:
+                cl.add(r)
+            cl = self.write_changelist(cl, outfile)
+            rlb.commit()
+            return cl
+        finally:
+            rlb.close()
+
+    def read_published_changelist(self, changelist_sitemap):
+        """ Read the ChangeList already published at changelist_sitemap
+
+        If scan_state_file is set then the change list is written by a
+        ChangeListWriter as a sitemapindex of segments, so the segments
+        are always read to get the published changes. Otherwise, unless
+        allow_multifile is set, only a single sitemap is read.
+        """
+        cl = ChangeList()
+        cl.mapper = self.mapper
+        index_only = (not self.allow_multifile and
+                      self.scan_state_file is None)
+        cl.read(uri=changelist_sitemap, index_only=index_only)
+        return cl
+
+    def change_list_writer(self, outfile, links=None):
+        """ ChangeListWriter for the segmented change list at outfile """
+        writer = ChangeListWriter(outfile, self.mapper,
+                                  segment_window=self.segment_window, ln=links)
+        writer.pretty_xml = self.pretty_xml
+        if (self.max_sitemap_entries is not None):
+            writer.max_sitemap_entries = self.max_sitemap_entries
+        return writer
+
+    def write_changelist(self, cl, outfile=None):
         # 4. Write out change list
         cl.mapper = self.mapper
         cl.pretty_xml = self.pretty_xml
@@ -99,5 +231,3 @@ class ResourceSyncPublisherClient(Client):
         else:
             cl.write(basename=outfile)
         return(cl)
-
-
@@ -4,7 +4,11 @@ import io
 import os
 import unittest
 import contextlib
+import shutil
+import tempfile
 
+from resync.change_list import ChangeList
+from resync.mapper import MapperError
 from resync_publisher.ehri_client import ResourceSyncPublisherClient
 
 
@@ -55,6 +59,155 @@ class TestClient(unittest.TestCase):
             re.search(r'<url><loc>http://example.com/res2.pdf</loc>',
                       capturer.result))
 
+    def test51_incremental_changelist(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data = os.path.join(tmpdir, 'data')
+            os.mkdir(data)
+            for name in ('a', 'b'):
+                with open(os.path.join(data, name), 'w') as fh:
+                    fh.write(name)
+            rl_file = os.path.join(tmpdir, 'resourcelist.xml')
+            cl_file = os.path.join(tmpdir, 'changelist.xml')
+            c = ResourceSyncPublisherClient()
+            c.set_mappings(['http://example.org/', tmpdir])
+            c.scan_state_file = os.path.join(tmpdir, 'state.sqlite')
+            c.max_sitemap_entries = 3
+
+            def calculate():
+                return c.calculate_changelist(
+                    paths=data, outfile=cl_file,
+                    resource_sitemap='file://' + rl_file,
+                    changelist_sitemap='file://' + cl_file)
+
+            def read_changelist():
+                cl = ChangeList(mapper=c.mapper)
+                cl.read(uri='file://' + cl_file)
+                return sorted((r.uri, r.change) for r in cl)
+
+            # first run calculates everything and records the state
+            calculate()
+            self.assertEqual(read_changelist(),
+                             [('http://example.org/data/a', 'created'),
+                              ('http://example.org/data/b', 'created')])
+            # no changes
+            self.assertEqual(len(calculate()), 0)
+            # new and deleted files are appended, in a new segment once
+            # the first is full
+            for name in ('c', 'd'):
+                with open(os.path.join(data, name), 'w') as fh:
+                    fh.write(name)
+            os.unlink(os.path.join(data, 'b'))
+            self.assertEqual(len(calculate()), 3)
+            self.assertEqual(read_changelist(),
+                             [('http://example.org/data/a', 'created'),
+                              ('http://example.org/data/b', 'created'),
+                              ('http://example.org/data/b', 'deleted'),
+                              ('http://example.org/data/c', 'created'),
+                              ('http://example.org/data/d', 'created')])
+            self.assertTrue(
+                os.path.exists(os.path.join(tmpdir, 'changelist00001.xml')))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test52_state_loss(self):
+        self.check_state_loss(allow_multifile=True)
+
+    def test53_state_loss_not_multifile(self):
+        # the segments are read even though the index is not followed
+        # for other change lists
+        self.check_state_loss(allow_multifile=False)
+
+    def test54_failed_write_keeps_changes(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data = os.path.join(tmpdir, 'data')
+            os.mkdir(data)
+            with open(os.path.join(data, 'a'), 'w') as fh:
+                fh.write('a')
+            rl_file = os.path.join(tmpdir, 'resourcelist.xml')
+            cl_file = os.path.join(tmpdir, 'changelist.xml')
+            c = ResourceSyncPublisherClient()
+            c.set_mappings(['http://example.org/', tmpdir])
+            c.scan_state_file = os.path.join(tmpdir, 'state.sqlite')
+
+            def calculate(outfile=cl_file):
+                return c.calculate_changelist(
+                    paths=data, outfile=outfile,
+                    resource_sitemap='file://' + rl_file,
+                    changelist_sitemap='file://' + cl_file)
+
+            # segments outside the mappings have no URI so the write
+            # fails, first with no state and then with state
+            other = tempfile.mkdtemp()
+            try:
+                bad = os.path.join(other, 'changelist.xml')
+                self.assertRaises(MapperError, calculate, bad)
+                self.assertEqual([(r.uri, r.change) for r in calculate()],
+                                 [('http://example.org/data/a', 'created')])
+                with open(os.path.join(data, 'b'), 'w') as fh:
+                    fh.write('b')
+                self.assertRaises(MapperError, calculate, bad)
+            finally:
+                shutil.rmtree(other)
+            # the changes are not lost
+            self.assertEqual([(r.uri, r.change) for r in calculate()],
+                             [('http://example.org/data/b', 'created')])
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def check_state_loss(self, allow_multifile):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            data = os.path.join(tmpdir, 'data')
+            os.mkdir(data)
+            for name in ('a', 'b', 'c', 'd'):
+                with open(os.path.join(data, name), 'w') as fh:
+                    fh.write(name)
+            rl_file = os.path.join(tmpdir, 'resourcelist.xml')
+            cl_file = os.path.join(tmpdir, 'changelist.xml')
+            state = os.path.join(tmpdir, 'state.sqlite')
+            c = ResourceSyncPublisherClient()
+            c.set_mappings(['http://example.org/', tmpdir])
+            c.scan_state_file = state
+            c.max_sitemap_entries = 3
+            c.allow_multifile = allow_multifile
+
+            def calculate():
+                return c.calculate_changelist(
+                    paths=data, outfile=cl_file,
+                    resource_sitemap='file://' + rl_file,
+                    changelist_sitemap='file://' + cl_file)
+
+            calculate()
+            os.unlink(os.path.join(data, 'b'))
+            self.assertEqual(len(calculate()), 1)
+            closed = os.path.join(tmpdir, 'changelist00000.xml')
+            with open(closed, 'rb') as fh:
+                closed_xml = fh.read()
+            # with the state lost the full calculation is done again but
+            # only the changes not already published are appended
+            os.unlink(state)
+            with open(os.path.join(data, 'e'), 'w') as fh:
+                fh.write('e')
+            self.assertEqual([(r.uri, r.change) for r in calculate()],
+                             [('http://example.org/data/e', 'created')])
+            with open(closed, 'rb') as fh:
+                self.assertEqual(fh.read(), closed_xml)
+            cl = ChangeList(mapper=c.mapper)
+            cl.read(uri='file://' + cl_file)
+            self.assertEqual(sorted((r.uri, r.change) for r in cl),
+                             [('http://example.org/data/a', 'created'),
+                              ('http://example.org/data/b', 'created'),
+                              ('http://example.org/data/b', 'deleted'),
+                              ('http://example.org/data/c', 'created'),
+                              ('http://example.org/data/d', 'created'),
+                              ('http://example.org/data/e', 'created')])
+            # the state is recorded again
+            self.assertEqual(len(calculate()), 0)
+        finally:
+            shutil.rmtree(tmpdir)
+
 if __name__ == '__main__':
     suite = unittest.TestLoader().loadTestsFromTestCase(TestClient)
     unittest.TextTestRunner(verbosity=2).run(suite)